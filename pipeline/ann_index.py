@@ -0,0 +1,222 @@
+import os
+import glob
+import json
+import numpy as np
+
+from pipeline.utils import inverse_norms
+
+
+class IVFIndex:
+    """
+    An inverted file index for approximate nearest neighbour search over word vectors.
+    The normalized vectors are clustered around centroids (spherical k-means) and the ids of
+    each cluster are stored as one contiguous list. A query only scans the lists of its
+    `nprobe` closest centroids instead of the full vocabulary.
+    """
+
+    ARRAYS = ["centroids", "ids", "offsets"]
+
+    def __init__(self, centroids: np.ndarray, ids: np.ndarray, offsets: np.ndarray):
+        """
+        Parameters
+        ----------
+        centroids : np.ndarray
+            The normalized centroid of each list.
+        ids : np.ndarray
+            The vector ids ordered by list.
+        offsets : np.ndarray
+            The boundaries of each list within `ids`.
+        """
+        self.centroids = centroids
+        self.ids = ids
+        self.offsets = offsets
+
+
+    @staticmethod
+    def get_paths(model_path: str) -> dict:
+        """
+        Get the paths of the index files that are persisted next to a model file.
+        """
+        return {name: f"{model_path}.ivf.{name}.npy" for name in IVFIndex.ARRAYS}
+
+
+    @staticmethod
+    def get_meta_path(model_path: str) -> str:
+        """
+        Get the path of the file that records which model an index was built for.
+        """
+        return f"{model_path}.ivf.meta.json"
+
+
+    @staticmethod
+    def fingerprint(model_path: str) -> str:
+        """
+        Compute a fingerprint of a model from the size and modification time of the model file and of the arrays
+        gensim stores next to it (e.g. model.vectors.npy). Quantized copies and the index itself are not part of it.
+        """
+        files = [model_path] + sorted(glob.glob(glob.escape(model_path) + ".vectors*.npy"))
+        return json.dumps([(os.path.basename(f), os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in files])
+
+
+    @classmethod
+    def exists(cls, model_path: str) -> bool:
+        """
+        Check whether an index has been built for the given model file.
+        """
+        return all(os.path.exists(path) for path in cls.get_paths(model_path).values())
+
+
+    @classmethod
+    def load(cls, model_path: str, count: int = None) -> "IVFIndex":
+        """
+        Load the index of a model file. The arrays are memory-mapped. An index that was built for another
+        version of the model, or for another number of vectors, is rejected, because its ids would be wrong.
+
+        Parameters
+        ----------
+        model_path : str
+            The path of the model file.
+        count : int
+            If set, the number of vectors of the loaded model.
+
+        Returns
+        -------
+        index : IVFIndex
+            The index of the model.
+        """
+        if not cls.exists(model_path):
+            raise FileNotFoundError(f"No index found for {model_path} - build it with scripts/model_loader.build_index")
+
+        meta = None
+        if os.path.exists(cls.get_meta_path(model_path)):
+            with open(cls.get_meta_path(model_path), "r", encoding="utf-8") as file:
+                meta = json.load(file)
+
+        if meta is None or meta["fingerprint"] != cls.fingerprint(model_path) or (count is not None and meta["count"] != count):
+            raise ValueError(f"The index of {model_path} does not match the model - rebuild it with scripts/model_loader.build_index")
+
+        arrays = {name: np.load(path, mmap_mode='r') for name, path in cls.get_paths(model_path).items()}
+        return cls(**arrays)
+
+
+    def save(self, model_path: str) -> None:
+        """
+        Persist the index next to the model file, together with the number of vectors and the fingerprint of the model.
+        """
+        for name, path in self.get_paths(model_path).items():
+            np.save(path, getattr(self, name))
+
+        with open(self.get_meta_path(model_path), "w", encoding="utf-8") as file:
+            json.dump({"count": len(self.ids), "fingerprint": self.fingerprint(model_path)}, file)
+
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, inv_norms: np.ndarray, n_lists: int = None, n_iter: int = 10,
+              sample_size: int = 200000, batch_size: int = 10000, seed: int = 0) -> "IVFIndex":
+        """
+        Build the index by training the centroids on a sample of the vectors and assigning
+        every vector to its closest centroid.
+
+        Parameters
+        ----------
+        vectors : np.ndarray
+            The (unnormalized) word vectors.
+        inv_norms : np.ndarray
+            The inverse L2-norm of each vector.
+        n_lists : int
+            The number of lists. Defaults to 4 * sqrt(number of vectors).
+        n_iter : int
+            The number of k-means iterations.
+        sample_size : int
+            The number of vectors the centroids are trained on.
+        batch_size : int
+            The number of vectors assigned at once.
+        seed : int
+            The seed for sampling.
+
+        Returns
+        -------
+        index : IVFIndex
+            The built index.
+        """
+        rng = np.random.default_rng(seed)
+        n_lists = n_lists or int(4 * np.sqrt(len(vectors)))
+
+        # train on a normalized sample of the vocabulary
+        sample = np.sort(rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False))
+        data = vectors[sample] * inv_norms[sample, np.newaxis]
+        centroids = data[rng.choice(len(data), n_lists, replace=False)].astype(np.float32)
+
+        for _ in range(n_iter):
+            assignment = cls._assign(data, centroids, batch_size)
+
+            # sum up the members of each list, empty lists keep their previous centroid
+            order = np.argsort(assignment, kind="stable")
+            counts = np.bincount(assignment, minlength=n_lists)
+            filled = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+            sums = np.add.reduceat(data[order], starts, axis=0)
+
+            # lists of zero vectors only have no direction, their centroid stays zero
+            centroids[filled] = sums * inverse_norms(np.linalg.norm(sums, axis=1))[:, np.newaxis]
+
+        # the norm of a vector does not change its closest centroid
+        assignment = cls._assign(vectors, centroids, batch_size)
+
+        ids = np.argsort(assignment, kind="stable").astype(np.int32)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=n_lists))
+
+        return cls(centroids, ids, offsets)
+
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, batch_size: int) -> np.ndarray:
+        """
+        Assign each vector to the centroid with the highest dot product.
+        """
+        assignment = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), batch_size):
+            assignment[start:start + batch_size] = np.argmax(vectors[start:start + batch_size] @ centroids.T, axis=1)
+        return assignment
+
+
+    def search(self, vectors: np.ndarray, inv_norms: np.ndarray, queries: np.ndarray, n: int, nprobe: int, exclude: np.ndarray) -> list[np.ndarray]:
+        """
+        Find the approximate n nearest neighbours by cosine similarity for each query.
+
+        Parameters
+        ----------
+        vectors : np.ndarray
+            The word vectors the index was built for.
+        inv_norms : np.ndarray
+            The inverse L2-norm of each vector.
+        queries : np.ndarray
+            The normalized query vectors.
+        n : int
+            The number of neighbours returned per query.
+        nprobe : int
+            The number of lists scanned per query. Trades recall for latency.
+        exclude : np.ndarray
+            For each query, a vector id that must not be returned.
+
+        Returns
+        -------
+        neighbours : list[np.ndarray]
+            The ids of the neighbours of each query, ordered by similarity.
+        """
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        neighbours = []
+        for query, lists, excluded in zip(queries, probes, exclude):
+            candidates = np.concatenate([self.ids[self.offsets[l]:self.offsets[l + 1]] for l in lists])
+            candidates = candidates[candidates != excluded]
+
+            scores = (vectors[candidates] @ query) * inv_norms[candidates]
+
+            k = min(n, len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.int64)
+            neighbours.append(candidates[top[np.argsort(-scores[top])]])
+
+        return neighbours
@@ -0,0 +1,137 @@
+import json
+import math
+import datetime
+
+from typing import Iterable, Iterator
+from json.encoder import encode_basestring
+from elasticsearch.helpers import BulkIndexError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_value(value: any) -> str:
+    """
+    Encode a value of a database row as JSON, like the serializer of the Elastic Search client does.
+    NaN and infinity are not valid JSON, they are encoded as null like orjson does.
+    """
+    if value is None:
+        return "null"
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, float):
+        return float.__repr__(value) if math.isfinite(value) else "null"
+    if isinstance(value, (datetime.date, datetime.time)):
+        return '"' + value.isoformat() + '"'
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(encode_value(item) for item in value) + "]"
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class NDJSONSerializer:
+    """
+    Serializes database rows of a fixed shape directly into the lines of bulk index actions, without building
+    a dictionary per row. The document is serialized with orjson if it is installed, otherwise with a template
+    of the document that is compiled once.
+    """
+
+    def __init__(self, attributes: list[str], use_orjson: bool = True):
+        """
+        Parameters
+        ----------
+        attributes : list[str]
+            The name of each column of the rows, the column `_id` holds the id of the document.
+        use_orjson : bool
+            Whether orjson is used if it is installed.
+        """
+        self.id_position = attributes.index("_id")
+        self.positions = [i for i, attr in enumerate(attributes) if attr != "_id"]
+        self.names = [attributes[i] for i in self.positions]
+        self.use_orjson = use_orjson and orjson is not None
+
+        # e.g. {"retweet_count":%s,"txt":%s}, the names are escaped once
+        self.template = "{" + ",".join(encode_basestring(name) + ":%s" for name in self.names) + "}"
+
+
+    def dumps(self, row: tuple) -> bytes:
+        """
+        Serialize a row into the action and the document line of a bulk request.
+        """
+        action = '{"index":{"_id":' + encode_basestring(str(row[self.id_position])) + '}}\n'
+
+        if self.use_orjson:
+            document = orjson.dumps(dict(zip(self.names, [row[i] for i in self.positions])))
+        else:
+            document = (self.template % tuple(encode_value(row[i]) for i in self.positions)).encode("utf-8")
+
+        return action.encode("utf-8") + document + b"\n"
+
+
+def iterate_rows(cursor, size: int = 1000) -> Iterator[tuple]:
+    """
+    An iterator that returns the rows of a database cursor as they are, fetched in batches.
+    """
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        yield from rows
+
+
+def bulk_rows(client, index: str, rows: Iterable[tuple], serializer: NDJSONSerializer, chunk_size: int = 500,
+              max_chunk_bytes: int = 100 * 2**20) -> Iterator[tuple[int, int, tuple]]:
+    """
+    Index rows with pre-serialized bulk requests of at most `chunk_size` documents and `max_chunk_bytes` bytes.
+
+    Parameters
+    ----------
+    client : elasticsearch.Elasticsearch
+        The client to send the requests with.
+    index : str
+        The name of the index.
+    rows : Iterable[tuple]
+        The rows to index.
+    serializer : NDJSONSerializer
+        The serializer of the rows.
+    chunk_size : int
+        The maximum number of documents per request.
+    max_chunk_bytes : int
+        The maximum size of a request in bytes.
+
+    Returns
+    -------
+    chunks : Iterator[tuple[int, int, tuple]]
+        The number of documents, the number of bytes and the last row of each request, once it succeeded.
+
+    Raises
+    ------
+    BulkIndexError
+        If documents of a request could not be indexed.
+    """
+    lines, size, last = [], 0, None
+
+    def send():
+        res = client.bulk(index=index, operations=b"".join(lines))
+        if res["errors"]:
+            errors = [item for item in res["items"] if "error" in next(iter(item.values()))]
+            raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+        return len(lines), size, last
+
+    for row in rows:
+        line = serializer.dumps(row)
+        if lines and (len(lines) >= chunk_size or size + len(line) > max_chunk_bytes):
+            yield send()
+            lines, size = [], 0
+
+        lines.append(line)
+        size += len(line)
+        last = row
+
+    if lines:
+        yield send()
@@ -0,0 +1,440 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LRUCache:
+    """
+    A bounded in-memory mapping that evicts the least recently used entries.
+    Hits and misses are counted to help sizing the cache. This class is thread-safe.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        """
+        Parameters
+        ----------
+        maxsize : int
+            The maximum number of entries, or the maximum total weight if entries are weighted.
+        """
+        self.maxsize = maxsize
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._weights = {}
+        self._lock = threading.Lock()
+
+
+    def get(self, key, default=None):
+        """
+        Get the value of a key and mark it as recently used.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+
+    def put(self, key, value, weight: int = 1) -> None:
+        """
+        Insert or update a key and evict the least recently used entries if the cache is full.
+        An entry that alone exceeds the maximum weight is not kept.
+        """
+        with self._lock:
+            self.weight += weight - self._weights.get(key, 0)
+            self._data[key] = value
+            self._weights[key] = weight
+            self._data.move_to_end(key)
+            while self.weight > self.maxsize:
+                evicted, _ = self._data.popitem(last=False)
+                self.weight -= self._weights.pop(evicted)
+
+
+    def discard(self, predicate) -> None:
+        """
+        Remove all entries whose key satisfies the predicate.
+        """
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+                self.weight -= self._weights.pop(key)
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._weights.clear()
+            self.weight = 0
+
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+    def stats(self) -> dict:
+        """
+        Get the size and the hit/miss counters of the cache.
+        """
+        return {"size": len(self._data), "weight": self.weight, "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class SimilarTermsCache:
+    """
+    A cache for similar terms keyed on (model file, term, n). It consists of an in-process LRU front
+    and an optional SQLite back which survives across runs and can be shared by several processes.
+    Entries of a model are invalidated automatically when its files change.
+    """
+
+    def __init__(self, path: str = None, maxsize: int = 100000):
+        """
+        Parameters
+        ----------
+        path : str
+            The path of the SQLite database. If not set, only the in-process cache is used.
+        maxsize : int
+            The maximum number of entries of the in-process cache.
+        """
+        self.path = path
+        self.memory = LRUCache(maxsize)
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        self._db = None
+
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # autocommit mode, transactions are opened explicitly
+            self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS models (model TEXT PRIMARY KEY, fingerprint TEXT)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS similar_terms ("
+                "model TEXT, variant TEXT, term TEXT, n INTEGER, terms TEXT, "
+                "PRIMARY KEY (model, variant, term, n))"
+            )
+
+
+    @staticmethod
+    def fingerprint(model: str) -> str:
+        """
+        Compute a fingerprint of a model from the size and modification time of all its files,
+        i.e. the model file itself and the arrays stored next to it.
+        """
+        files = sorted(glob.glob(glob.escape(model) + "*"))
+        return json.dumps([(f, os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in files])
+
+
+    def _validate(self, model: str) -> None:
+        """
+        Drop all entries of a model if its files changed since the entries were stored.
+        """
+        fingerprint = self.fingerprint(model)
+        if self._fingerprints.get(model) == fingerprint:
+            return
+
+        self.memory.discard(lambda key: key[0] == model)
+
+        if self._db is not None:
+            with self._lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._db.execute("SELECT fingerprint FROM models WHERE model = ?", (model,)).fetchone()
+                    if row is None or row[0] != fingerprint:
+                        self._db.execute("DELETE FROM similar_terms WHERE model = ?", (model,))
+                        self._db.execute("INSERT OR REPLACE INTO models VALUES (?, ?)", (model, fingerprint))
+                    self._db.execute("COMMIT")
+                except Exception:
+                    self._db.execute("ROLLBACK")
+                    raise
+
+        self._fingerprints[model] = fingerprint
+
+
+    def get_many(self, model: str, terms: list[str], n: int, variant: str = "") -> dict:
+        """
+        Get the cached similar terms of the given terms.
+
+        Parameters
+        ----------
+        model : str
+            The path of the model file.
+        terms : list[str]
+            The terms to look up.
+        n : int
+            The number of similar terms.
+        variant : str
+            Distinguishes results of different search methods on the same model.
+
+        Returns
+        -------
+        similar_terms : dict
+            The similar terms of all terms that are cached.
+        """
+        self._validate(model)
+
+        found = {}
+        missing = []
+        for term in terms:
+            similar = self.memory.get((model, variant, term, n))
+            if similar is not None:
+                found[term] = similar
+            else:
+                missing.append(term)
+
+        if self._db is not None and missing:
+            rows = []
+            with self._lock:
+                # stay below the maximum number of host parameters of SQLite
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    rows += self._db.execute(
+                        f"SELECT term, terms FROM similar_terms WHERE model = ? AND variant = ? AND n = ? AND term IN ({','.join('?' * len(chunk))})",
+                        (model, variant, n, *chunk),
+                    ).fetchall()
+
+            for term, similar in rows:
+                found[term] = json.loads(similar)
+                self.memory.put((model, variant, term, n), found[term])
+
+            self.disk_hits += len(rows)
+            self.disk_misses += len(missing) - len(rows)
+
+        return found
+
+
+    def put_many(self, model: str, similar_terms: dict, n: int, variant: str = "") -> None:
+        """
+        Store the similar terms of several terms.
+
+        Parameters
+        ----------
+        model : str
+            The path of the model file.
+        similar_terms : dict
+            The similar terms of each term.
+        n : int
+            The number of similar terms.
+        variant : str
+            Distinguishes results of different search methods on the same model.
+        """
+        for term, similar in similar_terms.items():
+            self.memory.put((model, variant, term, n), similar)
+
+        if self._db is not None and similar_terms:
+            rows = [(model, variant, term, n, json.dumps(similar, ensure_ascii=False)) for term, similar in similar_terms.items()]
+            with self._lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    self._db.executemany("INSERT OR REPLACE INTO similar_terms VALUES (?, ?, ?, ?, ?)", rows)
+                    self._db.execute("COMMIT")
+                except Exception:
+                    self._db.execute("ROLLBACK")
+                    raise
+
+
+    def stats(self) -> dict:
+        """
+        Get the hit/miss counters of the in-process and the on-disk cache.
+        """
+        return {"memory": self.memory.stats(), "disk": {"hits": self.disk_hits, "misses": self.disk_misses}}
+
+
+class ResultCache:
+    """
+    A cache for search results keyed on a canonical hash of the index and the request body. The results are
+    stored serialized as JSON and every lookup returns a new copy, hence callers may modify the results they get.
+    The cache is bounded by the serialized size of the results with LRU eviction. An entry is fresh as long as the generation of the index
+    did not change since it was stored and it is younger than `max_age`. Optionally, stale entries are served while
+    they are refreshed in the background. This class is thread-safe.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2**20, max_age: float = None, stale_while_revalidate: bool = False, refresh_workers: int = 2):
+        """
+        Parameters
+        ----------
+        max_bytes : int
+            The maximum total size of the serialized results.
+        max_age : float
+            The maximum age of a fresh entry in seconds. If not set, entries are fresh until the index changes.
+        stale_while_revalidate : bool
+            Whether stale entries are served while they are refreshed in the background.
+        refresh_workers : int
+            The number of threads refreshing stale entries.
+        """
+        self.max_age = max_age
+        self.stale_while_revalidate = stale_while_revalidate
+        self.entries = LRUCache(max_bytes)
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.saved_latency = 0.0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="result-cache") if stale_while_revalidate else None
+
+
+    @staticmethod
+    def get_key(index: str, body: dict) -> str:
+        """
+        Compute the canonical key of a request, i.e. the hash of the index and the body serialized with sorted keys.
+        """
+        canonical = json.dumps([index, body], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+    def lookup(self, key: str, generation: int = None, refresh=None):
+        """
+        Get a cached result. A stale result is only returned if stale results may be served, then it is
+        refreshed in the background by calling `refresh`.
+
+        Parameters
+        ----------
+        key : str
+            The key of the request.
+        generation : int
+            The current generation of the index.
+        refresh : func
+            Computes the result again, required to refresh stale results.
+
+        Returns
+        -------
+        result : any
+            The cached result or None.
+        """
+        entry = self.entries.get(key)
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+
+            serialized, entry_generation, stored, latency = entry
+            if entry_generation == generation and (self.max_age is None or time.monotonic() - stored < self.max_age):
+                self.hits += 1
+                self.saved_latency += latency
+                return json.loads(serialized)
+
+            if not self.stale_while_revalidate or refresh is None:
+                self.misses += 1
+                return None
+
+            self.stale_hits += 1
+            self.saved_latency += latency
+            if key in self._refreshing:
+                return json.loads(serialized)
+            self._refreshing.add(key)
+
+        self._executor.submit(self._refresh, key, generation, refresh)
+        return json.loads(serialized)
+
+
+    def put(self, key: str, value, generation: int = None, latency: float = 0.0) -> None:
+        """
+        Store a copy of a result.
+
+        Parameters
+        ----------
+        key : str
+            The key of the request.
+        value : any
+            The JSON serializable result.
+        generation : int
+            The generation of the index the result was computed on.
+        latency : float
+            The time it took to compute the result in seconds, which is saved by every hit.
+        """
+        serialized = json.dumps(value, ensure_ascii=False)
+        self.entries.put(key, (serialized, generation, time.monotonic(), latency), weight=len(serialized))
+
+
+    def fetch(self, key: str, compute, generation: int = None):
+        """
+        Get a cached result or compute and store it.
+
+        Parameters
+        ----------
+        key : str
+            The key of the request.
+        compute : func
+            Computes the result.
+        generation : int
+            The current generation of the index.
+
+        Returns
+        -------
+        result : any
+            The result.
+        """
+        value = self.lookup(key, generation, compute)
+        if value is not None:
+            return value
+
+        start = time.perf_counter()
+        value = compute()
+        self.put(key, value, generation, time.perf_counter() - start)
+        return value
+
+
+    def _refresh(self, key: str, generation: int, refresh) -> None:
+        """
+        Compute a stale result again and store it.
+        """
+        try:
+            start = time.perf_counter()
+            value = refresh()
+            self.put(key, value, generation, time.perf_counter() - start)
+            with self._lock:
+                self.refreshes += 1
+        except Exception as e:
+            print("Error while refreshing a cached result", e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+    def close(self) -> None:
+        """
+        Wait for running refreshes and stop the background threads.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+    def stats(self) -> dict:
+        """
+        Get the hit rate, the latency saved by hits and the size of the cache.
+        """
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self.entries),
+            "bytes": self.entries.weight,
+            "max_bytes": self.entries.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            "saved_latency_s": self.saved_latency,
+        }
@@ -0,0 +1,239 @@
+import os
+import json
+import numpy as np
+
+from typing import Iterable
+
+from pipeline.utils import split_words, npmi
+
+
+class CooccurrenceMatrix:
+    """
+    A sparse term/term matrix counting the documents in which two terms occur together, built from the
+    tweets at ingest time. It allows to score candidate pairs locally instead of running adjacency matrix
+    aggregations. The upper triangle of the matrix is stored in CSR form and memory-mapped at load.
+    """
+
+    ARRAYS = ["indptr", "indices", "data", "doc_freq"]
+
+    def __init__(self, vocabulary: list[str], indptr: np.ndarray, indices: np.ndarray, data: np.ndarray,
+                 doc_freq: np.ndarray, total_word_count: int):
+        """
+        Parameters
+        ----------
+        vocabulary : list[str]
+            The terms of the matrix.
+        indptr : np.ndarray
+            The boundaries of each row within `indices` and `data`.
+        indices : np.ndarray
+            The column of each non-zero entry, sorted within each row.
+        data : np.ndarray
+            The number of documents of each non-zero entry.
+        doc_freq : np.ndarray
+            The number of documents of each term.
+        total_word_count : int
+            The total number of words in the corpus.
+        """
+        self.vocabulary = vocabulary
+        self.term_to_id = {term: i for i, term in enumerate(vocabulary)}
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.doc_freq = doc_freq
+        self.total_word_count = total_word_count
+
+
+    @classmethod
+    def build(cls, rows: Iterable[tuple[str, int]], min_count: int = 5, max_vocab: int = 200000,
+              buffer_size: int = 20000000) -> "CooccurrenceMatrix":
+        """
+        Build the matrix from a stream of documents in two passes. The first pass counts the document frequency
+        of each term and prunes the vocabulary to the most frequent terms. The second pass encodes the pairs of
+        pruned terms of each document as integers, buffers them and merges them into sorted unique pairs with
+        counts whenever the buffer is full. Hence memory is bounded by the pairs of the pruned vocabulary.
+
+        Parameters
+        ----------
+        rows : Iterable[tuple[str, int]]
+            The text and the word count of each document. It is iterated twice, e.g. a list or an object which
+            reads the documents again on each iteration, but not an iterator.
+        min_count : int
+            The minimum number of documents of a term.
+        max_vocab : int
+            The maximum number of terms.
+        buffer_size : int
+            The number of pairs buffered before merging.
+
+        Returns
+        -------
+        matrix : CooccurrenceMatrix
+            The co-occurrence matrix.
+        """
+        if iter(rows) is rows:
+            raise TypeError("The documents are read twice, pass a list or an iterable which can be iterated again")
+
+        # first pass, count the documents of each term
+        doc_freq = {}
+        total_word_count = 0
+        for text, word_count in rows:
+            total_word_count += word_count or 0
+            for term in set(split_words(text or "")):
+                doc_freq[term] = doc_freq.get(term, 0) + 1
+
+        # keep the most frequent terms, ordered by their document frequency, ties by their first occurrence
+        vocabulary = list(doc_freq)
+        counts = np.fromiter(doc_freq.values(), dtype=np.int64, count=len(doc_freq))
+        keep = np.argsort(-counts, kind="stable")[:max_vocab]
+        keep = keep[counts[keep] >= min_count]
+
+        vocabulary = [vocabulary[i] for i in keep]
+        term_to_id = {term: i for i, term in enumerate(vocabulary)}
+        del doc_freq
+
+        pair_codes = np.empty(0, dtype=np.int64)
+        pair_counts = np.empty(0, dtype=np.int64)
+        buffer, buffered = [], 0
+        triangles = {}
+
+        def merge():
+            codes = np.concatenate([pair_codes] + buffer)
+            counts = np.concatenate([pair_counts, np.ones(buffered, dtype=np.int64)])
+            codes, inverse = np.unique(codes, return_inverse=True)
+            return codes, np.bincount(inverse.ravel(), weights=counts).astype(np.int64)
+
+        # second pass, count the pairs of pruned terms
+        for text, _ in rows:
+            ids = [term_to_id[term] for term in set(split_words(text or "")) if term in term_to_id]
+            if len(ids) < 2:
+                continue
+
+            # encode each pair (i, j) with i < j as i << 32 | j
+            ids = np.sort(np.array(ids, dtype=np.int64))
+            if len(ids) not in triangles:
+                triangles[len(ids)] = np.triu_indices(len(ids), 1)
+            i, j = triangles[len(ids)]
+            buffer.append((ids[i] << 32) | ids[j])
+            buffered += len(i)
+
+            if buffered >= buffer_size:
+                pair_codes, pair_counts = merge()
+                buffer, buffered = [], 0
+
+        if buffer:
+            pair_codes, pair_counts = merge()
+
+        # the codes are sorted, hence the pairs are ordered by row and column, the row is the smaller id
+        first, second = pair_codes >> 32, pair_codes & 0xFFFFFFFF
+
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(first, minlength=len(vocabulary)))
+
+        return cls(vocabulary, indptr, second.astype(np.int32), pair_counts.astype(np.int32), counts[keep], total_word_count)
+
+
+    @staticmethod
+    def get_paths(path: str) -> dict:
+        """
+        Get the paths of the files of a matrix stored in the directory `path`.
+        """
+        paths = {name: os.path.join(path, f"{name}.npy") for name in CooccurrenceMatrix.ARRAYS}
+        paths["vocabulary"] = os.path.join(path, "vocabulary.json")
+        paths["meta"] = os.path.join(path, "meta.json")
+        return paths
+
+
+    @classmethod
+    def load(cls, path: str) -> "CooccurrenceMatrix":
+        """
+        Load a matrix from a directory. The arrays are memory-mapped.
+        """
+        paths = cls.get_paths(path)
+
+        with open(paths["vocabulary"], "r", encoding="utf-8") as file:
+            vocabulary = json.load(file)
+        with open(paths["meta"], "r") as file:
+            meta = json.load(file)
+
+        arrays = {name: np.load(paths[name], mmap_mode='r') for name in cls.ARRAYS}
+        if len(vocabulary) != len(arrays["doc_freq"]):
+            raise ValueError(f"The vocabulary of {path} does not match its document frequencies, rebuild the matrix")
+
+        return cls(vocabulary, total_word_count=meta["total_word_count"], **arrays)
+
+
+    def save(self, path: str) -> None:
+        """
+        Save the matrix into a directory.
+        """
+        os.makedirs(path, exist_ok=True)
+        paths = self.get_paths(path)
+
+        # a JSON list, since terms might contain any character
+        with open(paths["vocabulary"], "w", encoding="utf-8") as file:
+            json.dump(list(self.vocabulary), file, ensure_ascii=False)
+        with open(paths["meta"], "w") as file:
+            json.dump({"total_word_count": int(self.total_word_count)}, file)
+
+        for name in self.ARRAYS:
+            np.save(paths[name], getattr(self, name))
+
+
+    def __contains__(self, term: str) -> bool:
+        return term.lower() in self.term_to_id
+
+
+    def get_ids(self, terms: list[str]) -> np.ndarray:
+        """
+        Map terms to their ids, -1 for terms which are not part of the vocabulary.
+        """
+        return np.array([self.term_to_id.get(term.lower(), -1) for term in terms], dtype=np.int64)
+
+
+    def get_joint_counts(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """
+        Get the number of documents in which the terms a[k] and b[k] occur together, for all k at once.
+        Pairs with unknown terms (id -1) have a count of 0.
+        """
+        rows, cols = np.minimum(a, b), np.maximum(a, b)
+        counts = np.zeros(len(rows), dtype=np.int64)
+
+        for row in np.unique(rows[rows >= 0]):
+            mask = rows == row
+            start, end = self.indptr[row], self.indptr[row + 1]
+
+            # the columns of a row are sorted
+            positions = np.searchsorted(self.indices[start:end], cols[mask])
+            found = positions < end - start
+            found[found] = self.indices[start:end][positions[found]] == cols[mask][found]
+
+            counts[np.flatnonzero(mask)[found]] = self.data[start:end][positions[found]]
+
+        return counts
+
+
+    def score(self, terms: list[str], synonyms: list[str], measure=npmi) -> np.ndarray:
+        """
+        Score all (term, synonym) pairs at once with some association measure.
+        All terms must be part of the vocabulary.
+
+        Parameters
+        ----------
+        terms : list[str]
+            The first term of each pair.
+        synonyms : list[str]
+            The second term of each pair.
+        measure : func
+            A function that exhibits some measure to calculate similarity of terms.
+
+        Returns
+        -------
+        scores : np.ndarray
+            The score of each pair, NaN if the terms never occur together.
+        """
+        a, b = self.get_ids(terms), self.get_ids(synonyms)
+        joint = self.get_joint_counts(a, b)
+
+        scores = np.full(len(a), np.nan)
+        found = joint > 0
+        scores[found] = measure(self.total_word_count, self.doc_freq[a[found]], self.doc_freq[b[found]], joint[found])
+        return scores
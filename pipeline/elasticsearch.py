@@ -1,50 +1,769 @@
+import asyncio
 import elasticsearch
 import json
+import time
+import numpy as np
 
-from pipeline.utils import pmi, npmi
+from typing import AsyncIterator, Iterator
 
-class ElasticsearchClient(elasticsearch.Elasticsearch):
+from pipeline.utils import pmi, npmi, dice, select_scores, TermCounts
+from pipeline.cache import ResultCache
+from pipeline.cooccurrence import CooccurrenceMatrix
+from pipeline.templates import load_template, assoc_in, dissoc_in, validate_search_params
+
+# maximum number of filters of an adjacency matrix aggregation (index.max_adjacency_matrix_filters)
+MAX_ADJACENCY_FILTERS = 100
+
+# number of terms counted per filters aggregation
+TERM_COUNT_BATCH_SIZE = 500
+
+# number of searches sent per multi search request
+MSEARCH_CHUNK_SIZE = 50
+
+# number of hits per page when streaming the tweets of a query
+STREAM_PAGE_SIZE = 1000
+
+# fields of the tweets returned when streaming
+STREAM_SOURCE_FIELDS = ["txt", "hashtags", "created_at"]
+
+# maximum number of requests the asynchronous client has in flight at once
+MAX_CONCURRENT_REQUESTS = 8
+
+# id of the document holding the corpus statistics in the statistics index
+STATISTICS_ID = "corpus"
+
+# measures which increase with the joint count of a pair, hence their score is bounded by the largest possible joint count
+MONOTONIC_MEASURES = (pmi, npmi, dice)
+
+
+def get_statistics_index(index: str) -> str:
+    """
+    Get the name of the index which holds the precomputed statistics of an index.
+    """
+    return f"{index}-stats"
+
+
+def parse_time_value(value: str) -> float:
+    """
+    Parse a time value of the index settings such as "500ms", "1s" or "-1" into seconds.
+    """
+    units = {"nanos": 1e-9, "micros": 1e-6, "ms": 1e-3, "s": 1, "m": 60, "h": 3600, "d": 86400}
+    value = str(value).strip()
+
+    for unit in sorted(units, key=len, reverse=True):
+        if value.endswith(unit):
+            return float(value[:-len(unit)]) * units[unit]
+    return float(value)
+
+
+def get_index_generation(client: elasticsearch.Elasticsearch, index: str) -> int:
+    """
+    Get the generation of an index, i.e. the sum of the maximum sequence numbers of its primary shards.
+    It increases with every indexed, updated or deleted document and is stable across restarts.
+    """
+    return sum_primary_seq_nos(client.indices.stats(index=index, level="shards"))
+
+
+async def get_index_generation_async(client: elasticsearch.AsyncElasticsearch, index: str) -> int:
+    """
+    Get the generation of an index with an asynchronous client, see `get_index_generation`.
+    """
+    return sum_primary_seq_nos(await client.indices.stats(index=index, level="shards"))
+
+
+def sum_primary_seq_nos(stats: json) -> int:
+    """
+    Sum up the maximum sequence numbers of the primary shards in the shard level stats of an index.
+    """
+    generation = 0
+    for index_stats in stats["indices"].values():
+        for copies in index_stats["shards"].values():
+            generation += sum(copy["seq_no"]["max_seq_no"] for copy in copies if copy["routing"]["primary"])
+    return generation
+
+
+def count_terms(client: elasticsearch.Elasticsearch, index: str, terms: list[str], query: json = None) -> dict:
+    """
+    Count the number of documents containing each term by using filters aggregations.
+
+    Parameters
+    ----------
+    client : elasticsearch.Elasticsearch
+        The client to connect with.
+    index : str
+        The name of the index.
+    terms : list[str]
+        The terms to count.
+    query : json
+        Restricts the counted documents, e.g. to recently ingested ones.
+
+    Returns
+    -------
+    counts : dict
+        The number of documents of each (lowercased) term.
+    """
+    counts = {}
+    for aggregations in compose_term_count_aggregations(terms):
+        res = client.search(index=index, size=0, query=query, aggregations=aggregations)
+        counts.update((term, bucket["doc_count"]) for term, bucket in res["aggregations"]["terms"]["buckets"].items())
+
+    return counts
+
+
+def compose_term_count_aggregations(terms: list[str]) -> list[json]:
+    """
+    Compose the filters aggregations counting the (lowercased) terms, TERM_COUNT_BATCH_SIZE terms each.
+    """
+    terms = list(dict.fromkeys(term.lower() for term in terms))
+
+    aggregations = []
+    for start in range(0, len(terms), TERM_COUNT_BATCH_SIZE):
+        filters = {term: {"term": {"txt": term}} for term in terms[start:start + TERM_COUNT_BATCH_SIZE]}
+        aggregations.append({"terms": {"filters": {"filters": filters}}})
+    return aggregations
+
+
+class ElasticsearchQueries:
+    """
+    The composition of queries and the scoring of expansion terms, shared by the synchronous and the asynchronous client.
+    Classes using it must set `_index`.
+    """
+
+    @staticmethod
+    def pack_similar_terms(similar_terms: list[json]) -> list[json]:
+        """
+        Pack the candidate and similar terms of several queries into as few chunks as possible,
+        each with at most MAX_ADJACENCY_FILTERS distinct terms. The terms are packed by term group, i.e. a candidate
+        term together with its similar terms, hence every pair is counted within one adjacency matrix. A group which
+        exceeds the limit on its own is split, the candidate term is repeated in each part.
+
+        Parameters
+        ----------
+        similar_terms: list[json]
+            The possible expansion terms of each query.
+
+        Returns
+        -------
+        chunks : list[json]
+            The similar terms of each chunk.
+        """
+        groups = []
+        for terms in similar_terms:
+            for term, synonyms in terms.items():
+                synonyms = list(dict.fromkeys(synonyms))
+                for start in range(0, len(synonyms), MAX_ADJACENCY_FILTERS - 1):
+                    groups.append((term, synonyms[start:start + MAX_ADJACENCY_FILTERS - 1]))
+
+        chunks = []
+        chunk, chunk_filters = {}, set()
+
+        for term, synonyms in groups:
+            filters = {term, *synonyms}
+            if chunk and len(chunk_filters | filters) > MAX_ADJACENCY_FILTERS:
+                chunks.append(chunk)
+                chunk, chunk_filters = {}, set()
+
+            chunk.setdefault(term, [])
+            chunk[term] += [synonym for synonym in synonyms if synonym not in chunk[term]]
+            chunk_filters |= filters
+
+        if chunk:
+            chunks.append(chunk)
+
+        return chunks
+
+
+    def statistics_expired(self, now: float) -> bool:
+        """
+        Whether the cached corpus statistics have to be revalidated against the index generation.
+        """
+        return self._statistics is None or now - self._statistics_checked >= self.statistics_ttl
+
+
+    @staticmethod
+    def statistics_outdated(statistics: json, generation: int) -> bool:
+        """
+        Whether corpus statistics are missing or belong to another generation of the index.
+        """
+        return statistics is None or statistics["generation"] != generation
+
+
+    @staticmethod
+    def compose_statistics(generation: int, total_word_count: int) -> json:
+        """
+        Compose the corpus statistics of an index without precomputed statistics, i.e. without known document frequencies.
+        """
+        return {"generation": generation, "total_word_count": total_word_count, "term_doc_freq": {}}
+
+
+    @staticmethod
+    def parse_word_count(res: json) -> int:
+        """
+        Get the total number of words from the response of the word count query.
+        """
+        return res["aggregations"]["total_word_count"]["value"]
+
+
+    @staticmethod
+    def parse_co_occurrences(res: json) -> json:
+        """
+        Get the document counts of the terms and of their pairs from the response of an adjacency matrix aggregation.
+        """
+        return {t["key"]: t["doc_count"] for t in res["aggregations"]["interactions"]["buckets"]}
+
+
+    def compose_aggregation_searches(self, chunks: list[json]) -> list[json]:
+        """
+        Compose the header and the adjacency matrix aggregation of each chunk of a multi search request.
+        """
+        searches = []
+        for chunk in chunks:
+            searches += [{"index": self._index}, self.compose_aggregation_query('templates/es-adjacency-matrix.tpl', chunk)]
+        return searches
+
+
+    def merge_co_occurrences(self, responses: list[json]) -> TermCounts:
+        """
+        Merge the buckets of several adjacency matrix aggregations. Failed aggregations are reported and skipped.
+        """
+        # the counts of a term are the same in every chunk, hence the chunks can be merged
+        co_occurrences = {}
+        for response in responses:
+            if "error" in response:
+                print("Error while executing aggregation query for index", self._index, response["error"])
+            else:
+                co_occurrences.update(self.parse_co_occurrences(response))
+
+        return TermCounts(co_occurrences)
+
+
+    def prepare_expansion_terms_batch(self, candidate_terms: list[list], similar_terms: list[json], statistics: json, threshold: float=.5,
+                                      measure=npmi, cooccurrences: CooccurrenceMatrix = None) -> tuple[list[tuple[list, np.ndarray]], list[json], list[json]]:
+        """
+        Score the pairs known to the co-occurrence matrix locally and compose the aggregations counting the remaining
+        pairs, which may reach the threshold according to the corpus statistics.
+
+        Returns
+        -------
+        batch : tuple[list[tuple[list, np.ndarray]], list[json], list[json]]
+            The local scores and the remaining similar terms of each query, and the searches of the multi search request.
+        """
+        scored = [([], np.empty(0)) for _ in similar_terms]
+        if cooccurrences is not None:
+            scored, similar_terms = self.score_local_expansion_terms(candidate_terms, similar_terms, cooccurrences, measure)
+
+        similar_terms = [
+            self.prune_similar_terms(terms, statistics["term_doc_freq"], statistics["total_word_count"], threshold, measure)
+            for terms in similar_terms
+        ]
+        return scored, similar_terms, self.compose_aggregation_searches(self.pack_similar_terms(similar_terms))
+
+
+    def collect_expansion_terms_batch(self, scored: list[tuple[list, np.ndarray]], candidate_terms: list[list], similar_terms: list[json],
+                                      responses: list[json], total_word_count: int, threshold: float=.5, measure=npmi, top_k: int = None) -> list[list]:
+        """
+        Score the remaining similar terms of each query with the counts of the aggregations and select the expansion terms.
+        """
+        if responses:
+            co_occurrences = self.merge_co_occurrences(responses)
+            self.add_expansion_scores(scored, candidate_terms, similar_terms, co_occurrences, total_word_count, measure)
+
+        return self.select_scored_terms(scored, threshold, top_k)
+
+
+    def add_expansion_scores(self, scored: list[tuple[list, np.ndarray]], candidate_terms: list[list], similar_terms: list[json],
+                             co_occurrences: TermCounts, total_word_count: int, measure=npmi) -> None:
+        """
+        Score the similar terms of each query with the merged counts and append them to the scores of the query.
+        """
+        for query, (candidates, terms) in enumerate(zip(candidate_terms, similar_terms)):
+            synonyms, scores = self.score_expansion_terms(candidates, terms, co_occurrences, total_word_count, measure)
+            scored[query] = (scored[query][0] + synonyms, np.concatenate([scored[query][1], scores]))
+
+
+    @staticmethod
+    def select_scored_terms(scored: list[tuple[list, np.ndarray]], threshold: float=.5, top_k: int = None) -> list[list]:
+        """
+        Select the expansion terms of each query from its scored similar terms.
+        """
+        expansion_terms = []
+        for synonyms, scores in scored:
+            expansion_terms.append([synonyms[i] for i in select_scores(scores, threshold, top_k)])
+        return expansion_terms
+
+
+    @staticmethod
+    def prune_similar_terms(similar_terms: json, doc_freq: dict, total_word_count: int, threshold: float = None, measure=npmi) -> json:
+        """
+        Drop the similar terms which can not be selected according to the document frequencies precomputed at
+        ingest time, hence they are not sent to Elastic Search. A pair can not be selected if one of its terms occurs
+        in no document or, for MONOTONIC_MEASURES, if it stays below the threshold even if the rarer term always
+        occurs together with the other one. Terms without a known document frequency are kept.
+
+        Parameters
+        ----------
+        similar_terms: json
+            The possible expansion terms.
+
+        doc_freq: dict
+            The number of documents of (lowercased) terms.
+
+        total_word_count: int
+            The total number of words in the index.
+
+        threshold: float
+            The threshold to include a term.
+
+        measure: func
+            A function that exhibits some measure to calculate similarity of terms.
+
+        Returns
+        -------
+        similar_terms : json
+            The possible expansion terms that may reach the threshold.
+        """
+        pairs = [
+            (term, synonym)
+            for term, synonyms in similar_terms.items() if term.lower() in doc_freq
+            for synonym in synonyms if synonym.lower() in doc_freq
+        ]
+        if not pairs:
+            return similar_terms
+
+        w1 = np.array([doc_freq[term.lower()] for term, _ in pairs], dtype=np.int64)
+        w2 = np.array([doc_freq[synonym.lower()] for _, synonym in pairs], dtype=np.int64)
+        joint = np.minimum(w1, w2)
+
+        # pairs that never occur together have a score of NaN
+        excluded = joint == 0
+        if threshold is not None and measure in MONOTONIC_MEASURES:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                excluded |= np.asarray(measure(total_word_count, w1, w2, joint), dtype=np.float64) < threshold
+
+        dropped = {pair for pair, exclude in zip(pairs, excluded) if exclude}
+        return {term: [synonym for synonym in synonyms if (term, synonym) not in dropped] for term, synonyms in similar_terms.items()}
+
+
+    def compose_search_bodies(self, searches: list[json]) -> list[json]:
+        """
+        Compose the header and the body of each search query of a multi search request.
+
+        Parameters
+        ----------
+        searches : list[json]
+            The parameters of each search query.
+
+        Returns
+        -------
+        bodies : list[json]
+            The header and body of each search, alternating.
+        """
+        bodies = []
+        for params in searches:
+            bodies += [{"index": self._index}, self.compose_search_body(params)]
+        return bodies
+
+
+    def compose_search_body(self, params: json) -> json:
+        """
+        Compose the body of the search request of a query, i.e. its size, query and aggregations.
+        """
+        query = self.compose_search_query('templates/es-query.tpl', params)
+        return {"size": query["size"], "query": query["query"], "aggs": query["aggs"]}
+
+
+    def collect_tweets_many(self, responses: list[json], indices: list[int]) -> list[json]:
+        """
+        Collect the tweets of each response of a multi search request. Failed searches are reported
+        and result in no tweets together with the error.
+
+        Parameters
+        ----------
+        responses : list[json]
+            The responses of the searches.
+        indices : list[int]
+            The position of each search within all queries, used for reporting.
+
+        Returns
+        -------
+        tweets : list[json]
+            The retrieved Tweets of each search.
+        """
+        results = []
+        for i, response in zip(indices, responses):
+            if "error" in response:
+                print(f"Error while executing search query {i} for index", self._index, response["error"])
+                results.append({"hits": 0, "took": response.get("took", 0), "tweets": [], "error": response["error"]})
+            else:
+                results.append(self.collect_tweets(response))
+        return results
+
+
+    def collect_failed_tweets(self, indices: list[int], error: elasticsearch.ApiError) -> list[json]:
+        """
+        Report a failed request and mark all of its searches, given by their position within all queries, as failed.
+        """
+        print(f"Error while executing search queries {indices} for index", self._index, error)
+        return [{"hits": 0, "took": 0, "tweets": [], "error": str(error)} for _ in indices]
+
+
+    @staticmethod
+    def collect_tweets(res: json) -> json:
+        """
+        Collect the number of hits, the duration and the tweets of a search response.
+        """
+        tweets = {}
+
+        # collect results
+        tweets["hits"] = res["hits"]["total"]["value"]
+        tweets["took"] = res["took"]
+        tweets["tweets"] = res["hits"]["hits"]
+
+        return tweets
+
+
+    @staticmethod
+    def score_local_expansion_terms(candidate_terms: list[list], similar_terms: list[json], cooccurrences: CooccurrenceMatrix,
+                                    measure=npmi) -> tuple[list[tuple[list, np.ndarray]], list[json]]:
+        """
+        Score all pairs of candidate and similar terms that are part of the co-occurrence matrix at once.
+
+        Parameters
+        ----------
+        candidate_terms: list[list]
+            The initial terms of each query.
+
+        similar_terms: list[json]
+            The possible expansion terms of each query.
+
+        cooccurrences: CooccurrenceMatrix
+            The co-occurrence matrix built at ingest time.
+
+        measure: func
+            A function that exhibits some measure to calculate similarity of terms.
+
+        Returns
+        -------
+        scored : tuple[list[tuple[list, np.ndarray]], list[json]]
+            The scored similar terms of each query and the similar terms that are left for Elastic Search,
+            because they are not part of the matrix.
+        """
+        pairs = []
+        remaining = []
+
+        for query, (candidates, terms) in enumerate(zip(candidate_terms, similar_terms)):
+            rest = {}
+            for term in candidates:
+                if term not in terms:
+                    continue
+
+                if term in cooccurrences:
+                    pairs += [(query, term, synonym) for synonym in terms[term] if synonym in cooccurrences]
+                    unknown = [synonym for synonym in terms[term] if synonym not in cooccurrences]
+                else:
+                    unknown = terms[term]
+
+                if unknown:
+                    rest[term] = unknown
+            remaining.append(rest)
+
+        # pairs that never occur together have a score of NaN
+        scores = cooccurrences.score([p[1] for p in pairs], [p[2] for p in pairs], measure) if pairs else np.empty(0)
+        queries = np.array([p[0] for p in pairs], dtype=np.int64)
+
+        scored = []
+        for query in range(len(similar_terms)):
+            indices = np.flatnonzero(queries == query)
+            scored.append(([pairs[i][2] for i in indices], scores[indices]))
+
+        return scored, remaining
+
+
+    @staticmethod
+    def score_expansion_terms(candidate_terms: list, similar_terms: json, co_occurrences: json, total_word_count: int, measure=npmi) -> tuple[list, np.ndarray]:
+        """
+        Score all pairs of candidate and similar terms with known counts at once.
+
+        Parameters
+        ----------
+        candidate_terms: list
+            The initial terms of the query.
+
+        similar_terms: json
+            The possible expansion terms.
+
+        co_occurrences: json
+            The document counts of the single terms and of the term pairs, either as returned
+            by the adjacency matrix aggregation or already indexed as `TermCounts`.
+
+        total_word_count: int
+            The total number of words in the index.
+
+        measure: func
+            A function that exhibits some measure to calculate similarity of terms.
+
+        Returns
+        -------
+        scored : tuple[list, np.ndarray]
+            The similar terms and their scores, NaN if they never occur together with their candidate term.
+        """
+        if not isinstance(co_occurrences, TermCounts):
+            co_occurrences = TermCounts(co_occurrences)
+
+        # the counts may stem from several queries, so the term itself might have no similar terms
+        pairs = [
+            (term, synonym)
+            for term in candidate_terms if term in co_occurrences and term in similar_terms
+            for synonym in similar_terms[term] if synonym in co_occurrences
+        ]
+        if not pairs:
+            return [], np.empty(0)
+
+        a = co_occurrences.get_ids([term for term, _ in pairs])
+        b = co_occurrences.get_ids([synonym for _, synonym in pairs])
+        joint = co_occurrences.get_joint_counts(a, b)
+
+        scores = np.asarray(measure(total_word_count, co_occurrences.counts[a], co_occurrences.counts[b], joint), dtype=np.float64)
+        scores[joint == 0] = np.nan
+
+        return [synonym for _, synonym in pairs], scores
+
+
+    @staticmethod
+    def select_expansion_terms(candidate_terms: list, similar_terms: json, co_occurrences: json, total_word_count: int, threshold: float=.5,
+                               measure=npmi, top_k: int = None) -> list:
+        """
+        Select the similar terms whose co-occurrence with their candidate term reaches the threshold.
+
+        Parameters
+        ----------
+        candidate_terms: list
+            The initial terms of the query.
+
+        similar_terms: json
+            The possible expansion terms.
+
+        co_occurrences: json
+            The document counts of the single terms and of the term pairs.
+
+        total_word_count: int
+            The total number of words in the index.
+
+        threshold: float
+            The threshold to include a term.
+
+        measure: func
+            A function that exhibits some measure to calculate similarity of terms.
+
+        top_k: int
+            If set, the maximum number of expansion terms.
+
+        Returns
+        -------
+        expansion_terms : list
+            The terms that are suitable to expand a query.
+        """
+        synonyms, scores = ElasticsearchQueries.score_expansion_terms(candidate_terms, similar_terms, co_occurrences, total_word_count, measure)
+        return [synonyms[i] for i in select_scores(scores, threshold, top_k)]
+
+
+    def compose_word_count_query(self) -> json:
+        """
+        Compose the query summing up the number of words of all documents.
+
+        Returns
+        -------
+        query : json
+            The aggregation query.
+        """
+        return {
+            "size": 0,
+            "aggs": {
+                "total_word_count": { "sum": { "field": "word_count" } }
+            }
+        }
+
+
+    def compose_aggregation_query(self, query_path, terms) -> json:
+        """
+        Based on a template, compose an Matrix Aggregation query. The parsed template is shared.
+
+        Parameters
+        ----------
+        query_path : str
+            The path to the query template.
+
+        terms: json
+            The terms to fill into the template. 
+
+        Returns
+        -------
+        agg_query : json
+            The aggregation query.
+        """
+
+        # compose the aggregation query with the candidate terms
+        filters = {}
+        for term in terms:
+            filters[term] = { "term" : { "txt" : term.lower() }}
+
+            for synonym in terms[term]:
+                filters[synonym] = { "term" : { "txt" : synonym.lower() }}
+
+        # the parsed template is shared, only the path to the filters is copied
+        return assoc_in(load_template(query_path), ("aggs", "interactions", "adjacency_matrix", "filters"), filters)
+
+
+    def compose_search_query(self, query_path: str, params: json) -> json:
+            """
+            Derive a search query from a predefined template according to specific configurations.
+            The parameters are validated first. The parsed template is shared, only the parts
+            that change are copied.
+
+            Parameters
+            ----------
+            query_path : str
+                The path to the query template..
+            
+            params: json
+                The parameters to fill into the template.
+
+            Returns
+            -------
+            search_query : json
+                The search object with filled in data.
+            """
+            validate_search_params(params)
+
+            search_query = load_template(query_path)
+            hashtags = params["hashtags"] or []
+
+            if params["num_of_tweets"]:
+                search_query = assoc_in(search_query, ("size",), params["num_of_tweets"])
+
+            # filter retweets
+            if params["retweet"]:
+                search_query = dissoc_in(search_query, ("query", "bool", "must_not", "term"))
+            
+            # boost hashtags
+            if params["hashtag_boost"]:
+                search_query = assoc_in(search_query, ("query", "bool", "should", 1, "terms", "boost"), params["hashtag_boost"])
+            
+            # if present, insert hashtags from query
+            if len(hashtags) > 0 :
+                search_query = assoc_in(search_query, ("query", "bool", "must", "terms_set", "hashtags", "terms"), list(hashtags))
+            else:
+                search_query = dissoc_in(search_query, ("query", "bool", "must"))
+            
+            # set date range for tweets
+            if params["tweet_range"]:
+                search_query = assoc_in(search_query, ("query", "bool", "filter", 0, "range", "created_at", "gte"), params["tweet_range"][0])
+                search_query = assoc_in(search_query, ("query", "bool", "filter", 1, "range", "created_at", "lte"), params["tweet_range"][1])
+
+            # insert the query terms
+            if params["terms"]:
+                search_query = assoc_in(search_query, ("query", "bool", "should", 0, "match", "txt", "query"), ' '.join(params["terms"]))
+
+            if hashtags:
+                search_query = assoc_in(search_query, ("query", "bool", "should", 1, "terms", "hashtags"), [q.lower() for q in hashtags])
+
+            return search_query
+
+
+class ElasticsearchClient(ElasticsearchQueries, elasticsearch.Elasticsearch):
     """
     This class represents an Elastic Search client to handle the connection to an Index.
     """
 
-    def __init__(self, credentials, index) -> None:
+    def __init__(self, credentials, index, statistics_ttl: float = 60, result_cache: ResultCache = None) -> None:
         self._host = credentials['URL']
         self._user = credentials['USER']
         self._cert_path = credentials['CERT']
         self._index = index
 
+        # cached corpus statistics, revalidated against the index generation after statistics_ttl seconds
+        self.statistics_ttl = statistics_ttl
+        self._statistics = None
+        self._statistics_checked = 0
+
+        # cached search results, revalidated against the index generation once per refresh interval
+        self.result_cache = result_cache
+        self._refresh_interval = None
+        self._generation = None
+        self._generation_checked = 0
+
         super().__init__(self._host, basic_auth=(self._user, credentials['PWD']), ca_certs=f"auth/{self._cert_path}")
 
 
+    def get_corpus_statistics(self) -> json:
+        """
+        Get the statistics of the index, i.e. the total word count and the document frequencies of terms.
+        The statistics are cached and only reloaded if the generation of the index changed.
+        If the statistics precomputed at ingest time are up to date, they are used.
+
+        Returns
+        -------
+        statistics : json
+            The generation of the index, the total word count and the known document frequencies.
+        """
+        now = time.monotonic()
+        if not self.statistics_expired(now):
+            return self._statistics
+
+        generation = get_index_generation(self, self._index)
+
+        if self.statistics_outdated(self._statistics, generation):
+            try:
+                statistics = self.get(index=get_statistics_index(self._index), id=STATISTICS_ID)["_source"]
+            except elasticsearch.NotFoundError:
+                statistics = None
+
+            if self.statistics_outdated(statistics, generation):
+                statistics = self.compose_statistics(generation, self.count_total_words())
+
+            self._statistics = statistics
+
+        self._statistics_checked = now
+        return self._statistics
+
+
     def get_total_word_count(self) -> int:
         """
-        Count the number of documents in the index.
+        Get the total number of words in the index from the cached corpus statistics.
 
         Returns
         ----------     
         count: int
-            The number of documents in _index.  
+            The number of words in _index.  
         """
+        return self.get_corpus_statistics()["total_word_count"]
 
-        query = {
-            "size": 0,
-            "aggs": {
-                "total_word_count": { "sum": { "field": "word_count" } }
-            }
-        }
+
+    def count_total_words(self) -> int:
+        """
+        Count the number of words in the index.
+
+        Returns
+        ----------     
+        count: int
+            The number of words in _index.  
+        """
+
+        query = self.compose_word_count_query()
         try:
             # run search request
             res = self.search(index=self._index, size=query["size"], aggregations=query["aggs"])
         except elasticsearch.ApiError:
             print("Error while executing count query for index", self._index)
-        
-        return res["aggregations"]["total_word_count"]["value"]
+            raise
+
+        return self.parse_word_count(res)
 
 
     def get_tweets(self, params: json) -> json:
         """
-        Get all tweets from an index given a query.
+        Get all tweets from an index given a query. If a result cache is set, identical
+        requests are served from it until the index changes.
 
         Parameters
         ----------
@@ -58,22 +777,171 @@ class ElasticsearchClient(elasticsearch.Elasticsearch):
         """
 
         # compose the query based on predefined template
-        query = self.compose_search_query('templates/es-query.tpl', params)
+        body = self.compose_search_body(params)
+
+        if self.result_cache is None:
+            return self.search_tweets(body)
 
+        key = ResultCache.get_key(self._index, body)
+        return self.result_cache.fetch(key, lambda: self.search_tweets(body), self.get_generation())
+
+
+    def search_tweets(self, body: json) -> json:
+        """
+        Run a composed search request and collect the tweets.
+        """
         try:
             # run search request
-            res = self.search(index=self._index, size=query["size"], query=query["query"], aggregations=query["aggs"])
+            res = self.search(index=self._index, size=body["size"], query=body["query"], aggregations=body["aggs"])
         except elasticsearch.ApiError:
             print("Error while executing search query for index", self._index)
+            raise
 
-        tweets = {}
+        return self.collect_tweets(res)
 
-        # collect results
-        tweets["hits"] = res["hits"]["total"]["value"]
-        tweets["took"] = res["took"]
-        tweets["tweets"] = res["hits"]["hits"]
 
-        return tweets
+    def iter_tweets(self, params: json, max_hits: int = None, page_size: int = STREAM_PAGE_SIZE,
+                    source: list[str] = STREAM_SOURCE_FIELDS, keep_alive: str = "1m") -> Iterator[json]:
+        """
+        Stream all tweets matching a query, ordered by their score, page by page. The pages are retrieved with
+        `search_after` on a point in time, hence the results are consistent even if the index changes meanwhile.
+        Only one page is held in memory at once.
+
+        Parameters
+        ----------
+        params : json
+            The parameters to execute a search query, `num_of_tweets` is ignored.
+        max_hits : int
+            The maximum number of tweets. If not set, all matching tweets are streamed.
+        page_size : int
+            The number of tweets per request.
+        source : list[str]
+            The fields of the tweets to retrieve.
+        keep_alive : str
+            How long the point in time is kept between two pages.
+
+        Returns
+        -------
+        tweets : Iterator[json]
+            The hits of the matching tweets.
+        """
+        query = self.compose_search_query('templates/es-query.tpl', params)["query"]
+        pit = self.open_point_in_time(index=self._index, keep_alive=keep_alive)["id"]
+
+        try:
+            search_after = None
+            count = 0
+
+            while max_hits is None or count < max_hits:
+                size = page_size if max_hits is None else min(page_size, max_hits - count)
+                try:
+                    res = self.search(
+                        pit={"id": pit, "keep_alive": keep_alive},
+                        query=query,
+                        size=size,
+                        source=source,
+                        # ties are broken by the shard document order of the point in time
+                        sort=[{"_score": "desc"}, {"_shard_doc": "asc"}],
+                        search_after=search_after,
+                        track_total_hits=False,
+                    )
+                except elasticsearch.ApiError:
+                    print("Error while streaming search query for index", self._index)
+                    raise
+
+                hits = res["hits"]["hits"]
+                if not hits:
+                    break
+
+                # the point in time id may change between requests
+                pit = res.get("pit_id", pit)
+                search_after = hits[-1]["sort"]
+                count += len(hits)
+
+                yield from hits
+
+                if len(hits) < size:
+                    break
+        finally:
+            self.close_point_in_time(id=pit)
+
+
+    def get_tweets_many(self, searches: list[json], chunk_size: int = MSEARCH_CHUNK_SIZE) -> list[json]:
+        """
+        Get the tweets of several queries with multi search requests of at most `chunk_size` searches each.
+        A failed search does not affect the others, its result holds the error and no tweets.
+        If a result cache is set, only the queries which are not cached are sent.
+
+        Parameters
+        ----------
+        searches : list[json]
+            The parameters of each search query.
+        chunk_size : int
+            The maximum number of searches per request.
+
+        Returns
+        -------
+        tweets : list[json]
+            The retrieved Tweets of each query.
+        """
+        bodies = [self.compose_search_body(params) for params in searches]
+        results = [None] * len(bodies)
+
+        if self.result_cache is not None:
+            generation = self.get_generation()
+            keys = [ResultCache.get_key(self._index, body) for body in bodies]
+            for i, body in enumerate(bodies):
+                results[i] = self.result_cache.lookup(keys[i], generation, lambda body=body: self.search_tweets(body))
+
+        pending = [i for i, result in enumerate(results) if result is None]
+
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            requests = [part for i in chunk for part in ({"index": self._index}, bodies[i])]
+
+            begin = time.perf_counter()
+            try:
+                responses = self.msearch(searches=requests)["responses"]
+            except elasticsearch.ApiError as e:
+                for i, result in zip(chunk, self.collect_failed_tweets(chunk, e)):
+                    results[i] = result
+                continue
+            latency = (time.perf_counter() - begin) / len(chunk)
+
+            for i, result in zip(chunk, self.collect_tweets_many(responses, chunk)):
+                results[i] = result
+                if self.result_cache is not None and "error" not in result:
+                    self.result_cache.put(keys[i], result, generation, latency)
+
+        return results
+
+
+    def get_generation(self) -> int:
+        """
+        Get the generation of the index. It is checked again once per refresh interval of the index,
+        because changes only become visible to searches after a refresh.
+
+        Returns
+        -------
+        generation : int
+            The generation of the index.
+        """
+        if self._refresh_interval is None:
+            settings = self.indices.get_settings(index=self._index, name="index.refresh_interval", include_defaults=True, flat_settings=True)
+            for index_settings in settings.values():
+                value = index_settings.get("settings", {}).get("index.refresh_interval") or index_settings.get("defaults", {}).get("index.refresh_interval", "1s")
+                self._refresh_interval = parse_time_value(value)
+
+            # refreshes are disabled, check as rarely as the corpus statistics
+            if self._refresh_interval is None or self._refresh_interval < 0:
+                self._refresh_interval = self.statistics_ttl
+
+        now = time.monotonic()
+        if self._generation is None or now - self._generation_checked >= self._refresh_interval:
+            self._generation = get_index_generation(self, self._index)
+            self._generation_checked = now
+
+        return self._generation
 
 
     def get_co_occurring_terms(self, terms) -> json:
@@ -98,14 +966,12 @@ class ElasticsearchClient(elasticsearch.Elasticsearch):
             res = self.search(index=self._index, size=agg_query["size"], aggregations=agg_query["aggs"])
         except elasticsearch.ApiError:
             print("Error while executing aggregation query for index", self._index)
-        
-        co_occurrences = {}
-        co_occurrences.update((t["key"], t["doc_count"]) for t in res["aggregations"]["interactions"]["buckets"])
+            raise
 
-        return co_occurrences
+        return self.parse_co_occurrences(res)
 
 
-    def get_expansion_terms(self, candidate_terms: list, similar_terms: json, threshold: float=.5, measure=npmi) -> list:
+    def get_expansion_terms(self, candidate_terms: list, similar_terms: json, threshold: float=.5, measure=npmi, top_k: int = None) -> list:
             """
             Given some candidate terms and their corresponding similar terms, check if the terms
             can act as expansion terms. This is done by looking at the co-occurrence of both terms using TF-IDF.
@@ -124,131 +990,324 @@ class ElasticsearchClient(elasticsearch.Elasticsearch):
             measure: func
                 A function that exhibits some measure to calculate similarity of terms.
 
+            top_k: int
+                If set, the maximum number of expansion terms.
+
             Returns
             -------
             expansion_terms : list
                 The terms that are suitable to expand a query.
             """
-            if not similar_terms:
+            statistics = self.get_corpus_statistics()
+            total_word_count = statistics["total_word_count"]
+
+            similar_terms = self.prune_similar_terms(similar_terms, statistics["term_doc_freq"], total_word_count, threshold, measure)
+            if not any(similar_terms.values()):
                 return []
 
             co_occurrences = self.get_co_occurring_terms(similar_terms)
-            total_word_count = self.get_total_word_count()
 
-            expansion_terms = []
+            return self.select_expansion_terms(candidate_terms, similar_terms, co_occurrences, total_word_count, threshold, measure, top_k)
+
+
+    def get_expansion_terms_batch(self, candidate_terms: list[list], similar_terms: list[json], threshold: float=.5, measure=npmi,
+                                  top_k: int = None, cooccurrences: CooccurrenceMatrix = None) -> list[list]:
+        """
+        Find the expansion terms of several queries at once. If a co-occurrence matrix is given, all pairs of known
+        terms are scored locally. The remaining candidate and similar terms of all queries are deduplicated and
+        packed into as few adjacency matrix aggregations as the filter limit allows. These are sent in a single
+        multi search request and the counts are fanned back out to the queries.
+
+        Parameters
+        ----------
+        candidate_terms: list[list]
+            The initial terms of each query.
+
+        similar_terms: list[json]
+            The possible expansion terms of each query.
 
-            for term in candidate_terms:
-                if term in co_occurrences.keys():
+        threshold: float
+            The threshold to include a term.
 
-                    term_freq = co_occurrences[term]
+        measure: func
+            A function that exhibits some measure to calculate similarity of terms.
 
-                    for synonym in similar_terms[term]:
-                        if synonym in co_occurrences.keys():
-                            synonym_freq = co_occurrences[synonym]
+        top_k: int
+            If set, the maximum number of expansion terms per query.
 
-                            if f"{synonym}&{term}" in co_occurrences.keys():
-                                joint_freq = co_occurrences[f"{synonym}&{term}"]
+        cooccurrences: CooccurrenceMatrix
+            The co-occurrence matrix built at ingest time.
 
-                            elif f"{term}&{synonym}" in co_occurrences.keys():
-                                joint_freq = co_occurrences[f"{term}&{synonym}"]
+        Returns
+        -------
+        expansion_terms : list[list]
+            The expansion terms of each query.
+        """
+        statistics = self.get_corpus_statistics()
+        scored, similar_terms, searches = self.prepare_expansion_terms_batch(candidate_terms, similar_terms, statistics, threshold, measure, cooccurrences)
 
-                            else:
-                                continue
+        responses = []
+        if searches:
+            try:
+                responses = self.msearch(searches=searches)["responses"]
+            except elasticsearch.ApiError:
+                print("Error while executing aggregation queries for index", self._index)
+                raise
 
-                            beta = measure(total_word_count, term_freq, synonym_freq, joint_freq)
-                            if beta >= threshold:
-                                expansion_terms.append(synonym)
-                        else:
-                            continue
+        return self.collect_expansion_terms_batch(scored, candidate_terms, similar_terms, responses, statistics["total_word_count"], threshold, measure, top_k)
 
-            return expansion_terms
 
+class AsyncElasticsearchClient(ElasticsearchQueries, elasticsearch.AsyncElasticsearch):
+    """
+    This class represents an asynchronous Elastic Search client to handle the connection to an Index.
+    It offers the methods of `ElasticsearchClient` as coroutines. At most `max_concurrency` searches are
+    in flight at once and they share a pool of as many connections per node. Requires the package aiohttp.
+    """
 
-    def compose_aggregation_query(self, query_path, terms) -> json:
+    def __init__(self, credentials, index, statistics_ttl: float = 60, max_concurrency: int = MAX_CONCURRENT_REQUESTS) -> None:
+        self._host = credentials['URL']
+        self._user = credentials['USER']
+        self._cert_path = credentials['CERT']
+        self._index = index
+
+        # cached corpus statistics, revalidated against the index generation after statistics_ttl seconds
+        self.statistics_ttl = statistics_ttl
+        self._statistics = None
+        self._statistics_checked = 0
+        self._statistics_lock = asyncio.Lock()
+
+        # bounds the concurrency against the cluster
+        self._requests = asyncio.Semaphore(max_concurrency)
+
+        super().__init__(self._host, basic_auth=(self._user, credentials['PWD']), ca_certs=f"auth/{self._cert_path}",
+                         connections_per_node=max_concurrency)
+
+
+    async def search(self, **kwargs) -> json:
+        """
+        Run a search request once a request slot is free.
+        """
+        async with self._requests:
+            return await super().search(**kwargs)
+
+
+    async def msearch(self, **kwargs) -> json:
+        """
+        Run a multi search request once a request slot is free.
+        """
+        async with self._requests:
+            return await super().msearch(**kwargs)
+
+
+    async def get_corpus_statistics(self) -> json:
+        """
+        Get the statistics of the index, see `ElasticsearchClient.get_corpus_statistics`.
+        Concurrent callers wait for a single reload.
+
+        Returns
+        -------
+        statistics : json
+            The generation of the index, the total word count and the known document frequencies.
+        """
+        async with self._statistics_lock:
+            now = time.monotonic()
+            if not self.statistics_expired(now):
+                return self._statistics
+
+            generation = await get_index_generation_async(self, self._index)
+
+            if self.statistics_outdated(self._statistics, generation):
+                try:
+                    statistics = (await self.get(index=get_statistics_index(self._index), id=STATISTICS_ID))["_source"]
+                except elasticsearch.NotFoundError:
+                    statistics = None
+
+                if self.statistics_outdated(statistics, generation):
+                    statistics = self.compose_statistics(generation, await self.count_total_words())
+
+                self._statistics = statistics
+
+            self._statistics_checked = now
+            return self._statistics
+
+
+    async def get_total_word_count(self) -> int:
+        """
+        Get the total number of words in the index from the cached corpus statistics.
+
+        Returns
+        ----------
+        count: int
+            The number of words in _index.
+        """
+        return (await self.get_corpus_statistics())["total_word_count"]
+
+
+    async def count_total_words(self) -> int:
+        """
+        Count the number of words in the index.
+
+        Returns
+        ----------
+        count: int
+            The number of words in _index.
+        """
+        query = self.compose_word_count_query()
+        try:
+            res = await self.search(index=self._index, size=query["size"], aggregations=query["aggs"])
+        except elasticsearch.ApiError:
+            print("Error while executing count query for index", self._index)
+            raise
+
+        return self.parse_word_count(res)
+
+
+    async def get_tweets(self, params: json) -> json:
         """
-        Based on a template, compose an Matrix Aggregation query. 
+        Get all tweets from an index given a query.
 
         Parameters
         ----------
-        query_path : str
-            The path to the query template.
+        params : json
+            The parameters to execute a search query.
 
-        terms: json
-            The terms to fill into the template. 
+        Returns
+        -------
+        tweets : json
+            The retrieved Tweets.
+        """
+        query = self.compose_search_query('templates/es-query.tpl', params)
+
+        try:
+            res = await self.search(index=self._index, size=query["size"], query=query["query"], aggregations=query["aggs"])
+        except elasticsearch.ApiError:
+            print("Error while executing search query for index", self._index)
+            raise
+
+        return self.collect_tweets(res)
+
+
+    async def get_tweets_as_completed(self, searches: list[json]) -> AsyncIterator[tuple[int, json]]:
+        """
+        Run the searches of several queries concurrently and yield the tweets of each query as soon as it finished.
+
+        Parameters
+        ----------
+        searches : list[json]
+            The parameters of each search query.
+
+        A failed search does not affect the others, its result holds the error and no tweets. If the
+        iteration stops early, the remaining searches are cancelled.
 
         Returns
         -------
-        agg_query : json
-            The aggregation query.
+        tweets : AsyncIterator[tuple[int, json]]
+            The position of the query within `searches` and its retrieved Tweets, in the order of completion.
         """
+        async def get_tweets(i, params):
+            try:
+                return i, await self.get_tweets(params)
+            except elasticsearch.ApiError as e:
+                return i, self.collect_failed_tweets([i], e)[0]
 
-        # load the predefined aggregation query
-        with open(query_path, 'r') as q:
-            agg_query = json.load(q)
+        tasks = [asyncio.ensure_future(get_tweets(i, params)) for i, params in enumerate(searches)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
-        filters = agg_query["aggs"]["interactions"]["adjacency_matrix"]["filters"]
 
-        # compose the aggregation query with the candidate terms
-        for term in terms:
-            filters[term] = { "term" : { "txt" : term.lower() }}
+    async def get_tweets_many(self, searches: list[json], chunk_size: int = MSEARCH_CHUNK_SIZE) -> list[json]:
+        """
+        Get the tweets of several queries with multi search requests, see `ElasticsearchClient.get_tweets_many`.
+        The chunks are requested concurrently.
 
-            for synonym in terms[term]:
-                filters[synonym] = { "term" : { "txt" : synonym.lower() }}
+        Returns
+        -------
+        tweets : list[json]
+            The retrieved Tweets of each query.
+        """
+        async def get_chunk(start):
+            indices = list(range(start, min(start + chunk_size, len(searches))))
+            try:
+                responses = (await self.msearch(searches=self.compose_search_bodies([searches[i] for i in indices])))["responses"]
+            except elasticsearch.ApiError as e:
+                return self.collect_failed_tweets(indices, e)
+            return self.collect_tweets_many(responses, indices)
 
-        return agg_query
+        chunks = await asyncio.gather(*(get_chunk(start) for start in range(0, len(searches), chunk_size)))
+        return [tweets for chunk in chunks for tweets in chunk]
 
 
-    def compose_search_query(self, query_path: str, params: json) -> json:
-            """
-            Load a predefined template and manipulate it according to specific configurations.
+    async def get_co_occurring_terms(self, terms) -> json:
+        """
+        Execute search query in order to determine co-occurring terms.
 
-            Parameters
-            ----------
-            query_path : str
-                The path to the query template..
-            
-            params: json
-                The parameters to fill into the template.
+        Parameters
+        ----------
+        terms : list
+            The terms to include in the co-occurrence finding process.
 
-            Returns
-            -------
-            search_query : json
-                The search object with filled in data.
-            """
+        Returns
+        -------
+        co_occurrences : json
+            The co-occurrences.
+        """
+        agg_query = self.compose_aggregation_query('templates/es-adjacency-matrix.tpl', terms)
 
-            with open(query_path, 'r') as q:
-                search_query = json.load(q)
-            query = search_query['query']
+        try:
+            res = await self.search(index=self._index, size=agg_query["size"], aggregations=agg_query["aggs"])
+        except elasticsearch.ApiError:
+            print("Error while executing aggregation query for index", self._index)
+            raise
 
-            if params["num_of_tweets"]:
-                search_query["size"] = params["num_of_tweets"]
+        return self.parse_co_occurrences(res)
 
-            # filter retweets
-            if params["retweet"]:
-                del query['bool']['must_not']['term']
-            
-            # boost hashtags
-            if params["hashtag_boost"]:
-                query['bool']['should'][1]['terms']["boost"] = params["hashtag_boost"]
-            
-            # if present, insert hashtags from query
-            if len(params["hashtags"]) > 0 :
-                query['bool']['must']['terms_set']['hashtags']['terms'] = [h for h in params["hashtags"]]
-            else:
-                del query['bool']['must']
-            
-            # set date range for tweets
-            if params["tweet_range"]:
-                query['bool']['filter'][0]['range']['created_at']['gte'] = params["tweet_range"][0]
-                query['bool']['filter'][1]['range']['created_at']['lte'] = params["tweet_range"][1]
 
-            # insert the query terms
-            if params["terms"]:
-                query['bool']['should'][0]['match']['txt']['query'] = ' '.join(params["terms"])
+    async def get_expansion_terms(self, candidate_terms: list, similar_terms: json, threshold: float=.5, measure=npmi, top_k: int = None) -> list:
+        """
+        Given some candidate terms and their corresponding similar terms, check if the terms can act as expansion terms,
+        see `ElasticsearchClient.get_expansion_terms`.
+
+        Returns
+        -------
+        expansion_terms : list
+            The terms that are suitable to expand a query.
+        """
+        statistics = await self.get_corpus_statistics()
+        total_word_count = statistics["total_word_count"]
 
-            if params["hashtags"]:
-                query['bool']['should'][1]['terms']['hashtags'] = [q.lower() for q in params["hashtags"]]
+        similar_terms = self.prune_similar_terms(similar_terms, statistics["term_doc_freq"], total_word_count, threshold, measure)
+        if not any(similar_terms.values()):
+            return []
 
-            return search_query
+        co_occurrences = await self.get_co_occurring_terms(similar_terms)
+
+        return self.select_expansion_terms(candidate_terms, similar_terms, co_occurrences, total_word_count, threshold, measure, top_k)
+
+
+    async def get_expansion_terms_batch(self, candidate_terms: list[list], similar_terms: list[json], threshold: float=.5, measure=npmi,
+                                        top_k: int = None, cooccurrences: CooccurrenceMatrix = None) -> list[list]:
+        """
+        Find the expansion terms of several queries at once, see `ElasticsearchClient.get_expansion_terms_batch`.
+
+        Returns
+        -------
+        expansion_terms : list[list]
+            The expansion terms of each query.
+        """
+        statistics = await self.get_corpus_statistics()
+        scored, similar_terms, searches = self.prepare_expansion_terms_batch(candidate_terms, similar_terms, statistics, threshold, measure, cooccurrences)
+
+        responses = []
+        if searches:
+            try:
+                responses = (await self.msearch(searches=searches))["responses"]
+            except elasticsearch.ApiError:
+                print("Error while executing aggregation queries for index", self._index)
+                raise
 
-    
\ No newline at end of file
+        return self.collect_expansion_terms_batch(scored, candidate_terms, similar_terms, responses, statistics["total_word_count"], threshold, measure, top_k)
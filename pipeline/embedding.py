@@ -1,23 +1,289 @@
+import os
+import time
+import ctypes
+import ctypes.util
+import mmap
+import numpy as np
 from gensim.models import KeyedVectors
 import json
 
+from pipeline.ann_index import IVFIndex
+from pipeline.cache import SimilarTermsCache
+from pipeline.utils import inverse_norms
+
+
+class QuantizedVectors:
+    """
+    Normalized word vectors stored either as float16 or as int8 with a scale per row.
+    Provides the parts of `KeyedVectors` that are needed to search similar terms,
+    so that the search runs directly on the memory-mapped quantized matrix.
+    """
+
+    DTYPES = ["float16", "int8"]
+
+    def __init__(self, index_to_key: list[str], vectors: np.ndarray, scale: np.ndarray = None):
+        """
+        Parameters
+        ----------
+        index_to_key : list[str]
+            The vocabulary.
+        vectors : np.ndarray
+            The quantized, normalized vectors.
+        scale : np.ndarray
+            The scale of each row of int8 vectors.
+        """
+        self.index_to_key = index_to_key
+        self.key_to_index = {key: i for i, key in enumerate(index_to_key)}
+        self.vectors = vectors
+        self.scale = scale
+
+
+    @staticmethod
+    def get_paths(path: str, dtype: str) -> dict:
+        """
+        Get the paths of the files of a quantized model that are stored next to the model file.
+        """
+        return {
+            "vocab": f"{path}.vocab.txt",
+            "vectors": f"{path}.{dtype}.npy",
+            "scale": f"{path}.{dtype}.scale.npy",
+        }
+
+
+    @classmethod
+    def quantize(cls, model: KeyedVectors, dtype: str, batch_size: int = 100000) -> "QuantizedVectors":
+        """
+        Normalize and quantize the vectors of a model.
+
+        Parameters
+        ----------
+        model : KeyedVectors
+            The model to quantize.
+        dtype : str
+            Either "float16" or "int8".
+        batch_size : int
+            The number of vectors converted at once.
+
+        Returns
+        -------
+        vectors : QuantizedVectors
+            The quantized model.
+        """
+        if dtype not in cls.DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}, use one of {cls.DTYPES}")
+
+        model.fill_norms()
+        vectors = np.empty(model.vectors.shape, dtype=dtype)
+        scale = np.empty(len(vectors), dtype=np.float32) if dtype == "int8" else None
+
+        for start in range(0, len(vectors), batch_size):
+            batch = model.vectors[start:start + batch_size] * inverse_norms(model.norms[start:start + batch_size])[:, np.newaxis]
+
+            if dtype == "int8":
+                # symmetric quantization, each row uses the full range of [-127, 127]
+                batch_scale = np.abs(batch).max(axis=1) / 127
+                batch_scale[batch_scale == 0] = 1
+                vectors[start:start + batch_size] = np.round(batch / batch_scale[:, np.newaxis])
+                scale[start:start + batch_size] = batch_scale
+            else:
+                vectors[start:start + batch_size] = batch
+
+        return cls(list(model.index_to_key), vectors, scale)
+
+
+    @classmethod
+    def load(cls, path: str, dtype: str) -> "QuantizedVectors":
+        """
+        Load a quantized model. The vectors are memory-mapped.
+        """
+        paths = cls.get_paths(path, dtype)
+        if not os.path.exists(paths["vectors"]):
+            raise FileNotFoundError(f"No {dtype} model found for {path} - create it with scripts/model_loader.quantize")
+
+        with open(paths["vocab"], "r", encoding="utf-8") as file:
+            index_to_key = file.read().split("\n")
+
+        vectors = np.load(paths["vectors"], mmap_mode='r')
+        scale = np.load(paths["scale"], mmap_mode='r') if dtype == "int8" else None
+        return cls(index_to_key, vectors, scale)
+
+
+    def save(self, path: str) -> None:
+        """
+        Save the quantized model next to the model file.
+        """
+        paths = self.get_paths(path, self.vectors.dtype.name)
+
+        with open(paths["vocab"], "w", encoding="utf-8") as file:
+            file.write("\n".join(self.index_to_key))
+
+        np.save(paths["vectors"], self.vectors)
+        if self.scale is not None:
+            np.save(paths["scale"], self.scale)
+
+
+    def has_index_for(self, key: str) -> bool:
+        return key in self.key_to_index
+
+
+    def get_index(self, key: str) -> int:
+        return self.key_to_index[key]
+
+
+class ModelRegistry:
+    """
+    Keeps the loaded embedding models of the process, so that each model file is loaded only once
+    and repeated pipeline runs reuse it. The vectors are memory-mapped read-only, hence their pages
+    are shared with forked worker processes if the models are loaded (see `preload`) before forking.
+    """
+
+    _models = {}
+    _indexes = {}
+
+
+    @classmethod
+    def get(cls, path: str, dtype: str = None, prefault: bool = False, lock: bool = False) -> tuple[KeyedVectors, np.ndarray]:
+        """
+        Get a model and the scale of each row of its vectors, loading it on first use.
+        For full precision models the scale is the inverse norm of the vectors.
+
+        Parameters
+        ----------
+        path : str
+            The path of the model file.
+        dtype : str
+            If set, load the quantized model of this type ("float16" or "int8") instead.
+        prefault : bool
+            Read all vector pages once after loading, so that the first query does not pay for page faults.
+        lock : bool
+            Lock the vector pages in memory after loading, so that they are never swapped out.
+
+        Returns
+        -------
+        model : tuple[KeyedVectors, np.ndarray]
+            The model and the scale of each row of its vectors.
+        """
+        if (path, dtype) not in cls._models:
+            if dtype:
+                model = QuantizedVectors.load(path, dtype)
+
+                # float16 vectors are stored normalized
+                scale = model.scale if model.scale is not None else np.ones(len(model.vectors), dtype=np.float32)
+            else:
+                model = KeyedVectors.load(fname=path, mmap='r')
+
+                # compressed models already carry their norms, so this only computes them if missing
+                model.fill_norms()
+                scale = inverse_norms(model.norms)
+
+            cls._models[(path, dtype)] = (model, scale)
+
+            if prefault:
+                cls.prefault(model.vectors)
+            if lock:
+                cls.lock(model.vectors)
+
+        return cls._models[(path, dtype)]
+
+
+    @classmethod
+    def is_loaded(cls, path: str, dtype: str = None) -> bool:
+        """
+        Check whether a model is already resident in this process.
+        """
+        return (path, dtype) in cls._models
+
+
+    @classmethod
+    def get_index(cls, path: str, count: int = None) -> IVFIndex:
+        """
+        Get the approximate nearest neighbour index of a model with `count` vectors, loading it on first use.
+        """
+        if path not in cls._indexes:
+            cls._indexes[path] = IVFIndex.load(path, count)
+        return cls._indexes[path]
+
+
+    @classmethod
+    def preload(cls, paths: list[str], dtype: str = None, prefault: bool = True, lock: bool = False) -> None:
+        """
+        Load several models, e.g. the fastText and word2vec model, before worker processes are forked.
+        """
+        for path in paths:
+            cls.get(path, dtype=dtype, prefault=prefault, lock=lock)
+
+
+    @classmethod
+    def clear(cls) -> None:
+        """
+        Release all loaded models.
+        """
+        cls._models.clear()
+        cls._indexes.clear()
+
+
+    @staticmethod
+    def prefault(vectors: np.ndarray) -> None:
+        """
+        Touch one value per memory page so that all pages of the vectors are faulted in.
+        """
+        step = max(mmap.PAGESIZE // vectors.itemsize, 1)
+        np.ravel(vectors)[::step].sum()
+
+
+    @staticmethod
+    def lock(vectors: np.ndarray) -> bool:
+        """
+        Lock the pages of the vectors in memory with mlock. Only supported on POSIX systems and
+        limited by RLIMIT_MEMLOCK, hence failing is not an error.
+        """
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            return False
+
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if libc.mlock(ctypes.c_void_p(vectors.ctypes.data), ctypes.c_size_t(vectors.nbytes)) != 0:
+            print("Unable to lock model in memory:", ctypes.get_errno())
+            return False
+        return True
+
+
 class WordEmbedding:
     """
     Base class to handle different Word Embeddings.
     """
 
-    def __init__(self, model):
+    def __init__(self, model, nprobe: int = None, cache: SimilarTermsCache = None, prefault: bool = False, dtype: str = None):
         """
         Initialize and load specified model from a file.
+
+        Parameters
+        ----------
+        model : str
+            The path of the model file.
+        nprobe : int
+            If set, search with the approximate index of the model and scan `nprobe` lists per term.
+            Higher values increase recall as well as latency. By default, an exact search is done.
+        cache : SimilarTermsCache
+            If set, similar terms are looked up in and stored to this cache.
+        prefault : bool
+            Fault in all pages of the vectors when the model is loaded.
+        dtype : str
+            If set, use the quantized model of this type ("float16" or "int8").
         """
-        self.model = KeyedVectors.load(fname=model, mmap='r')
+        self.path = model
+        self.cache = cache
+        self.dtype = dtype
+        self.model, self._scale = ModelRegistry.get(model, dtype=dtype, prefault=prefault)
+        self.nprobe = nprobe
+        self.index = ModelRegistry.get_index(model, len(self.model.vectors)) if nprobe else None
+
 
-    
     def get_similar_terms(self, terms: list[str], n: int) -> json:
         """
         Obtain similar terms from Word Embedding model given
         a list of words (or a single term).
-        
+
         Parameters
         ----------
         terms : list[str]
@@ -37,17 +303,40 @@ class WordEmbedding:
 
         if isinstance(terms, list):
             # Handle the input as a list of items
-            for term in terms:
-                similar_term = self.get_similar(term, n)
-                if similar_term is not None:
-                    similar_terms[f"{term}"] = similar_term
-            return similar_terms
+            return self.get_similar_terms_batch([terms], n)[0]
         else:
             # Handle the input as a single item
             similar_terms[f"{terms}"] = self.get_similar(terms, n)
             return similar_terms
 
-            
+
+    def get_similar_terms_batch(self, queries: list[list[str]], n: int, batch_size: int = 256) -> list[json]:
+        """
+        Obtain similar terms for the terms of several queries at once.
+        The distinct terms of all queries are stacked into one matrix and scored against
+        the whole vocabulary with matrix-matrix products instead of one scan per term.
+
+        Parameters
+        ----------
+        queries : list[list[str]]
+            The terms of each query.
+        n : int
+            The number of similar terms returned per term.
+        batch_size : int
+            The number of terms scored at once. Bounds the size of the score matrix.
+
+        Returns
+        -------
+        similar_terms : list[json]
+            For each query, the terms with corresponding similar terms.
+        """
+        # look up each distinct term only once, no matter how often it occurs
+        keys = list(dict.fromkeys(term for terms in queries for term in terms if self.model.has_index_for(term)))
+        neighbours = self._lookup(keys, n, batch_size)
+
+        return [{f"{term}": neighbours[term] for term in terms if term in neighbours} for terms in queries]
+
+
     def get_similar(self, term: str, n: int) -> list:
         """
         Get the most similar terms given a single term.
@@ -65,5 +354,164 @@ class WordEmbedding:
             The similar terms.
         """
         if self.model.has_index_for(term):
-            similar_terms = self.model.most_similar(term)[:n]
-            return [t[0].replace("_"," ") for t in similar_terms]
+            return self._lookup([term], n)[term]
+
+
+    def _lookup(self, keys: list[str], n: int, batch_size: int = 256) -> dict:
+        """
+        Get the similar terms for each of the given keys from the cache if possible
+        and compute only the missing ones.
+        """
+        if self.cache is None:
+            return self._most_similar(keys, n, batch_size)
+
+        # results of approximate or quantized lookups must not be served for exact lookups and vice versa
+        variant = []
+        if self.dtype:
+            variant.append(self.dtype)
+        if self.index is not None:
+            variant.append(f"nprobe={self.nprobe}")
+        variant = ",".join(variant)
+
+        similar_terms = self.cache.get_many(self.path, keys, n, variant)
+        missing = self._most_similar([key for key in keys if key not in similar_terms], n, batch_size)
+        self.cache.put_many(self.path, missing, n, variant)
+
+        similar_terms.update(missing)
+        return similar_terms
+
+
+    def _most_similar(self, keys: list[str], n: int, batch_size: int = 256) -> dict:
+        """
+        Find the n nearest neighbours by cosine similarity for each of the given keys.
+        Equivalent to `KeyedVectors.most_similar` but vectorized over all keys.
+
+        Parameters
+        ----------
+        keys : list[str]
+            The terms to find similar terms for. Must be part of the vocabulary.
+        n : int
+            The number of similar terms returned.
+        batch_size : int
+            The number of terms scored at once.
+
+        Returns
+        -------
+        similar_terms : dict
+            The similar terms for each key.
+        """
+        similar_terms = {}
+        if not keys or n < 1:
+            return {key: [] for key in keys}
+
+        vectors = self.model.vectors
+        ids = np.array([self.model.get_index(key) for key in keys])
+
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+
+            # normalized query vectors
+            queries = vectors[batch].astype(np.float32) * self._scale[batch, np.newaxis]
+
+            if self.index is not None:
+                top = self.index.search(vectors, self._scale, queries, n, self.nprobe, exclude=batch)
+            else:
+                top = self._exact_search(queries, n, exclude=batch)
+
+            for i, key_id in enumerate(batch):
+                similar_terms[self.model.index_to_key[key_id]] = [self.model.index_to_key[t].replace("_", " ") for t in top[i]]
+
+        return similar_terms
+
+
+    def _exact_search(self, queries: np.ndarray, n: int, exclude: np.ndarray, chunk_size: int = 131072) -> np.ndarray:
+        """
+        Score the queries against the whole vocabulary chunk by chunk and keep the running top n.
+        Chunking bounds the size of the score matrix and allows to search quantized vectors
+        without converting the full matrix at once.
+
+        Parameters
+        ----------
+        queries : np.ndarray
+            The normalized query vectors.
+        n : int
+            The number of neighbours returned per query.
+        exclude : np.ndarray
+            For each query, a vector id that must not be returned.
+        chunk_size : int
+            The number of vectors scored at once.
+
+        Returns
+        -------
+        neighbours : np.ndarray
+            The ids of the neighbours of each query, ordered by similarity.
+        """
+        vectors = self.model.vectors
+        rows = np.arange(len(queries))
+
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+
+            # cosine similarity of the normalized queries to the vectors of the chunk
+            scores = queries @ chunk.astype(np.float32, copy=False).T
+            scores *= self._scale[start:start + len(chunk)]
+
+            # like most_similar, never return the term itself
+            inside = (exclude >= start) & (exclude < start + len(chunk))
+            scores[rows[inside], exclude[inside] - start] = -np.inf
+
+            # partial sort to get the top n of the chunk and merge it with the previous ones
+            k = min(n, len(chunk))
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            best_ids = np.concatenate([best_ids, top + start], axis=1)
+
+            if best_ids.shape[1] > n:
+                keep = np.argpartition(-best_scores, n - 1, axis=1)[:, :n]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_ids = np.take_along_axis(best_ids, keep, axis=1)
+
+        # only order the final top n
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_ids, order, axis=1)
+
+
+def top_n_overlap(reference: WordEmbedding, candidate: WordEmbedding, terms: list[str], n: int) -> json:
+    """
+    Compare the similar terms of a candidate model against a reference model, e.g. an approximate
+    search against the exact one. Reports the recall@n and the lookup latency of both models.
+
+    Parameters
+    ----------
+    reference : WordEmbedding
+        The model that provides the expected similar terms.
+    candidate : WordEmbedding
+        The model to evaluate.
+    terms : list[str]
+        The terms to look up.
+    n : int
+        The number of similar terms per term.
+
+    Returns
+    -------
+    report : json
+        The mean recall@n and the latency per term in milliseconds.
+    """
+    start = time.perf_counter()
+    expected = reference.get_similar_terms(terms, n)
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = candidate.get_similar_terms(terms, n)
+    candidate_time = time.perf_counter() - start
+
+    recalls = [len(set(expected[t]) & set(actual.get(t, []))) / len(expected[t]) for t in expected if expected[t]]
+
+    return {
+        "recall": float(np.mean(recalls)) if recalls else None,
+        "reference_ms": 1000 * reference_time / max(len(terms), 1),
+        "candidate_ms": 1000 * candidate_time / max(len(terms), 1),
+    }
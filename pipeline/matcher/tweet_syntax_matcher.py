@@ -0,0 +1,37 @@
+import re
+
+from spacy.language import Language
+from spacy.tokens import Token
+
+# Register the token extensions to mark Twitter syntax
+for extension in ["is_hashtag", "is_user", "is_url", "is_retweet"]:
+    if not Token.has_extension(extension):
+        Token.set_extension(extension, default=False)
+
+@Language.factory("tweet_syntax_matcher")
+def create_tweet_syntax_matcher(nlp, name):
+    return TweetSyntaxMatcher()
+
+class TweetSyntaxMatcher:
+    """
+    The purpose of this class is to detect hashtags, users, URLs and retweet markers and mark them.
+    The custom token_match of the tokenizer keeps hashtags and users as single tokens, hence
+    a single scan over the tokens suffices and no retokenization is needed.
+    """
+    HASHTAG = re.compile(r"#\w+")
+    USER = re.compile(r"@\w+")
+
+    def __call__(self, doc):
+        # This method is invoked when the component is called on a Doc
+        for token in doc:
+            text = token.text
+
+            if text[0] == "#":
+                token._.is_hashtag = self.HASHTAG.fullmatch(text) is not None
+            elif text[0] == "@":
+                token._.is_user = self.USER.fullmatch(text) is not None
+            elif text == "RT":
+                token._.is_retweet = True
+            elif token.like_url:
+                token._.is_url = True
+        return doc
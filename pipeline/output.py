@@ -0,0 +1,308 @@
+import os
+import io
+import glob
+import gzip
+import json
+import numpy as np
+
+from abc import ABC, abstractmethod
+from typing import Iterator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+# file extension of each compression
+COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# columns of the columnar formats for hit lists, the source is stored as JSON string
+HIT_COLUMNS = ["query", "_id", "_score", "_source"]
+
+
+def open_text(path: str, mode: str = "r", compression: str = None) -> io.TextIOBase:
+    """
+    Open a text file, optionally compressed. If no compression is given, it is derived from the extension of the file.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+    mode : str
+        Either "r", "w" or "a".
+    compression : str
+        Either None, "gzip" or "zstd".
+
+    Returns
+    -------
+    file : io.TextIOBase
+        The opened file.
+    """
+    if compression is None:
+        compression = {ext: name for name, ext in COMPRESSIONS.items() if ext}.get(os.path.splitext(path)[1])
+
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression requires the package zstandard")
+        return zstandard.open(path, mode + "t", encoding="utf-8")
+
+    return open(path, mode, encoding="utf-8")
+
+
+class RecordWriter(ABC):
+    """
+    Writes records, i.e. JSON serializable dictionaries, one after another. Writers are context managers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+
+
+    @abstractmethod
+    def write(self, record: dict) -> None:
+        """
+        Write a record.
+        """
+
+
+    def flush(self) -> None:
+        """
+        Make the records written so far readable from the output, e.g. once all records of a query are written.
+        """
+
+
+    def close(self) -> None:
+        pass
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class JSONWriter(RecordWriter):
+    """
+    Writes all records as a single indented JSON list when closed. This is the format of former runs.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.records = []
+
+
+    def write(self, record: dict) -> None:
+        self.records.append(record)
+        self.count += 1
+
+
+    def close(self) -> None:
+        with open(self.path, "w", encoding="utf-8") as file:
+            json.dump(self.records, file, ensure_ascii=False, indent=4)
+
+
+class JSONLinesWriter(RecordWriter):
+    """
+    Writes one compact JSON record per line, optionally compressed. The records are flushed on `flush`, hence
+    the file is readable while it is written and a failed run keeps all records up to the last flush.
+    Flushing every record would end a compressed block each time, which slows down writing and inflates the file.
+    """
+
+    def __init__(self, path: str, compression: str = None):
+        super().__init__(path)
+        self.file = open_text(path, "w", compression)
+
+
+    def write(self, record: dict) -> None:
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ColumnarHitsWriter(RecordWriter):
+    """
+    Writes hit records in columns (query, _id, _score, _source) in batches of `batch_size` hits.
+    Each batch is written as a row group of a Parquet file, or as a part of NumPy arrays if `numpy` is set.
+    Batches are only written when full or on close, `flush` does not cut them short.
+    """
+
+    def __init__(self, path: str, batch_size: int = 10000, numpy: bool = False):
+        """
+        Parameters
+        ----------
+        path : str
+            The path of the Parquet file or the directory of the NumPy parts.
+        batch_size : int
+            The number of hits per batch.
+        numpy : bool
+            Whether NumPy arrays are written instead of Parquet.
+        """
+        super().__init__(path)
+        self.batch_size = batch_size
+        self.numpy = numpy
+        self.columns = {name: [] for name in HIT_COLUMNS}
+        self.parts = 0
+        self.parquet = None
+
+        if numpy:
+            os.makedirs(path, exist_ok=True)
+        elif pq is None:
+            raise ImportError("Parquet output requires the package pyarrow")
+
+
+    def write(self, record: dict) -> None:
+        self.columns["query"].append(record["query"])
+        self.columns["_id"].append(record.get("_id"))
+        self.columns["_score"].append(record.get("_score"))
+        self.columns["_source"].append(json.dumps(record.get("_source"), ensure_ascii=False))
+        self.count += 1
+
+        if len(self.columns["query"]) >= self.batch_size:
+            self.write_batch()
+
+
+    def write_batch(self) -> None:
+        """
+        Write the buffered hits as a batch.
+        """
+        if not self.columns["query"]:
+            return
+
+        scores = [np.nan if score is None else score for score in self.columns["_score"]]
+
+        if self.numpy:
+            np.savez(
+                os.path.join(self.path, f"part-{self.parts:05d}.npz"),
+                query=np.array(self.columns["query"], dtype=np.int32),
+                _id=np.array(self.columns["_id"], dtype=str),
+                _score=np.array(scores, dtype=np.float32),
+                _source=np.array(self.columns["_source"], dtype=str),
+            )
+        else:
+            table = pa.table({
+                "query": pa.array(self.columns["query"], type=pa.int32()),
+                "_id": pa.array(self.columns["_id"], type=pa.string()),
+                "_score": pa.array(scores, type=pa.float32()),
+                "_source": pa.array(self.columns["_source"], type=pa.string()),
+            })
+            if self.parquet is None:
+                self.parquet = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+            self.parquet.write_table(table)
+
+        self.parts += 1
+        self.columns = {name: [] for name in HIT_COLUMNS}
+
+
+    def close(self) -> None:
+        self.write_batch()
+        if self.parquet is not None:
+            self.parquet.close()
+
+
+def open_writer(path: str, format: str = "jsonl", compression: str = None, **kwargs) -> RecordWriter:
+    """
+    Open a writer for records. The extension of the format is appended to the path.
+
+    Parameters
+    ----------
+    path : str
+        The path of the output without extension.
+    format : str
+        One of "json" (a single indented list), "jsonl" (JSON Lines), "parquet", "numpy" or
+        "columnar" (Parquet if pyarrow is installed, else NumPy). The columnar formats are meant for hit lists.
+    compression : str
+        The compression of JSON Lines, either None, "gzip" or "zstd".
+
+    Returns
+    -------
+    writer : RecordWriter
+        The writer.
+    """
+    if format == "columnar":
+        format = "numpy" if pq is None else "parquet"
+
+    if format == "json":
+        return JSONWriter(path + ".json")
+    if format == "jsonl":
+        return JSONLinesWriter(path + ".jsonl" + COMPRESSIONS[compression], compression)
+    if format == "parquet":
+        return ColumnarHitsWriter(path + ".parquet", **kwargs)
+    if format == "numpy":
+        return ColumnarHitsWriter(path + ".npy.d", numpy=True, **kwargs)
+
+    raise ValueError(f"Unknown output format {format}, use one of json, jsonl, parquet, numpy or columnar")
+
+
+def iter_batches(path: str) -> Iterator[dict]:
+    """
+    Read the hits of a columnar output batch by batch, i.e. as dictionaries of arrays.
+
+    Parameters
+    ----------
+    path : str
+        The path of the Parquet file or the directory of the NumPy parts.
+
+    Returns
+    -------
+    batches : Iterator[dict]
+        The columns of each batch.
+    """
+    if os.path.isdir(path):
+        for part in sorted(glob.glob(os.path.join(path, "part-*.npz"))):
+            with np.load(part) as arrays:
+                yield {name: arrays[name] for name in HIT_COLUMNS}
+    else:
+        if pq is None:
+            raise ImportError("Reading Parquet requires the package pyarrow")
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield {name: batch.column(batch.schema.get_field_index(name)).to_numpy(zero_copy_only=False) for name in HIT_COLUMNS}
+
+
+def read_records(path: str) -> Iterator[dict]:
+    """
+    Read the records of any output lazily, the format is derived from the path. Only JSON lists are loaded at once.
+
+    Parameters
+    ----------
+    path : str
+        The path of the output.
+
+    Returns
+    -------
+    records : Iterator[dict]
+        The records.
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as file:
+            yield from json.load(file)
+
+    elif path.endswith(".parquet") or os.path.isdir(path):
+        for batch in iter_batches(path):
+            for query, _id, score, source in zip(*(batch[name] for name in HIT_COLUMNS)):
+                yield {"query": int(query), "_id": str(_id), "_score": None if np.isnan(score) else float(score), "_source": json.loads(source)}
+
+    else:
+        with open_text(path, "r") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
@@ -0,0 +1,193 @@
+import os
+import json
+import itertools
+
+from abc import ABC, abstractmethod
+from typing import Iterator
+from pipeline.bulk import iterate_rows
+from pipeline.output import COMPRESSIONS, open_text
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+# alternative column names of files, e.g. dumps of a table use "id" instead of "_id"
+ALIASES = {"_id": "id"}
+
+
+class TweetSource(ABC):
+    """
+    A source of tweets that yields rows, i.e. tuples of the values of certain attributes in the same order,
+    lazily. Sources are context managers.
+    """
+
+    def __init__(self, attributes: list[str]):
+        self.attributes = attributes
+
+
+    @abstractmethod
+    def rows(self, size: int = 10000) -> Iterator[tuple]:
+        """
+        Iterate the rows of the source, reading `size` rows at once.
+        """
+
+
+    def close(self) -> None:
+        pass
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class PostgresSource(TweetSource):
+    """
+    Yields the rows of a query of a PostgreSQL database whose columns are in the order of the attributes.
+    """
+
+    def __init__(self, connection, query: str, attributes: list[str], name: str = None, params: json = None):
+        """
+        Parameters
+        ----------
+        connection : psycopg2.extensions.connection
+            The connection to the database.
+        query : str
+            The query.
+        attributes : list[str]
+            The name of each column of the query.
+        name : str
+            The name of a server-side cursor, which keeps the result set on the server and transfers
+            it in batches. Without a name, the whole result set is transferred at once.
+        params : json
+            The parameters of the query.
+        """
+        super().__init__(attributes)
+        self.connection = connection
+        self.query = query
+        self.name = name
+        self.params = params
+        self.cursor = None
+
+
+    def rows(self, size: int = 10000) -> Iterator[tuple]:
+        # each iteration runs the query again
+        self.close()
+        self.cursor = self.connection.cursor(name=self.name) if self.name else self.connection.cursor()
+        self.cursor.itersize = size
+        self.cursor.execute(self.query, self.params)
+        yield from iterate_rows(self.cursor, size=size)
+
+
+    def close(self) -> None:
+        if self.cursor is not None:
+            self.cursor.close()
+            self.cursor = None
+
+
+class JSONLinesSource(TweetSource):
+    """
+    Streams the tweets of a JSON Lines file, optionally compressed, line by line. Each line is either a tweet
+    or a hit of Elastic Search, whose source holds the tweet. Missing attributes are None.
+    """
+
+    def __init__(self, path: str, attributes: list[str], compression: str = None):
+        super().__init__(attributes)
+        self.path = path
+        self.compression = compression
+
+
+    def rows(self, size: int = 10000) -> Iterator[tuple]:
+        with open_text(self.path, "r", self.compression) as file:
+            for line in file:
+                if not line.strip():
+                    continue
+
+                record = json.loads(line)
+                if "_source" in record:
+                    record = {"_id": record.get("_id"), **record["_source"]}
+
+                yield tuple(record.get(attr, record.get(ALIASES.get(attr))) for attr in self.attributes)
+
+
+class ArrowSource(TweetSource):
+    """
+    Reads the tweets of a Parquet file or an Arrow IPC file batch by batch. The file is memory-mapped, hence only
+    the batch being read is held in memory (Arrow IPC files are not copied at all). Missing attributes are None.
+    """
+
+    def __init__(self, path: str, attributes: list[str]):
+        super().__init__(attributes)
+        if pa is None:
+            raise ImportError("Reading Parquet and Arrow files requires the package pyarrow")
+
+        self.path = path
+        self.file = pa.memory_map(path, "r")
+        self.parquet = path.endswith(".parquet")
+        self.reader = pq.ParquetFile(self.file) if self.parquet else pa.ipc.open_file(self.file)
+
+        # the column of each attribute, None if the file has no such column
+        names = set(self.reader.schema_arrow.names if self.parquet else self.reader.schema.names)
+        self.columns = []
+        for attr in attributes:
+            column = attr if attr in names else ALIASES.get(attr)
+            self.columns.append(column if column in names else None)
+
+
+    def batches(self, size: int) -> Iterator:
+        columns = [column for column in self.columns if column is not None]
+        if self.parquet:
+            yield from self.reader.iter_batches(batch_size=size, columns=columns)
+        else:
+            for i in range(self.reader.num_record_batches):
+                yield self.reader.get_batch(i).select(columns)
+
+
+    def rows(self, size: int = 10000) -> Iterator[tuple]:
+        for batch in self.batches(size):
+            values = [
+                batch.column(batch.schema.get_field_index(column)).to_pylist() if column is not None else itertools.repeat(None)
+                for column in self.columns
+            ]
+            yield from zip(*values)
+
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def open_source(path: str, attributes: list[str]) -> TweetSource:
+    """
+    Open a file of tweets, the format is derived from its extension.
+
+    Parameters
+    ----------
+    path : str
+        The path of a JSON Lines file (.jsonl, optionally compressed, e.g. .jsonl.gz), a Parquet file (.parquet)
+        or an Arrow IPC file (.arrow, .feather).
+    attributes : list[str]
+        The attributes of the rows.
+
+    Returns
+    -------
+    source : TweetSource
+        The source.
+    """
+    name = path
+    for ext in COMPRESSIONS.values():
+        if ext and name.endswith(ext):
+            name = name[:-len(ext)]
+
+    ext = os.path.splitext(name)[1]
+    if ext in [".jsonl", ".ndjson"]:
+        return JSONLinesSource(path, attributes)
+    if ext in [".parquet", ".arrow", ".feather"]:
+        return ArrowSource(path, attributes)
+
+    raise ValueError(f"Unknown format of {path}, use JSON Lines, Parquet or Arrow")
@@ -0,0 +1,133 @@
+import os
+import json
+
+from functools import lru_cache
+
+
+class FrozenDict(dict):
+    """
+    A read-only dictionary. Parsed templates consist of frozen dictionaries and tuples only,
+    hence they can be shared between requests and threads without copying them.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Templates are read-only, use assoc_in or dissoc_in to derive a request body")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = __ior__ = _readonly
+
+
+def freeze(value: any) -> any:
+    """
+    Recursively convert dictionaries into frozen dictionaries and lists into tuples.
+    """
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def load_template(path: str) -> FrozenDict:
+    """
+    Get the parsed, immutable form of a query template. Each template file is read only once per process.
+
+    Parameters
+    ----------
+    path : str
+        The path to the template, relative paths are resolved against the working directory.
+
+    Returns
+    -------
+    template : FrozenDict
+        The parsed template.
+    """
+    return _load_template(os.path.abspath(path))
+
+
+@lru_cache(maxsize=None)
+def _load_template(path: str) -> FrozenDict:
+    with open(path, 'r') as file:
+        return freeze(json.load(file))
+
+
+def assoc_in(tree: any, path: tuple, value: any) -> any:
+    """
+    Derive a tree in which the value at `path` is replaced. Only the dictionaries and lists along
+    the path are copied, all other subtrees are shared with the original tree.
+
+    Parameters
+    ----------
+    tree : any
+        The nested dictionaries and lists (or tuples).
+    path : tuple
+        The keys and indices leading to the value.
+    value : any
+        The new value.
+
+    Returns
+    -------
+    tree : any
+        The new tree.
+    """
+    if not path:
+        return value
+
+    key, rest = path[0], path[1:]
+    if isinstance(tree, dict):
+        copy = dict(tree)
+    else:
+        copy = list(tree)
+    copy[key] = assoc_in(tree[key], rest, value)
+    return copy
+
+
+def dissoc_in(tree: any, path: tuple) -> any:
+    """
+    Derive a tree in which the key at `path` is removed, see `assoc_in`.
+    """
+    *parents, key = path
+    parent = dict(get_in(tree, parents))
+    del parent[key]
+    return assoc_in(tree, tuple(parents), parent)
+
+
+def get_in(tree: any, path: tuple) -> any:
+    """
+    Get the value at `path`.
+    """
+    for key in path:
+        tree = tree[key]
+    return tree
+
+
+def validate_search_params(params: json) -> None:
+    """
+    Check the parameters of a search query before composing it.
+
+    Parameters
+    ----------
+    params : json
+        The parameters to fill into the template.
+
+    Raises
+    ------
+    ValueError
+        If a parameter is missing or has an invalid value.
+    """
+    missing = [p for p in ["num_of_tweets", "retweet", "hashtag_boost", "hashtags", "tweet_range", "terms"] if p not in params]
+    if missing:
+        raise ValueError(f"Missing search params {missing}")
+
+    if params["num_of_tweets"] and (not isinstance(params["num_of_tweets"], int) or params["num_of_tweets"] < 0):
+        raise ValueError(f"num_of_tweets must be a non-negative integer, got {params['num_of_tweets']!r}")
+
+    if params["hashtag_boost"] and not isinstance(params["hashtag_boost"], (int, float)):
+        raise ValueError(f"hashtag_boost must be a number, got {params['hashtag_boost']!r}")
+
+    if params["tweet_range"] and len(params["tweet_range"]) != 2:
+        raise ValueError(f"tweet_range must consist of a start and an end, got {params['tweet_range']!r}")
+
+    for p in ["hashtags", "terms"]:
+        if params[p] is not None and (isinstance(params[p], str) or not all(isinstance(t, str) for t in params[p])):
+            raise ValueError(f"{p} must be a list of strings, got {params[p]!r}")
@@ -1,19 +1,49 @@
+import unicodedata
 import spacy as sp
 import de_core_news_lg as sp_model
 
-from pipeline.tokenizer.tweet_tokenizer import separate_hashtags, add_hashtag_pattern
+from typing import Iterable, Iterator
 
-import pipeline.matcher.hashtag_matcher
-import pipeline.matcher.user_matcher
+from pipeline.cache import LRUCache
+from pipeline.tokenizer.tweet_tokenizer import TWEET_TOKEN_PATTERN, separate_hashtags, add_hashtag_pattern
+
+import pipeline.matcher.tweet_syntax_matcher
+
+
+# pipes of the full pipeline that are never used
+EXCLUDE_PIPES = ["tagger", "entity_linker", "textcat", "textcat_multilabel", "trainable_lemmatizer", "senter", "sentencizer", "transformer"]
+
+# Processing profiles trading accuracy for latency. Each profile lists the pipes it excludes
+# and the filter params of `get_filtered_tokens` it can honor.
+PROFILES = {
+    # POS tags, named entities and lemmas
+    "full": {
+        "exclude": EXCLUDE_PIPES,
+        "params": ["pos_list", "entity_list", "hashtag", "user"],
+    },
+    # POS tags and lemmas, without dependency parsing and named entities
+    "tagger_lemma": {
+        "exclude": EXCLUDE_PIPES + ["parser", "ner"],
+        "params": ["pos_list", "hashtag", "user"],
+    },
+    # rule-based lemma lookup on a blank pipeline, requires the package spacy-lookups-data
+    "lookup": {
+        "exclude": None,
+        "params": ["hashtag", "user"],
+    },
+}
 
 
 class TextProcessor:
     """
     A natural language processing pipeline that uses a spaCy model to process text.
-    This class is a singleton.
+    There is a single instance of this class per model and profile.
     """
 
-    def __new__(cls, model:str = None):
+    # maximum number of cached query analyses
+    ANALYSIS_CACHE_SIZE = 10000
+
+    def __new__(cls, model:str = None, profile:str = "full"):
         """
         Calling this method to create singleton pattern.
 
@@ -21,19 +51,26 @@ class TextProcessor:
         ----------
         model : str
             The name of the SpaCy model.
+        profile : str
+            The name of the processing profile, see `PROFILES`.
         """
-        it = cls.__dict__.get("__it__")
+        instances = cls.__dict__.get("__instances__")
+
+        if instances is None:
+            cls.__instances__ = instances = {}
+
+        it = instances.get((model, profile))
 
         if it is not None:
             return it
 
-        cls.__it__ = it = object.__new__(cls)
-        it.init(model)
+        instances[(model, profile)] = it = object.__new__(cls)
+        it.init(model, profile)
 
         return it
 
 
-    def init(self, model:str):
+    def init(self, model:str, profile:str = "full"):
         """
         Initialize the SpaCy model either by the specific name of the model or use the default model.
         
@@ -41,23 +78,50 @@ class TextProcessor:
         ----------
         model : str
             The name of the SpaCy model.
+        profile : str
+            The name of the processing profile, see `PROFILES`.
         """
-        exclude_pipes = ["tagger", "entity_linker", "textcat", "textcat_multilabel", "trainable_lemmatizer", "senter", "sentencizer", "transformer"]
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown profile {profile}, use one of {list(PROFILES)}")
 
-        if model:
+        self.model = model
+        self.profile = profile
+        self.analyses = LRUCache(self.ANALYSIS_CACHE_SIZE)
+        self.supported_params = PROFILES[profile]["params"]
+        exclude_pipes = PROFILES[profile]["exclude"]
+
+        if exclude_pipes is None:
+            # only tokenization and lemma lookup tables
+            self.nlp = sp.blank("de")
+            self.nlp.add_pipe("lemmatizer", config={"mode": "lookup"})
+            self.nlp.initialize()
+        elif model:
             self.nlp = sp.load(model, exclude=exclude_pipes)
         else:
             self.nlp = sp_model.load(exclude=exclude_pipes)
 
-        # Custom tokenization pattern for hashtags
-        pattern = r'#\w+|\w+-\w+'
+        # Add the custom tokenization pattern for hashtags and users to the tokenizer
+        add_hashtag_pattern(self.nlp, TWEET_TOKEN_PATTERN)
+
+        # Add the custom matcher for hashtags, users, URLs and retweets
+        self.nlp.add_pipe("tweet_syntax_matcher")
 
-        # Add the custom pattern to the tokenizer
-        add_hashtag_pattern(self.nlp, pattern)
 
-        # Add the custom matchers
-        self.nlp.add_pipe("hashtag_matcher")
-        self.nlp.add_pipe("user_matcher") 
+    def get_unsupported_params(self, params: any) -> list[str]:
+        """
+        Get the filter params which are set but can not be honored by the processing profile.
+
+        Parameters
+        ----------
+        params : object
+            The parameters on the basis of which filtering is performed.
+
+        Returns
+        -------
+        unsupported : list[str]
+            The names of the unsupported params.
+        """
+        return [p for p in ["pos_list", "entity_list", "hashtag", "user"] if params.get(p) and p not in self.supported_params]
            
 
     def invoke(self, text: str) -> sp.tokens.doc.Doc:
@@ -78,6 +142,104 @@ class TextProcessor:
         return self.nlp(text)
 
 
+    def invoke_many(self, texts: Iterable[str], batch_size: int = 256, n_process: int = 1) -> Iterator[sp.tokens.doc.Doc]:
+        """
+        Process a stream of texts with the pipeline in batches. The texts are consumed
+        and the docs are yielded lazily, hence memory stays bounded for arbitrarily long streams.
+
+        Parameters
+        ----------
+        texts : Iterable[str]
+            The input texts to process.
+        batch_size : int
+            The number of texts buffered and processed at once.
+        n_process : int
+            The number of processes to use. -1 uses all CPU cores.
+
+        Returns
+        -------
+        docs : Iterator[spacy.tokens.doc.Doc]
+            The processed `Doc` objects in the order of the input texts.
+        """
+        texts = (separate_hashtags(text) for text in texts)
+        yield from self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+
+
+
+    def analyze_many(self, texts: list[str], params: any, batch_size: int = 256, n_process: int = 1) -> list[dict]:
+        """
+        Process the texts and extract everything the pipeline needs from the docs: the text, the filtered
+        tokens and their lemmas as well as hashtags, users and entities. The analyses are cached by the
+        normalized text and the filter params, so repeated texts skip the SpaCy pipeline entirely.
+
+        Parameters
+        ----------
+        texts : list[str]
+            The input texts to process.
+        params : object
+            The parameters on the basis of which filtering is performed.
+        batch_size : int
+            The number of texts processed at once.
+        n_process : int
+            The number of processes to use.
+
+        Returns
+        -------
+        analyses : list[dict]
+            The analysis of each text.
+        """
+        keys = [self._get_analysis_key(text, params) for text in texts]
+
+        analyses = {}
+        for key in dict.fromkeys(keys):
+            analysis = self.analyses.get(key)
+            if analysis is not None:
+                analyses[key] = analysis
+
+        # the normalized text is only the cache key, the pipeline processes the first original text of each key
+        originals = {}
+        for key, text in zip(keys, texts):
+            originals.setdefault(key, text)
+
+        # process only the texts that are not cached
+        missing = [key for key in originals if key not in analyses]
+        for key, doc in zip(missing, self.invoke_many((originals[key] for key in missing), batch_size, n_process)):
+            analyses[key] = self._analyze(doc, params)
+            self.analyses.put(key, analyses[key])
+
+        return [{name: list(value) if isinstance(value, tuple) else value for name, value in analyses[key].items()} for key in keys]
+
+
+    def _get_analysis_key(self, text: str, params: any) -> tuple:
+        """
+        Compose the cache key of an analysis from the normalized text, the model, the profile and the filter params.
+        """
+        text = unicodedata.normalize("NFC", " ".join(text.split()))
+        return (
+            text,
+            self.model,
+            self.profile,
+            tuple(params["pos_list"]),
+            tuple(params["entity_list"]),
+            bool(params["hashtag"]),
+            bool(params["user"]),
+        )
+
+
+    def _analyze(self, doc: sp.tokens.doc.Doc, params: any) -> dict:
+        """
+        Extract the analysis of a doc in a compact form of plain strings and tuples.
+        """
+        tokens = self.get_filtered_tokens(doc, params)
+        return {
+            "text": doc.text,
+            "tokens": tuple(token.text for token in tokens),
+            "terms": tuple(self.trim_symbols(tokens)),
+            "hashtags": tuple(h.lower() for h in self.trim_symbols([t for t in doc if t._.is_hashtag])),
+            "users": tuple(self.trim_symbols([t for t in doc if t._.is_user])),
+            "entities": tuple(self.trim_symbols([t for t in doc if t.ent_type_])),
+        }
+
 
     def get_filtered_tokens(self, doc: sp.tokens.doc.Doc, params: any) -> list[sp.tokens.token.Token]:
         """
@@ -1,5 +1,13 @@
 import re
 from spacy.tokenizer import _get_regex_pattern
+from spacy.util import compile_prefix_regex
+
+# a hashtag symbol which directly follows some other character than a space
+_MISSING_GAP = re.compile(r"(?<=[^ ])#")
+
+# tokens which are not split, i.e. hashtags, users and hyphenated words. The pattern is anchored at the end,
+# since the tokenizer matches it at the start of a token, hence trailing punctuation is still split off
+TWEET_TOKEN_PATTERN = r"(?:#\w+|@\w+|\w+-\w+)$"
 
 
 def add_hashtag_pattern(nlp, pattern) -> None:
@@ -19,15 +27,21 @@ def add_hashtag_pattern(nlp, pattern) -> None:
     re_token_match = _get_regex_pattern(nlp.Defaults.token_match)
 
     # add your patterns
-    re_token_match = f"({re_token_match}|{pattern})"
+    re_token_match = f"({re_token_match}|{pattern})" if re_token_match else f"({pattern})"
 
     # overwrite token_match function of the tokenizer
     nlp.tokenizer.token_match = re.compile(re_token_match).match
 
+    # a leading '#' must not be split off as prefix, otherwise a hashtag followed by punctuation is split into '#' and the word
+    prefixes = [prefix for prefix in nlp.Defaults.prefixes if prefix != "#"]
+    nlp.tokenizer.prefix_search = compile_prefix_regex(prefixes).search
+
 
 def separate_hashtags(text: str) -> str:
     """
-    Insert a whitespace if hashtags are missing a gap in between. 
+    Insert a whitespace if hashtags are missing a gap in between.
+    Every '#' that is preceded by a character other than a space is prefixed with a space.
+    This is done in a single pass over the text.
 
     Parameters 
     ----------
@@ -39,11 +53,4 @@ def separate_hashtags(text: str) -> str:
     text: str
         The modified text.
     """
-
-    for i, j in enumerate(text):
-        if (text[i] == "#" and i > 0):
-            if text[i-1] != " ":
-                    text = text[:i] + " " + text[i:]
-                    i+=1
-    return text
-
+    return _MISSING_GAP.sub(" #", text)
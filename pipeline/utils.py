@@ -1,7 +1,11 @@
+import re
 import numpy as np
 
 from pathlib import Path
 
+# the pattern of the tokenizer of the index, see templates/es-config.tpl, and any whitespace such as line breaks
+WORD_SEPARATOR = re.compile(r"[\s -.,;:!?/#]")
+
 
 def get_project_root() -> Path:
     """
@@ -10,33 +14,206 @@ def get_project_root() -> Path:
     return Path(__file__).parent.parent
 
 
+def split_words(text: str) -> list[str]:
+    """
+    Split a text into lowercased words similar to the tokenizer and length filter of the index.
+
+    Returns
+    -------
+    words : list[str]
+        The words of the text.
+    """
+    return [word for word in WORD_SEPARATOR.split(text.lower()) if 2 <= len(word) <= 20]
+
+
 def pmi(total, w1, w2, w12) -> float:
     """
     Calculate the Point-wise Mutual Information as log(P(w12) / (P(w1) * P(w2))), where P(w1) 
     is the probability of w1 occurring, P(w2) is the probability of w2 occurring, and P(w1, w2) is 
     the probability of w1 and w2 occurring together.
+    All counts may be arrays to score many pairs at once. Pairs that never occur together
+    have a PMI of -inf.
 
     Returns
     -------
     pmi : float
         The Point-wise Mutual Information.
     """
-    p12 = w12 / total
-    p1 = w1 / total
-    p2 = w2 / total
-    return np.log2(p12 / (p1 * p2))
+    p12 = np.divide(w12, total)
+    p1 = np.divide(w1, total)
+    p2 = np.divide(w2, total)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.log2(p12 / (p1 * p2))
 
 
 def npmi(total, w1, w2, w12) -> float:
     """
-    Calculate the normalized Point-wise Mutual Information as log(P(w12) / (P(w1) * P(w2))), where P(w1) 
+    Calculate the normalized Point-wise Mutual Information as log(P(w12) / (P(w1) * P(w2))) / -log(P(w12)), where P(w1) 
     is the probability of w1 occurring, P(w2) is the probability of w2 occurring, and P(w1, w2) is 
     the probability of w1 and w2 occurring together.
+    All counts may be arrays to score many pairs at once. Pairs that never occur together
+    have a NPMI of -1.
 
     Returns
     -------
     npmi : float
         The normalized Point-wise Mutual Information.
     """
-    p12 = w12 / total
-    return pmi(total, w1, w2, w12) / -np.log2(p12)
\ No newline at end of file
+    p12 = np.divide(w12, total)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        score = pmi(total, w1, w2, w12) / -np.log2(p12)
+
+    # -1 for no co-occurrence, 1 if both terms occur in every document
+    return np.where(np.equal(w12, 0), -1.0, np.where(np.equal(p12, 1), 1.0, score))[()]
+
+
+def llr(total, w1, w2, w12) -> float:
+    """
+    Calculate Dunning's log-likelihood ratio (G²) of the contingency table of w1 and w2,
+    i.e. 2 * sum(O * log(O / E)) over the observed counts O and the counts E expected under independence.
+    All counts may be arrays to score many pairs at once.
+
+    Returns
+    -------
+    llr : float
+        The log-likelihood ratio.
+    """
+    total, w1, w2, w12 = (np.asarray(x, dtype=np.float64) for x in (total, w1, w2, w12))
+
+    observed = [w12, w1 - w12, w2 - w12, total - w1 - w2 + w12]
+    expected = [w1 * w2 / total, w1 * (total - w2) / total, (total - w1) * w2 / total, (total - w1) * (total - w2) / total]
+
+    # cells without observations do not contribute
+    g2 = sum(np.where(o > 0, o * np.log(np.where(o > 0, o, 1) / np.where(e > 0, e, 1)), 0) for o, e in zip(observed, expected))
+    return (2 * g2)[()]
+
+
+def chi2(total, w1, w2, w12) -> float:
+    """
+    Calculate Pearson's chi-squared statistic of the contingency table of w1 and w2.
+    All counts may be arrays to score many pairs at once.
+
+    Returns
+    -------
+    chi2 : float
+        The chi-squared statistic, 0 for terms that occur in none or all documents.
+    """
+    total, w1, w2, w12 = (np.asarray(x, dtype=np.float64) for x in (total, w1, w2, w12))
+
+    numerator = total * (w12 * (total - w1 - w2 + w12) - (w1 - w12) * (w2 - w12)) ** 2
+    denominator = w1 * w2 * (total - w1) * (total - w2)
+    return np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1), 0)[()]
+
+
+def dice(total, w1, w2, w12) -> float:
+    """
+    Calculate the Dice coefficient 2 * w12 / (w1 + w2). The total is not needed and only
+    accepted for a common signature of all measures.
+    All counts may be arrays to score many pairs at once.
+
+    Returns
+    -------
+    dice : float
+        The Dice coefficient.
+    """
+    w1, w2, w12 = (np.asarray(x, dtype=np.float64) for x in (w1, w2, w12))
+
+    denominator = w1 + w2
+    return np.where(denominator > 0, 2 * w12 / np.where(denominator > 0, denominator, 1), 0)[()]
+
+
+def select_scores(scores: np.ndarray, threshold: float = None, top_k: int = None) -> np.ndarray:
+    """
+    Select the scores that reach the threshold and of those at most the k best ones.
+    NaN scores are never selected.
+
+    Returns
+    -------
+    selected : np.ndarray
+        The indices of the selected scores in their original order.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+
+    if threshold is not None:
+        selected = np.flatnonzero(scores >= threshold)
+    else:
+        selected = np.flatnonzero(~np.isnan(scores))
+
+    if top_k is not None and len(selected) > top_k:
+        best = np.argpartition(-scores[selected], top_k - 1)[:top_k] if top_k > 0 else []
+        selected = np.sort(selected[best])
+
+    return selected
+
+
+def inverse_norms(norms: np.ndarray) -> np.ndarray:
+    """
+    The inverse of the L2-norm of each vector. Zero vectors have an inverse norm of 0 instead of infinity,
+    hence they stay zero when normalized and score 0 against any query instead of NaN.
+    """
+    norms = np.asarray(norms)
+    inverse = np.zeros(norms.shape, dtype=np.result_type(norms.dtype, np.float32))
+    np.divide(1, norms, out=inverse, where=norms > 0)
+    return inverse
+
+
+class TermCounts:
+    """
+    Document counts of single terms and term pairs as returned by adjacency matrix aggregations.
+    The terms are mapped to integer ids once and the counts are held in arrays, so that
+    the counts of many pairs can be looked up at once.
+    """
+
+    def __init__(self, co_occurrences: dict, separator: str = "&"):
+        """
+        Parameters
+        ----------
+        co_occurrences : dict
+            The counts by term and by pair of terms joined with the separator.
+        separator : str
+            The separator of pairs.
+        """
+        terms = [key for key in co_occurrences if separator not in key]
+        self.term_to_id = {term: i for i, term in enumerate(terms)}
+        self.counts = np.array([co_occurrences[term] for term in terms], dtype=np.int64)
+
+        # encode each pair in both orders as a * n + b
+        n = len(terms)
+        codes, counts = [], []
+        for key, count in co_occurrences.items():
+            if separator in key:
+                first, second = key.split(separator, 1)
+                if first in self.term_to_id and second in self.term_to_id:
+                    a, b = self.term_to_id[first], self.term_to_id[second]
+                    codes += [a * n + b, b * n + a]
+                    counts += [count, count]
+
+        order = np.argsort(codes)
+        self._codes = np.array(codes, dtype=np.int64)[order]
+        self._joint_counts = np.array(counts, dtype=np.int64)[order]
+
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.term_to_id
+
+
+    def get_ids(self, terms: list[str]) -> np.ndarray:
+        """
+        Map terms to their ids. All terms must be known.
+        """
+        return np.array([self.term_to_id[term] for term in terms], dtype=np.int64)
+
+
+    def get_joint_counts(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """
+        Get the number of documents in which the terms a[k] and b[k] occur together, for all k at once.
+        """
+        codes = a * len(self.counts) + b
+        positions = np.searchsorted(self._codes, codes)
+
+        found = positions < len(self._codes)
+        found[found] = self._codes[positions[found]] == codes[found]
+
+        joint = np.zeros(len(codes), dtype=np.int64)
+        joint[found] = self._joint_counts[positions[found]]
+        return joint
@@ -0,0 +1,64 @@
+import argparse
+import configparser
+import sys
+import os
+
+# add root directory in front of the path in order to make imports work, otherwise `pipeline` is scripts/pipeline.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.cooccurrence import CooccurrenceMatrix
+from pipeline.sources import PostgresSource
+from scripts.tweet_feeder import ATTRIBUTES, compose_tweet_query, pg_connect
+
+
+class TweetTexts:
+    """
+    The text and word count of each tweet of a source. Every iteration reads the source again,
+    as the co-occurrence matrix is built in two passes.
+    """
+
+    def __init__(self, source: PostgresSource, size: int = 10000):
+        self.source = source
+        self.size = size
+
+
+    def __iter__(self):
+        txt, word_count = ATTRIBUTES.index("txt"), ATTRIBUTES.index("word_count")
+        for row in self.source.rows(self.size):
+            yield row[txt], row[word_count]
+
+
+def main():
+    """
+    This script builds the term co-occurrence matrix from the same tweets that are ingested into the Elastic Search index.
+    The matrix allows to score expansion terms locally instead of running adjacency matrix aggregations.
+    """
+
+    # parse command line arguments
+    parser = argparse.ArgumentParser(description='Build a term co-occurrence matrix from Postgres data')
+    parser.add_argument('-t', '--table', required=True, help='Name of Postgres table')
+    parser.add_argument('-o', '--output', required=True, help='Directory to store the matrix in')
+    parser.add_argument('-pc', '--postgres_credentials', required=False, default="auth/pg-credentials.ini", help='Path to Postgres credentials file')
+    parser.add_argument('-wc', '--wordcount', required=False, default=25, help='Minimum number of words per Tweet')
+    parser.add_argument('-mc', '--min_count', required=False, default=5, type=int, help='Minimum number of Tweets per term')
+    parser.add_argument('-mv', '--max_vocab', required=False, default=200000, type=int, help='Maximum number of terms')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.postgres_credentials)
+
+    pg_client = pg_connect(credentials=config["POSTGRES"])
+
+    # stream the tweets with a server-side cursor, the query runs once per pass
+    print("Building co-occurrence matrix...")
+    with PostgresSource(pg_client, compose_tweet_query(args.table, args.wordcount), ATTRIBUTES, name="cooccurrence_builder") as source:
+        matrix = CooccurrenceMatrix.build(TweetTexts(source), min_count=args.min_count, max_vocab=args.max_vocab)
+    matrix.save(args.output)
+
+    print(f"Finished - stored {len(matrix.vocabulary)} terms and {len(matrix.data)} pairs in {args.output}")
+
+    pg_client.close()
+
+    exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import datetime
+import itertools
+import json
+import random
+import sqlite3
+import sys
+import os
+import time
+
+# add root directory in front of the path in order to make imports work, otherwise `pipeline` is scripts/pipeline.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.bulk import NDJSONSerializer, iterate_rows, orjson
+from pipeline.sources import open_source
+from scripts.tweet_feeder import ATTRIBUTES
+
+try:
+    from elasticsearch.helpers import expand_action
+    from elastic_transport import JsonSerializer
+except ImportError:
+    expand_action = JsonSerializer = None
+
+
+WORDS = ["Koalition", "Rente", "Klima", "Wahl", "Merkel", "SPD", "CDU", "Grüne", "FDP", "Steuer", "Digitalisierung", "Europa"]
+
+
+def create_table(rows: int, seed: int = 0) -> sqlite3.Connection:
+    """
+    Create an in-memory table of synthetic tweets in the shape of ATTRIBUTES. The columns are declared
+    such that SQLite returns the same Python types as the Postgres query of the feeder.
+    """
+    sqlite3.register_converter("hashtags", lambda value: json.loads(value))
+    connection = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES)
+    connection.execute(
+        "CREATE TABLE tweet (id INTEGER PRIMARY KEY, retweet_count INTEGER, reply_count INTEGER, like_count INTEGER, "
+        "created_at TIMESTAMP, txt TEXT, hashtags HASHTAGS, word_count INTEGER)"
+    )
+
+    random.seed(seed)
+    start = datetime.datetime(2021, 9, 1)
+
+    def tweets():
+        for i in range(rows):
+            words = random.choices(WORDS, k=random.randint(25, 45))
+            hashtags = [f"#{w}" for w in random.sample(WORDS, random.randint(0, 3))]
+            yield (i, random.randint(0, 500), random.randint(0, 50), random.randint(0, 2000),
+                   start + datetime.timedelta(seconds=i), " ".join(words + hashtags), json.dumps(hashtags), len(words))
+
+    connection.executemany("INSERT INTO tweet VALUES (?, ?, ?, ?, ?, ?, ?, ?)", tweets())
+    return connection
+
+
+def serialize_dicts(rows) -> int:
+    """
+    Serialize the rows like the former feeder, i.e. a dictionary per row that streaming_bulk
+    splits into an action and a document and serializes with the client's serializer.
+    """
+    if JsonSerializer is not None:
+        serializer = JsonSerializer()
+        dumps = serializer.dumps
+    else:
+        # the same settings as the JSON serializer of the client
+        dumps = lambda data: json.dumps(data, default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    size = 0
+    for doc in (dict(zip(ATTRIBUTES, row)) for row in rows):
+        if expand_action is not None:
+            action, data = expand_action(doc)
+        else:
+            doc = doc.copy()
+            action, data = {"index": {"_id": doc.pop("_id")}}, doc
+        size += len(dumps(action)) + len(dumps(data)) + 2
+    return size
+
+
+def serialize_rows(rows, use_orjson: bool) -> int:
+    """
+    Serialize the rows directly into bulk request lines.
+    """
+    serializer = NDJSONSerializer(ATTRIBUTES, use_orjson=use_orjson)
+    return sum(len(serializer.dumps(row)) for row in rows)
+
+
+def main():
+    """
+    This script compares the rows per second of the former dictionary based serialization of the feeder with the
+    direct NDJSON serialization on a synthetic SQLite table, or on a file of tweets. No database server or cluster is needed.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the serialization of the tweet feeder')
+    parser.add_argument('-n', '--rows', required=False, default=200000, type=int, help='Number of synthetic tweets')
+    parser.add_argument('-in', '--input', required=False, help='File of tweets to read instead of the synthetic table (.jsonl, .jsonl.gz, .parquet, .arrow)')
+    parser.add_argument('-fs', '--fetch_size', required=False, default=10000, type=int, help='Number of rows fetched at once')
+    parser.add_argument('-r', '--repeat', required=False, default=3, type=int, help='Number of repetitions, the best is reported')
+    args = parser.parse_args()
+
+    if args.input is not None:
+        def read_rows():
+            with open_source(args.input, ATTRIBUTES) as source:
+                yield from source.rows(args.fetch_size)
+
+        # the rows are read within the measurement, hence the reading of the file is included
+        sample = list(itertools.islice(read_rows(), 100))
+        args.rows = sum(1 for _ in read_rows())
+    else:
+        print(f"Creating {args.rows} synthetic tweets...")
+        connection = create_table(args.rows)
+        query = "SELECT id, retweet_count, reply_count, like_count, created_at, txt, hashtags, word_count FROM tweet ORDER BY id"
+
+        def read_rows():
+            cursor = connection.cursor()
+            cursor.execute(query)
+            yield from iterate_rows(cursor, size=args.fetch_size)
+
+        sample = connection.execute(query + " LIMIT 100").fetchall()
+
+    # verify that both paths produce the same documents
+    serializer = NDJSONSerializer(ATTRIBUTES, use_orjson=False)
+    for row in sample:
+        action, document = serializer.dumps(row).decode("utf-8").splitlines()
+        expected = dict(zip(ATTRIBUTES, row))
+        if isinstance(expected["created_at"], datetime.datetime):
+            expected["created_at"] = expected["created_at"].isoformat()
+        assert json.loads(action)["index"]["_id"] == str(expected.pop("_id"))
+        assert json.loads(document) == expected
+
+    variants = {
+        "dict + streaming_bulk serializer": serialize_dicts,
+        "ndjson template": lambda rows: serialize_rows(rows, use_orjson=False),
+    }
+    if orjson is not None:
+        variants["ndjson orjson"] = lambda rows: serialize_rows(rows, use_orjson=True)
+
+    baseline = None
+    for name, variant in variants.items():
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            size = variant(read_rows())
+            best = min(best, time.perf_counter() - start)
+
+        rate = args.rows / best
+        baseline = baseline or rate
+        print(f"{name:<34} {rate:>12,.0f} rows/s  {size / best / 2**20:>8.1f} MB/s  x{rate / baseline:.2f}")
+
+    if args.input is None:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,17 @@
 import os
+import sys
 import urllib.request
 import zipfile
 import gzip
 
 from gensim.models import KeyedVectors
 
+# add root directory in front of the path in order to make imports work, otherwise `pipeline` is scripts/pipeline.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.ann_index import IVFIndex
+from pipeline.embedding import WordEmbedding, QuantizedVectors, top_n_overlap
+from pipeline.utils import inverse_norms
+
 MODELS_PATH = "./models"
 
 
@@ -64,3 +71,101 @@ def compress(path: str, binary:bool = False) -> None:
     model = KeyedVectors.load_word2vec_format(path, binary=binary)
     model.fill_norms()
     model.save(f"{path}.model")
+
+
+def build_index(path: str, n_lists: int = None) -> None:
+    """
+    Build the approximate nearest neighbour index of a compressed model
+    and save it next to the model file.
+
+    path: str
+        The path of the compressed model file.
+
+    n_lists: int
+        The number of lists of the index.
+    """
+    print("Build index...")
+    model = KeyedVectors.load(path, mmap='r')
+    model.fill_norms()
+    index = IVFIndex.build(model.vectors, inverse_norms(model.norms), n_lists=n_lists)
+    index.save(path)
+
+
+def evaluate_index(path: str, terms: list, n: int, nprobes: list = [1, 2, 4, 8, 16, 32, 64]) -> list:
+    """
+    Report recall@n and latency of the approximate index against the exact search
+    for different numbers of scanned lists.
+
+    path: str
+        The path of the compressed model file.
+
+    terms: list
+        The terms to look up.
+
+    n: int
+        The number of similar terms per term.
+
+    nprobes: list
+        The numbers of scanned lists to evaluate.
+    """
+    exact = WordEmbedding(model=path)
+    approximate = WordEmbedding(model=path, nprobe=1)
+
+    report = []
+    for nprobe in nprobes:
+        approximate.nprobe = nprobe
+        result = top_n_overlap(exact, approximate, terms, n)
+        result["nprobe"] = nprobe
+        report.append(result)
+        print(f"nprobe={nprobe}: recall@{n}={result['recall']:.3f}, {result['candidate_ms']:.2f} ms/term (exact {result['reference_ms']:.2f} ms/term)")
+
+    return report
+
+
+def quantize(path: str, dtype: str = "int8") -> None:
+    """
+    Store the normalized vectors of a compressed model as float16 or as int8 with
+    a scale per row next to the model file.
+
+    path: str
+        The path of the compressed model file.
+
+    dtype: str
+        Either "float16" or "int8".
+    """
+    print(f"Quantize model to {dtype}...")
+    model = KeyedVectors.load(path, mmap='r')
+    QuantizedVectors.quantize(model, dtype).save(path)
+
+
+def evaluate_quantization(path: str, terms: list, n: int, dtypes: list = QuantizedVectors.DTYPES) -> list:
+    """
+    Report the overlap of the top n similar terms of the quantized models with the float32 model,
+    as well as their latency and the memory of the vectors.
+
+    path: str
+        The path of the compressed model file.
+
+    terms: list
+        The terms to look up.
+
+    n: int
+        The number of similar terms per term.
+
+    dtypes: list
+        The quantized models to evaluate.
+    """
+    exact = WordEmbedding(model=path)
+    exact_bytes = exact.model.vectors.nbytes
+
+    report = []
+    for dtype in dtypes:
+        quantized = WordEmbedding(model=path, dtype=dtype)
+        result = top_n_overlap(exact, quantized, terms, n)
+        result["dtype"] = dtype
+        result["bytes"] = quantized.model.vectors.nbytes + quantized._scale.nbytes
+        report.append(result)
+        print(f"{dtype}: overlap@{n}={result['recall']:.3f}, {result['candidate_ms']:.2f} ms/term (float32 {result['reference_ms']:.2f} ms/term), "
+              f"{exact_bytes / result['bytes']:.1f}x smaller")
+
+    return report
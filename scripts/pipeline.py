@@ -1,15 +1,28 @@
 import os
+import time
 import json
 import configparser
 
 from datetime import datetime
 
 from pipeline.text_processor import TextProcessor
-from pipeline.embedding import WordEmbedding
-from pipeline.elasticsearch import ElasticsearchClient
+from pipeline.embedding import WordEmbedding, ModelRegistry
+from pipeline.cache import SimilarTermsCache, ResultCache
+from pipeline.elasticsearch import ElasticsearchClient, AsyncElasticsearchClient
+from pipeline.cooccurrence import CooccurrenceMatrix
+from pipeline.output import RecordWriter, JSONWriter, open_writer
 
+# similar terms caches shared by all runs of this process
+_caches = {}
 
-def run(queries: list, embedding_params: json, elastic_params:json) -> json:
+# co-occurrence matrices shared by all runs of this process
+_cooccurrences = {}
+
+# search result caches shared by all runs of this process, one per index
+_result_caches = {}
+
+
+def run(queries: list, embedding_params: json, elastic_params:json, output_params: json = None) -> json:
     """
     Execute the complete Query Expansion Pipeline. This includes Query pre-processing, the application of Word Embeddings
     to find similar terms and the retrieval of Tweets.
@@ -26,13 +39,136 @@ def run(queries: list, embedding_params: json, elastic_params:json) -> json:
     elastic_params:json
         Parameters defining elastic-specific configurations.
 
+    output_params: json
+        Parameters defining the output format, see `_open_results`. By default, indented JSON is written.
+
     Returns
     ----------
     res: json
         The resulting Tweets.
     """    
-    # prepare logging
-    log = {
+    log = _create_log(queries, embedding_params, elastic_params)
+    out_path = _get_output_path(embedding_params)
+    analyses, query_terms, similar_terms = _expand_queries(queries, embedding_params, log)
+
+
+    # ------------------ ELASTIC SEARCH ------------------
+    print('Connecting to Elastic Search...')
+
+    # connect to Elastic Search
+    es_client = ElasticsearchClient(credentials=_read_credentials(), index=elastic_params["index"], result_cache=_get_result_cache(elastic_params))
+
+    print('Retrieving Tweets...')
+
+    # find most suitable expansion terms for all queries at once
+    expansion_terms = es_client.get_expansion_terms_batch(query_terms, similar_terms, cooccurrences=_load_cooccurrences(elastic_params))
+    log["expansion_terms"] = expansion_terms
+
+    searches = _compose_searches(analyses, query_terms, expansion_terms, elastic_params)
+
+    with _open_results(out_path, output_params) as writer:
+        if elastic_params.get("stream_hits"):
+            # stream all hits of each query into the output directory
+            results = _stream_tweets(es_client, searches, out_path, elastic_params["stream_hits"], output_params)
+        else:
+            # execute the final expanded queries of all queries in multi search requests
+            results = es_client.get_tweets_many(searches)
+
+        for i, tweets in enumerate(results):
+            _write_result(writer, i, tweets)
+
+    if es_client.result_cache is not None:
+        log["result_cache"] = es_client.result_cache.stats()
+    
+    del es_client
+
+    _write_log(out_path, log, output_params)
+
+    return results
+
+
+async def run_async(queries: list, embedding_params: json, elastic_params: json, on_result=None, output_params: json = None) -> json:
+    """
+    Execute the complete Query Expansion Pipeline like `run`, but retrieve the Tweets of all queries concurrently
+    with an asynchronous client. The latency of the retrieval approaches that of the slowest query.
+
+    Parameters
+    ----------
+    queries: list
+        A list of queries.
+
+    embedding_params: json
+        Parameters defining embedding-specific configurations.
+
+    elastic_params:json
+        Parameters defining elastic-specific configurations. `max_concurrency` bounds the number of concurrent searches.
+
+    on_result: func
+        If set, called with the position of a query and its Tweets as soon as the query finished.
+
+    output_params: json
+        Parameters defining the output format, see `_open_results`. With JSON Lines, the Tweets of each
+        query are written as soon as the query finished.
+
+    Returns
+    ----------
+    res: json
+        The resulting Tweets.
+    """
+    log = _create_log(queries, embedding_params, elastic_params)
+    out_path = _get_output_path(embedding_params)
+    analyses, query_terms, similar_terms = _expand_queries(queries, embedding_params, log)
+
+
+    # ------------------ ELASTIC SEARCH ------------------
+    print('Connecting to Elastic Search...')
+
+    es_client = AsyncElasticsearchClient(credentials=_read_credentials(), index=elastic_params["index"],
+                                         max_concurrency=elastic_params.get("max_concurrency", 8))
+
+    print('Retrieving Tweets...')
+
+    try:
+        expansion_terms = await es_client.get_expansion_terms_batch(query_terms, similar_terms, cooccurrences=_load_cooccurrences(elastic_params))
+        log["expansion_terms"] = expansion_terms
+
+        results = [None] * len(queries)
+        log["retrieval_s"] = [None] * len(queries)
+        start = time.perf_counter()
+
+        # the searches run concurrently, the results are handed out as soon as each query finished
+        searches = _compose_searches(analyses, query_terms, expansion_terms, elastic_params)
+        completed = es_client.get_tweets_as_completed(searches)
+        with _open_results(out_path, output_params) as writer:
+            try:
+                async for i, tweets in completed:
+                    results[i] = tweets
+                    log["retrieval_s"][i] = time.perf_counter() - start
+                    if not isinstance(writer, JSONWriter):
+                        _write_result(writer, i, tweets)
+                    if on_result is not None:
+                        on_result(i, tweets)
+            finally:
+                # cancel the searches which are still running if writing a result failed
+                await completed.aclose()
+
+            # a JSON list keeps the order of the queries
+            if isinstance(writer, JSONWriter):
+                for i, tweets in enumerate(results):
+                    _write_result(writer, i, tweets)
+    finally:
+        await es_client.close()
+
+    _write_log(out_path, log, output_params)
+
+    return results
+
+
+def _create_log(queries: list, embedding_params: json, elastic_params: json) -> json:
+    """
+    Prepare the log of a run.
+    """
+    return {
         "timestamp": datetime.now().strftime("%d-%m-%y_%H:%M:%S"),
         "queries": queries,
         "embedding_params": embedding_params,
@@ -40,93 +176,227 @@ def run(queries: list, embedding_params: json, elastic_params:json) -> json:
     }
 
 
+def _expand_queries(queries: list, embedding_params: json, log: json) -> tuple[list, list, list]:
+    """
+    Process the queries and find the similar terms of their terms.
+
+    Returns
+    ----------
+    expansion: tuple[list, list, list]
+        The analyses, the terms and the similar terms of each query.
+    """
     # ------------------ TEXT PROCESSING ------------------ 
     print('Processing text using SpaCy...')
-    text_processor = TextProcessor()
+    text_processor = TextProcessor(profile=embedding_params.get("profile", "full"))
 
-    docs = []
+    unsupported = text_processor.get_unsupported_params(embedding_params)
+    if unsupported:
+        print(f'Profile {text_processor.profile} ignores the params {unsupported}')
 
-    # for each query, invoke the SpaCy pipeline
-    for query in queries:
-        doc = text_processor.invoke(query)
-        docs.append(doc)
-    log["docs"] = [d.text for d in docs]
+    # invoke the SpaCy pipeline on all queries in batches and filter the tokens depending on the specified parameters,
+    # repeated queries are served from the cache of the text processor
+    analyses = text_processor.analyze_many(queries, embedding_params, batch_size=embedding_params.get("batch_size", 256), n_process=embedding_params.get("n_process", 1))
+    log["docs"] = [a["text"] for a in analyses]
+    log["query_tokens"] = [a["tokens"] for a in analyses]
+    log["analysis_cache"] = text_processor.analyses.stats()
 
-
-    query_tokens = []
-
-    # for each processed query, filter the tokens depending on the specified parameters
-    for doc in docs:
-        filtered_tokens = text_processor.get_filtered_tokens(doc, embedding_params)
-        query_tokens.append(filtered_tokens)
-    log["query_tokens"] = [[token.text for token in tokens] for tokens in query_tokens]
+    query_terms = [a["terms"] for a in analyses]
 
 
     # ------------------ WORD EMBEDDINGS ------------------
     print(f'Evaluating {embedding_params["type"]} model...')
-    model = WordEmbedding(model=embedding_params["model"])
+    cache = None
+    if embedding_params.get("cache"):
+        # only open the cache once, every instance holds its own database connection
+        if embedding_params["cache"] not in _caches:
+            _caches[embedding_params["cache"]] = SimilarTermsCache(embedding_params["cache"])
+        cache = _caches[embedding_params["cache"]]
+
+    # the model stays resident in the registry for subsequent runs
+    resident = ModelRegistry.is_loaded(embedding_params["model"], embedding_params.get("dtype"))
+    start = time.perf_counter()
+    model = WordEmbedding(
+        model=embedding_params["model"],
+        nprobe=embedding_params.get("nprobe"),
+        cache=cache,
+        prefault=embedding_params.get("prefault", False),
+        dtype=embedding_params.get("dtype"))
+    load_time = time.perf_counter() - start
+
+    # find similar terms for all queries at once using embedding model
+    similar_terms = model.get_similar_terms_batch(query_terms, embedding_params["num_nearest_terms"])
+    elapsed = time.perf_counter() - start
+    log["similar_terms"] = similar_terms
 
-    similar_terms = []
+    # the terms of all queries are looked up in one batch, hence there is no latency of a single query
+    log["embedding_timings"] = {
+        "resident": resident,
+        "load_s": load_time,
+        "batch_lookup_s": elapsed - load_time,
+        "total_s": elapsed,
+    }
+    print(f'Similar terms of {len(query_terms)} queries found after {log["embedding_timings"]["total_s"]:.2f}s ({"warm" if resident else "cold"} model)')
 
-    # find similar terms using embedding model 
-    for tokens in query_tokens:
-        similar_terms.append(model.get_similar_terms(text_processor.trim_symbols(tokens), embedding_params["num_nearest_terms"]))
-    log["similar_terms"] = similar_terms
+    if cache is not None:
+        log["similar_terms_cache"] = cache.stats()
 
-    # free space
-    del model
+    return analyses, query_terms, similar_terms
 
 
-    # ------------------ ELASTIC SEARCH ------------------
-    # read Elastic Search credentials
+def _read_credentials() -> configparser.SectionProxy:
+    """
+    Read the Elastic Search credentials.
+    """
     config = configparser.ConfigParser()
     config.read('auth/es-credentials.ini')
+    return config["ELASTIC"]
 
-    print('Connecting to Elastic Search...')
 
-    # connect to Elastic Search
-    es_client = ElasticsearchClient(credentials=config["ELASTIC"], index=elastic_params["index"])
+def _load_cooccurrences(elastic_params: json) -> CooccurrenceMatrix:
+    """
+    Get the co-occurrence matrix built at ingest time, if configured, to score known terms locally.
+    """
+    if not elastic_params.get("cooccurrence"):
+        return None
 
-    print('Retrieving Tweets...')
+    if elastic_params["cooccurrence"] not in _cooccurrences:
+        _cooccurrences[elastic_params["cooccurrence"]] = CooccurrenceMatrix.load(elastic_params["cooccurrence"])
+    return _cooccurrences[elastic_params["cooccurrence"]]
 
-    expansion_terms = []
 
-    # find most suitable expansion terms
-    for i in range(len(queries)):
-        expansion_terms.append(es_client.get_expansion_terms(text_processor.trim_symbols(query_tokens[i]), similar_terms[i]))
-    log["expansion_terms"] = expansion_terms
+def _get_result_cache(elastic_params: json) -> ResultCache:
+    """
+    Get the search result cache of the index, if configured. `result_cache` is either true or the
+    keyword arguments of the cache, e.g. {"max_bytes": 67108864, "stale_while_revalidate": true}.
+    """
+    if not elastic_params.get("result_cache"):
+        return None
 
-    results = []
+    if elastic_params["index"] not in _result_caches:
+        options = elastic_params["result_cache"] if isinstance(elastic_params["result_cache"], dict) else {}
+        _result_caches[elastic_params["index"]] = ResultCache(**options)
+    return _result_caches[elastic_params["index"]]
 
-    # execute query to retrieve tweets using the final expanded query
-    for i in range(len(queries)):
+
+def _compose_searches(analyses: list, query_terms: list, expansion_terms: list, elastic_params: json) -> list:
+    """
+    Compose the search params of each query using the final expanded query.
+    """
+    searches = []
+    for i in range(len(analyses)):
         search = elastic_params.copy()
-        search["terms"] = text_processor.trim_symbols(query_tokens[i]) + expansion_terms[i]
-        search["hashtags"] = [h.lower() for h in text_processor.trim_symbols([t for t in docs[i] if t._.is_hashtag ])]
-        search["users"] = text_processor.trim_symbols([t for t in docs[i] if t._.is_user ])
-        search["entities"] = text_processor.trim_symbols([t for t in docs[i] if t.ent_type_ ])
+        search["terms"] = query_terms[i] + expansion_terms[i]
+        search["hashtags"] = analyses[i]["hashtags"]
+        search["users"] = analyses[i]["users"]
+        search["entities"] = analyses[i]["entities"]
+        searches.append(search)
+    return searches
 
-        results.append(es_client.get_tweets(search))
-    
-    del es_client
 
-    # ------------------ LOG RESULTS ------------------
+def _get_output_path(embedding_params: json) -> str:
+    """
+    Get the output directory of a run, named after the embedding and the execution date.
+    """
     now = datetime.now().strftime('%d-%m-%y_%H-%M-%S')
-    out_path = os.path.join("output", embedding_params["type"], now)
-    
-    print(f'Writing results to {out_path}')
+    return os.path.join("output", embedding_params["type"], now)
+
+
+def _stream_tweets(es_client: ElasticsearchClient, searches: list, out_path: str, max_hits, output_params: json = None) -> list:
+    """
+    Stream the tweets of each query into `hits` within the output directory, by default as JSON Lines with one hit
+    per line. Memory stays bounded, because only the first page of each query is kept for the results.
+
+    Parameters
+    ----------
+    es_client: ElasticsearchClient
+        The client to retrieve the tweets with.
 
+    searches: list
+        The search params of each query.
+
+    out_path: str
+        The output directory.
+
+    max_hits: int
+        The maximum number of hits per query, true to stream all hits.
+
+    output_params: json
+        `hits` sets the format of the hits, e.g. "columnar" for Parquet or NumPy arrays.
+
+    Returns
+    ----------
+    res: list
+        The number of hits, the duration in milliseconds and the first page of tweets of each query.
+    """
+    output_params = output_params or {}
     if not os.path.exists(out_path):
         os.makedirs(out_path)
 
-    with open(os.path.join(out_path, "log.json"), "w") as file:
-        json.dump(log, file, ensure_ascii=False, indent=4)
-    file.close()
+    results = []
 
-    with open(os.path.join(out_path, "results.json"), "w") as file:
-        json.dump(results, file, ensure_ascii=False, indent=4)
-    file.close()
+    with open_writer(os.path.join(out_path, "hits"), output_params.get("hits", "jsonl"), output_params.get("compression")) as writer:
+        for i, search in enumerate(searches):
+            start = time.perf_counter()
+            page_size = search["num_of_tweets"] or 10
+            tweets = []
+            count = 0
 
-    print('Finished!')
+            for hit in es_client.iter_tweets(search, max_hits=None if max_hits is True else max_hits):
+                writer.write({"query": i, **hit})
+                if count < page_size:
+                    tweets.append(hit)
+                count += 1
+
+            writer.flush()
+            results.append({"hits": count, "took": round((time.perf_counter() - start) * 1000), "tweets": tweets})
+
+    return results
+
+
+def _open_results(out_path: str, output_params: json = None) -> RecordWriter:
+    """
+    Open the writer of the results within the output directory.
+
+    Parameters
+    ----------
+    out_path: str
+        The output directory.
+
+    output_params: json
+        `format` is either "json" (a single indented list, the default) or "jsonl" (one record per query,
+        written as soon as it is available) and `compression` is either None, "gzip" or "zstd".
+
+    Returns
+    ----------
+    writer: RecordWriter
+        The writer of the results.
+    """
+    output_params = output_params or {}
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+
+    print(f'Writing results to {out_path}')
+
+    return open_writer(os.path.join(out_path, "results"), output_params.get("format", "json"), output_params.get("compression"))
+
+
+def _write_result(writer: RecordWriter, i: int, tweets: json) -> None:
+    """
+    Write the Tweets of a query. JSON Lines records carry the position of the query, a JSON list keeps the order.
+    The record is flushed, hence finished queries are readable while the run continues.
+    """
+    writer.write(tweets if isinstance(writer, JSONWriter) else {"query": i, **tweets})
+    writer.flush()
 
-    return results
\ No newline at end of file
+
+def _write_log(out_path: str, log: json, output_params: json = None) -> None:
+    """
+    Write the log of a run to the output directory.
+    """
+    # ------------------ LOG RESULTS ------------------
+    compact = (output_params or {}).get("format", "json") != "json"
+
+    with open(os.path.join(out_path, "log.json"), "w") as file:
+        json.dump(log, file, ensure_ascii=False, indent=None if compact else 4)
+
+    print('Finished!')
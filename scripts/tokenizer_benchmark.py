@@ -0,0 +1,70 @@
+import argparse
+import random
+import sys
+import os
+import time
+
+# add root directory in front of the path in order to make imports work, otherwise `pipeline` is scripts/pipeline.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.tokenizer.tweet_tokenizer import separate_hashtags
+
+
+WORDS = ["Koalition", "Rente", "Klima", "Wahl", "Merkel", "SPD", "CDU", "Grüne", "FDP", "Steuer", "Digitalisierung", "Europa"]
+
+
+def separate_hashtags_loop(text: str) -> str:
+    """
+    The former implementation of separate_hashtags, which rebuilds the text on every insertion.
+    """
+    for i, j in enumerate(text):
+        if (text[i] == "#" and i > 0):
+            if text[i-1] != " ":
+                    text = text[:i] + " " + text[i:]
+                    i+=1
+    return text
+
+
+def create_texts(count: int, hashtags: int, seed: int = 0) -> list[str]:
+    """
+    Create tweets of about 30 words, followed by a number of hashtags without a gap in between.
+    """
+    random.seed(seed)
+    return [
+        " ".join(random.choices(WORDS, k=30)) + "".join("#" + word for word in random.choices(WORDS, k=hashtags))
+        for _ in range(count)
+    ]
+
+
+def measure(function, texts: list[str], repeat: int) -> float:
+    """
+    The best time of some repetitions to apply a function to all texts.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            function(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """
+    This script compares the texts per second of the former and the current separate_hashtags
+    for an increasing number of hashtags per text.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the separation of hashtags')
+    parser.add_argument('-n', '--texts', required=False, default=2000, type=int, help='Number of synthetic tweets')
+    parser.add_argument('-ht', '--hashtags', required=False, default=[1, 10, 100, 1000], type=int, nargs='+', help='Numbers of hashtags per tweet')
+    parser.add_argument('-r', '--repeat', required=False, default=3, type=int, help='Number of repetitions, the best is reported')
+    args = parser.parse_args()
+
+    for hashtags in args.hashtags:
+        texts = create_texts(args.texts, hashtags)
+        before = measure(separate_hashtags_loop, texts, args.repeat)
+        after = measure(separate_hashtags, texts, args.repeat)
+        print(f"{hashtags:>5} hashtags: loop {args.texts / before:>10,.0f} texts/s  regex {args.texts / after:>10,.0f} texts/s  x{before / after:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,19 +4,37 @@ import configparser
 import sys
 import os
 import json
+import re
+import time
 import psycopg2
 
+from typing import Iterable, Iterator
+from collections import Counter
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from elasticsearch.helpers import streaming_bulk
 from elasticsearch import Elasticsearch
 from tqdm import tqdm
 
-# add root directory (temporary) to path in order to make imports work
-#sys.path.append(os.path.dirname(sys.path[0]))
-#from pipeline.utils import get_project_root
+# add root directory in front of the path in order to make imports work, otherwise `pipeline` is scripts/pipeline.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.utils import split_words
+from pipeline.bulk import NDJSONSerializer, bulk_rows
+from pipeline.sources import PostgresSource, open_source
+from pipeline.elasticsearch import STATISTICS_ID, get_statistics_index, get_index_generation, count_terms
 
 # mapped attributes
 ATTRIBUTES = ["_id", "retweet_count", "reply_count", "like_count", "created_at", "txt", "hashtags", "word_count"]
 
+# attributes selected by the delta query, the word count is added afterwards
+DELTA_ATTRIBUTES = [attribute for attribute in ATTRIBUTES if attribute != "word_count"]
+
+# key of the ingestion watermark within the _meta of the index mapping
+WATERMARK_KEY = "feeder_watermark"
+
+# characters removed before counting words, like regexp_replace(txt, '[^\w\s]', '', 'g') in Postgres
+_NON_WORD = re.compile(r"[^\w\s]")
+
 
 def iterate(cursor, attributes, size=1000):
     """
@@ -35,6 +53,552 @@ def iterate(cursor, attributes, size=1000):
             yield obj
 
 
+def compose_tweet_query(table: str, wordcount: int, id_range: tuple[int, int] = None, after_id: int = None) -> str:
+    """
+    Compose the query to retrieve tweets in the shape of ATTRIBUTES, i.e. with their corresponding
+    hashtags and word count, restricted to tweets with a minimum number of words.
+    If an id range [start, end) is given, only the tweets of this range are retrieved in the order of their
+    id, optionally starting after some id.
+    """
+    conditions = []
+    if id_range is not None:
+        conditions += [f"tw.id >= {int(id_range[0])}", f"tw.id < {int(id_range[1])}"]
+    if after_id is not None:
+        conditions.append(f"tw.id > {int(after_id)}")
+
+    return (
+        "SELECT * FROM ( "
+            "SELECT tw.id, tw.retweet_count, tw.reply_count, tw.like_count, "
+            "tw.created_at, tw.txt, array_agg(ht.txt) AS hashtags, "
+            "array_length(string_to_array(regexp_replace(tw.txt,  '[^\w\s]', '', 'g'), ' '), 1) AS word_count "
+            f"FROM {table} tw "
+            "LEFT OUTER JOIN hashtag_posting hp ON hp.tweet_id = tw.id "
+            "LEFT OUTER JOIN hashtag ht ON ht.id = hp.hashtag_id "
+            + (f"WHERE {' AND '.join(conditions)} " if conditions else "") +
+            "GROUP BY tw.id "
+        ") as q "
+        f"WHERE q.word_count >= {wordcount} "
+        + ("ORDER BY q.id " if id_range is not None else "")
+    )
+
+
+def get_id_ranges(pg_cursor, table: str, partitions: int) -> list[tuple[int, int]]:
+    """
+    Split the ids of a table into evenly sized ranges [start, end).
+    """
+    pg_cursor.execute(f"SELECT min(id), max(id) FROM {table}")
+    low, high = pg_cursor.fetchone()
+    if low is None:
+        return []
+
+    step = max(1, -(-(high - low + 1) // partitions))
+    return [(start, min(start + step, high + 1)) for start in range(low, high + 1, step)]
+
+
+def read_checkpoint(path: str) -> json:
+    """
+    Read the checkpoint of a partition, None if there is none.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def write_checkpoint(path: str, checkpoint: json) -> None:
+    """
+    Write the checkpoint of a partition atomically, so that an interruption never leaves a broken file.
+    """
+    with open(path + ".tmp", "w") as file:
+        json.dump(checkpoint, file)
+    os.replace(path + ".tmp", path)
+
+
+def remove_checkpoints(checkpoint_dir: str, partitions: int) -> None:
+    """
+    Remove the ranges and the checkpoints of the partitions of a finished run, so that the next run splits the table
+    again. Other files, e.g. the state of a bulk load, are kept, the directory is only removed once it is empty.
+    """
+    for name in ["partitions.json"] + [f"partition-{partition}.json" for partition in range(partitions)]:
+        if os.path.exists(os.path.join(checkpoint_dir, name)):
+            os.remove(os.path.join(checkpoint_dir, name))
+
+    if not os.listdir(checkpoint_dir):
+        os.rmdir(checkpoint_dir)
+
+
+def bulk_ingest(es_client: Elasticsearch, rows: Iterable[tuple], args: argparse.Namespace, vocabulary: Counter) -> Iterator[tuple[int, int, int]]:
+    """
+    Ingest rows in the shape of ATTRIBUTES in chunks while counting the vocabulary.
+    By default the rows are serialized directly into bulk requests (`ndjson`), `dict` builds a
+    dictionary per row and passes it to `streaming_bulk`.
+
+    Returns
+    -------
+    chunks : Iterator[tuple[int, int, int]]
+        The number of tweets, the number of bytes and the last id of each committed chunk.
+    """
+    if args.serializer == "ndjson":
+        rows = count_vocabulary(rows, vocabulary, key=ATTRIBUTES.index("txt"))
+        for docs, size, last in bulk_rows(es_client, args.index, rows, NDJSONSerializer(ATTRIBUTES), args.chunk_size, args.max_chunk_bytes):
+            yield docs, size, int(last[ATTRIBUTES.index("_id")])
+        return
+
+    docs, size, last_id = 0, 0, None
+
+    def measure(docs_iter):
+        nonlocal size
+        for doc in docs_iter:
+            size += len(json.dumps(doc, default=str))
+            yield doc
+
+    actions = measure(count_vocabulary((dict(zip(ATTRIBUTES, row)) for row in rows), vocabulary))
+    for ok, action in streaming_bulk(client=es_client, index=args.index, actions=actions,
+                                     chunk_size=args.chunk_size, max_chunk_bytes=args.max_chunk_bytes):
+        docs += 1
+        last_id = int(action["index"]["_id"])
+        if docs >= args.chunk_size:
+            yield docs, size, last_id
+            docs, size = 0, 0
+
+    if docs:
+        yield docs, size, last_id
+
+
+def ingest_partition(partition: int, id_range: tuple[int, int], args: argparse.Namespace) -> tuple[Counter, int]:
+    """
+    Ingest the tweets of an id range with a server-side cursor. The last id committed to the index is checkpointed
+    after every chunk, hence an interrupted partition resumes after it. This function runs in a worker process.
+
+    Returns
+    -------
+    ingested : tuple[Counter, int]
+        The number of documents each word occurs in and the number of tweets, both for the tweets ingested by this call.
+    """
+    checkpoint_path = os.path.join(args.checkpoints, args.index, f"partition-{partition}.json")
+    checkpoint = read_checkpoint(checkpoint_path) or {"range": list(id_range), "last_id": None, "docs": 0, "bytes": 0, "done": False}
+
+    vocabulary = Counter()
+    if checkpoint["done"]:
+        print(f"Partition {partition} {id_range} already ingested, skipping")
+        return vocabulary, 0
+
+    config = configparser.ConfigParser()
+    config.read([args.elastic_credentials, args.postgres_credentials])
+    es_client = es_connect(credentials=config["ELASTIC"])
+    pg_client = pg_connect(credentials=config["POSTGRES"])
+
+    # a named cursor keeps the result set on the server and transfers it in batches
+    query = compose_tweet_query(args.table, args.wordcount, id_range, checkpoint["last_id"])
+    source = PostgresSource(pg_client, query, ATTRIBUTES, name=f"tweet_feeder_{partition}")
+
+    start = time.perf_counter()
+    docs, total_size, reported = 0, 0, 0
+
+    # the tweets are ordered by id and the chunks are committed in order, failures raise an error
+    for chunk_docs, chunk_bytes, last_id in bulk_ingest(es_client, source.rows(args.fetch_size), args, vocabulary):
+        docs += chunk_docs
+        total_size += chunk_bytes
+
+        checkpoint["last_id"] = last_id
+        checkpoint["docs"] += chunk_docs
+        checkpoint["bytes"] += chunk_bytes
+        write_checkpoint(checkpoint_path, checkpoint)
+
+        if docs - reported >= args.report_every:
+            reported = docs
+            elapsed = time.perf_counter() - start
+            print(f"Partition {partition}: {docs} tweets, {docs / elapsed:.0f} docs/s, {total_size / elapsed / 2**20:.2f} MB/s")
+
+    checkpoint["done"] = True
+    write_checkpoint(checkpoint_path, checkpoint)
+
+    elapsed = time.perf_counter() - start
+    print(f"Partition {partition} finished - ingested {docs} tweets in {elapsed:.0f}s "
+          f"({docs / max(elapsed, 1e-9):.0f} docs/s, {total_size / max(elapsed, 1e-9) / 2**20:.2f} MB/s)")
+
+    source.close()
+    pg_client.close()
+    es_client.close()
+
+    return vocabulary, docs
+
+
+def ingest_partitioned(pg_client, args: argparse.Namespace) -> tuple[Counter, int]:
+    """
+    Split the table into id ranges and ingest them with a pool of worker processes. The ranges of a run are
+    stored next to the checkpoints, so that a resumed run uses the same ranges. Once all partitions are ingested,
+    the ranges and the checkpoints are removed, hence the next run ingests the table from scratch.
+
+    Returns
+    -------
+    ingested : tuple[Counter, int]
+        The number of documents each word occurs in and the number of tweets, both for the tweets ingested by this run.
+    """
+    checkpoint_dir = os.path.join(args.checkpoints, args.index)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    ranges_path = os.path.join(checkpoint_dir, "partitions.json")
+    ranges = read_checkpoint(ranges_path)
+    if ranges is None:
+        ranges = get_id_ranges(pg_client.cursor(), args.table, args.partitions)
+        write_checkpoint(ranges_path, ranges)
+    else:
+        print(f"Resuming ingestion of {len(ranges)} partitions from {checkpoint_dir}")
+
+    print(f"Ingesting {len(ranges)} partitions with {args.workers} workers...")
+
+    start = time.perf_counter()
+    vocabulary = Counter()
+    ingested = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(ingest_partition, partition, tuple(id_range), args) for partition, id_range in enumerate(ranges)]
+        for future in as_completed(futures):
+            partition_vocabulary, partition_docs = future.result()
+            vocabulary.update(partition_vocabulary)
+            ingested += partition_docs
+
+    checkpoints = [read_checkpoint(os.path.join(checkpoint_dir, f"partition-{partition}.json")) for partition in range(len(ranges))]
+    docs = sum(c["docs"] for c in checkpoints)
+    size = sum(c["bytes"] for c in checkpoints)
+    elapsed = time.perf_counter() - start
+    print(f"Finished - {docs} tweets in all partitions, this run took {elapsed:.0f}s ({size / 2**20:.1f} MB)")
+
+    # a failed partition raises above, hence the checkpoints are only removed if all partitions finished
+    remove_checkpoints(checkpoint_dir, len(ranges))
+
+    return vocabulary, ingested
+
+
+def count_words(text: str) -> int:
+    """
+    Count the words of a text like the feeder query does in Postgres, i.e.
+    array_length(string_to_array(regexp_replace(txt, '[^\\w\\s]', '', 'g'), ' '), 1).
+    Returns None for missing or empty texts, as Postgres does.
+    """
+    if text is None:
+        return None
+
+    text = _NON_WORD.sub("", text)
+    if not text:
+        return None
+
+    return len(text.split(" "))
+
+
+def compose_delta_query(table: str) -> str:
+    """
+    Compose the query to retrieve the tweets created since some date with their hashtags in the shape of
+    DELTA_ATTRIBUTES, ordered by (created_at, id). The word count is not computed in SQL, see `read_delta`.
+    The query expects the parameter created_after.
+    """
+    return (
+        "SELECT tw.id, tw.retweet_count, tw.reply_count, tw.like_count, "
+        "tw.created_at, tw.txt, array_agg(ht.txt) AS hashtags "
+        f"FROM {table} tw "
+        "LEFT OUTER JOIN hashtag_posting hp ON hp.tweet_id = tw.id "
+        "LEFT OUTER JOIN hashtag ht ON ht.id = hp.hashtag_id "
+        "WHERE tw.created_at >= %(created_after)s "
+        "GROUP BY tw.id "
+        "ORDER BY tw.created_at, tw.id "
+    )
+
+
+def add_word_counts(docs, wordcount: int):
+    """
+    Compute the word count of each document and pass on the documents with a minimum number of words.
+    """
+    for doc in docs:
+        doc["word_count"] = count_words(doc["txt"])
+        if doc["word_count"] is not None and doc["word_count"] >= wordcount:
+            yield doc
+
+
+def read_delta(cursor, wordcount: int, size: int = 1000) -> Iterator[json]:
+    """
+    Read the tweets of an executed delta query as documents in the shape of ATTRIBUTES, only those with a minimum number of words.
+    """
+    return add_word_counts(iterate(cursor=cursor, attributes=DELTA_ATTRIBUTES, size=size), wordcount)
+
+
+def get_watermark(es: Elasticsearch, index: str) -> json:
+    """
+    Get the watermark of the last incremental ingestion, i.e. the (created_at, id) of the latest ingested tweet.
+    """
+    mappings = next(iter(es.indices.get_mapping(index=index).values()))["mappings"]
+    return mappings.get("_meta", {}).get(WATERMARK_KEY)
+
+
+def set_watermark(es: Elasticsearch, index: str, watermark: json) -> None:
+    """
+    Store the watermark in the _meta of the index mapping. Other entries of _meta are kept.
+    """
+    mappings = next(iter(es.indices.get_mapping(index=index).values()))["mappings"]
+    meta = dict(mappings.get("_meta", {}))
+    meta[WATERMARK_KEY] = watermark
+    es.indices.put_mapping(index=index, meta=meta)
+
+
+def count_range_statistics(es: Elasticsearch, index: str, terms: list[str], since: str) -> json:
+    """
+    Count the total word count and the document frequencies of terms of the tweets created since some date.
+    """
+    query = {"range": {"created_at": {"gte": since}}}
+    res = es.search(index=index, size=0, query=query, aggregations={"total_word_count": {"sum": {"field": "word_count"}}})
+    return {
+        "total_word_count": res["aggregations"]["total_word_count"]["value"],
+        "term_doc_freq": count_terms(es, index, terms, query) if terms else {},
+    }
+
+
+def ingest_incremental(es_client: Elasticsearch, pg_client, args: argparse.Namespace) -> None:
+    """
+    Ingest only the tweets created after the watermark of the index, and those of the preceding lookback window,
+    whose counts might have changed. Tweets are upserted by their id, hence ingesting a tweet twice is harmless.
+    The statistics of the index are updated by the difference of the statistics of the window before and after
+    the ingestion, instead of recomputing them.
+    """
+    watermark = get_watermark(es_client, args.index)
+    if watermark is None:
+        # nothing ingested incrementally yet, start from the latest tweet in the index
+        res = es_client.search(index=args.index, size=1, source=False, sort=[{"created_at": "desc"}])
+        hits = res["hits"]["hits"]
+        watermark = {"created_at": hits[0]["sort"][0], "id": int(hits[0]["_id"])} if hits else {"created_at": "1970-01-01T00:00:00", "id": 0}
+        if isinstance(watermark["created_at"], int):
+            watermark["created_at"] = datetime.utcfromtimestamp(watermark["created_at"] / 1000).isoformat()
+
+    created_after = datetime.fromisoformat(watermark["created_at"]) - timedelta(hours=args.lookback)
+    since = created_after.isoformat()
+    print(f"Ingesting tweets after {watermark} and changes since {since}...")
+
+    # statistics of the window before the ingestion
+    stats_index = get_statistics_index(args.index)
+    statistics = None
+    if es_client.indices.exists(index=stats_index) and es_client.exists(index=stats_index, id=STATISTICS_ID):
+        statistics = es_client.get(index=stats_index, id=STATISTICS_ID)["_source"]
+        es_client.indices.refresh(index=args.index)
+        before = count_range_statistics(es_client, args.index, list(statistics["term_doc_freq"]), since)
+
+    pg_cursor = pg_client.cursor(name="tweet_feeder_delta")
+    pg_cursor.itersize = args.fetch_size
+
+    # the window starts before the watermark, hence it contains all tweets after the watermark
+    pg_cursor.execute(compose_delta_query(args.table), {"created_after": created_after})
+
+    progress = tqdm(unit=" tweets")
+    start = time.perf_counter()
+    successes = 0
+    vocabulary = Counter()
+    latest = None
+
+    def track(docs):
+        nonlocal latest
+        for doc in docs:
+            latest = doc
+            yield doc
+
+    docs = track(count_vocabulary(read_delta(pg_cursor, args.wordcount, args.fetch_size), vocabulary))
+    for ok, action in streaming_bulk(client=es_client, index=args.index, actions=docs, chunk_size=args.chunk_size, max_chunk_bytes=args.max_chunk_bytes):
+        progress.update(1)
+        successes += ok
+
+    pg_cursor.close()
+    elapsed = time.perf_counter() - start
+    print(f"Finished - upserted {successes} tweets in {elapsed:.0f}s ({successes / max(elapsed, 1e-9):.0f} docs/s)")
+
+    if statistics is None:
+        print("Precomputing corpus statistics...")
+        write_statistics(es_client, args.index, [word for word, _ in vocabulary.most_common(args.vocabulary)])
+    else:
+        print("Updating corpus statistics...")
+        es_client.indices.refresh(index=args.index)
+        after = count_range_statistics(es_client, args.index, list(statistics["term_doc_freq"]), since)
+
+        statistics["total_word_count"] += after["total_word_count"] - before["total_word_count"]
+        for term, count in after["term_doc_freq"].items():
+            statistics["term_doc_freq"][term] += count - before["term_doc_freq"].get(term, 0)
+
+        # frequent words of the new tweets which are not part of the statistics yet
+        new_terms = [word for word, _ in vocabulary.most_common(args.vocabulary) if word not in statistics["term_doc_freq"]]
+        statistics["term_doc_freq"].update(count_terms(es_client, args.index, new_terms))
+
+        statistics["generation"] = get_index_generation(es_client, args.index)
+        es_client.index(index=stats_index, id=STATISTICS_ID, document=statistics)
+
+    # the watermark is only advanced once the tweets and the statistics are stored
+    if latest is not None:
+        created_at = latest["created_at"]
+        set_watermark(es_client, args.index, {
+            "created_at": created_at.isoformat() if isinstance(created_at, datetime) else str(created_at),
+            "id": int(latest["_id"]),
+        })
+
+
+def count_vocabulary(docs, vocabulary: Counter, key="txt"):
+    """
+    Pass the documents (or rows) through while counting the number of documents each word occurs in.
+    """
+    for doc in docs:
+        vocabulary.update(set(split_words(doc[key] or "")))
+        yield doc
+
+
+def write_statistics(es: Elasticsearch, index: str, terms: list[str]) -> None:
+    """
+    Precompute the statistics of an index, i.e. its total word count and the document frequencies
+    of the given terms, and store them in the statistics index. The statistics are tagged with the
+    generation of the index, so that clients can tell whether they are still up to date.
+    """
+    es.indices.refresh(index=index)
+
+    res = es.search(index=index, size=0, aggregations={"total_word_count": {"sum": {"field": "word_count"}}})
+
+    statistics = {
+        "generation": get_index_generation(es, index),
+        "total_word_count": res["aggregations"]["total_word_count"]["value"],
+        "term_doc_freq": count_terms(es, index, terms),
+    }
+
+    stats_index = get_statistics_index(index)
+    if not es.indices.exists(index=stats_index):
+        # the statistics are only stored, not searched
+        es.indices.create(index=stats_index, mappings={"enabled": False})
+
+    es.index(index=stats_index, id=STATISTICS_ID, document=statistics)
+
+
+def count_tweets(pg_client, args: argparse.Namespace) -> int:
+    """
+    Count the tweets of the table with a minimum number of words.
+    """
+    pg_cursor = pg_client.cursor()
+
+    # count entries in data base
+    wordcount_query = (
+        "Select count(*) from ( "
+            f"SELECT array_length(string_to_array(regexp_replace(txt,  '[^\w\s]', '', 'g'), ' '), 1) AS word_count FROM {args.table} "
+        ") as wc "
+        f"where wc.word_count >= {args.wordcount}"
+    )
+
+    pg_cursor.execute(query=wordcount_query)
+    doc_count = pg_cursor.fetchall()[0][0]
+    pg_cursor.close()
+
+    return doc_count
+
+
+def filter_rows(rows: Iterable[tuple], wordcount: int) -> Iterator[tuple]:
+    """
+    Pass on the rows with a minimum number of words, like the feeder query does. The word count of rows
+    without one is computed from their text.
+    """
+    txt, word_count = ATTRIBUTES.index("txt"), ATTRIBUTES.index("word_count")
+    for row in rows:
+        count = row[word_count]
+        if count is None:
+            count = count_words(row[txt])
+            row = row[:word_count] + (count,) + row[word_count + 1:]
+
+        if count is not None and count >= wordcount:
+            yield row
+
+
+def ingest_stream(es_client: Elasticsearch, rows: Iterable[tuple], args: argparse.Namespace, total: int = None) -> tuple[Counter, int]:
+    """
+    Ingest rows in the shape of ATTRIBUTES, e.g. those of a TweetSource, as a single stream.
+
+    Returns
+    -------
+    ingested : tuple[Counter, int]
+        The number of documents each word occurs in and the number of ingested tweets.
+    """
+    # insert data into ES in a lazy manner
+    print(f"Ingesting {total if total is not None else 'all'} tweets into Elastic Search...")
+
+    # feed tweets chunk by chunk
+    progress= tqdm(unit=" tweets", total=total)
+    successes = 0
+    vocabulary = Counter()
+    for docs, size, last_id in bulk_ingest(es_client, rows, args, vocabulary):
+        progress.update(docs)
+        successes += docs
+
+    print(f"Finished - ingested {successes} tweets")
+
+    return vocabulary, successes
+
+
+def prepare_bulk_load(es: Elasticsearch, index: str, state_path: str) -> json:
+    """
+    Disable refreshes and replicas of an index for a bulk load. The original settings are stored in a file,
+    so that they are restored even if the bulk load is interrupted and resumed.
+
+    Returns
+    -------
+    settings : json
+        The original settings.
+    """
+    previous = read_checkpoint(state_path)
+    if previous is None:
+        res = es.indices.get_settings(index=index, name=["index.refresh_interval", "index.number_of_replicas"], flat_settings=True)
+        settings = next(iter(res.values()))["settings"]
+
+        # settings which are not set explicitly are reset to their defaults
+        previous = {name: settings.get(name) for name in ["index.refresh_interval", "index.number_of_replicas"]}
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        write_checkpoint(state_path, previous)
+
+    print(f"Disabling refreshes and replicas of {index} for the bulk load, original settings {previous}")
+    es.indices.put_settings(index=index, settings={"index.refresh_interval": "-1", "index.number_of_replicas": 0})
+    return previous
+
+
+def finish_bulk_load(es: Elasticsearch, index: str, previous: json, state_path: str, docs: int, elapsed: float, max_segments: int = 1,
+                     wait_for_status: str = "yellow", wait_timeout: str = "30m") -> None:
+    """
+    Force merge an index after a bulk load, restore its settings and warm it and report the indexing throughput
+    and the final size of the index. The index is merged before the replicas are restored, hence only the merged
+    segments are copied to the replicas. Afterwards, it waits until the cluster health of the index reaches
+    `wait_for_status`, e.g. "green" once all replicas are allocated, unless it is None.
+    """
+    print(f"Bulk load finished - {docs} tweets in {elapsed:.0f}s ({docs / max(elapsed, 1e-9):.0f} docs/s)")
+
+    # refreshes are still disabled, make all tweets part of the segments to merge
+    es.indices.refresh(index=index)
+
+    # merging a large index takes a while
+    long_running = es.options(request_timeout=6 * 3600)
+
+    print(f"Force merging {index} into at most {max_segments} segments per shard...")
+    start = time.perf_counter()
+    long_running.indices.forcemerge(index=index, max_num_segments=max_segments)
+    print(f"Force merge took {time.perf_counter() - start:.0f}s")
+
+    es.indices.put_settings(index=index, settings=previous)
+    es.indices.refresh(index=index)
+
+    if wait_for_status is not None:
+        print(f"Waiting up to {wait_timeout} for the {wait_for_status} status of {index}...")
+        health = long_running.cluster.health(index=index, wait_for_status=wait_for_status, timeout=wait_timeout)
+        if health["timed_out"]:
+            print(f"Index {index} is still {health['status']}, its replicas are allocated in the background")
+
+    # load the doc values and the terms of the fields used by the pipeline into the caches
+    print("Warming the index...")
+    es.search(index=index, size=0, request_cache=False, aggregations={
+        "total_word_count": {"sum": {"field": "word_count"}},
+        "hashtags": {"terms": {"field": "hashtags", "size": 10}},
+    })
+
+    stats = es.indices.stats(index=index, metric=["docs", "store"])["_all"]
+    print(f"Index {index} holds {stats['primaries']['docs']['count']} tweets, "
+          f"{stats['primaries']['store']['size_in_bytes'] / 2**30:.2f} GB primary and "
+          f"{stats['total']['store']['size_in_bytes'] / 2**30:.2f} GB total size")
+
+    os.remove(state_path)
+
+
 def es_connect(credentials: json) -> Elasticsearch:
     """
     Connect to an elastic search API.
@@ -65,28 +629,47 @@ def pg_connect(credentials: json) -> any:
 
 def main():
     """
-    This script ingests data from an PostgreSQL instance into an Elastic Search index.
+    This script ingests data from an PostgreSQL instance, or from a file of tweets, into an Elastic Search index.
     The processing is based on streaming and arguments can be passed via the command line interface.
     """
 
     # parse command line arguments
     parser = argparse.ArgumentParser(description='Feed Postgres data into Elastic Search Index')
     parser.add_argument('-i', '--index', required=True, help='Name of Elastic Search index')
-    parser.add_argument('-t', '--table', required=True, help='Name of Postgres table')
+    parser.add_argument('-t', '--table', required=False, help='Name of Postgres table')
+    parser.add_argument('-in', '--input', required=False, help='File of tweets to ingest instead of a Postgres table (.jsonl, .jsonl.gz, .jsonl.zst, .parquet, .arrow)')
     parser.add_argument('-ec','--elastic_credentials', required=False, default="auth/es-credentials.ini", help='Path to Elastic Search credentials file')
     parser.add_argument('-pc', '--postgres_credentials', required=False, default="auth/pg-credentials.ini", help='Path to Postgres credentials file')
     parser.add_argument('-es', '--elastic_settings', required=False, default="templates/es-config.tpl", help='Settings for new Index; Look at "/templates/es-config.conf"')
-    parser.add_argument('-wc', '--wordcount', required=False, default=25, help='Minimum number of words per Tweet')
+    parser.add_argument('-wc', '--wordcount', required=False, default=25, type=int, help='Minimum number of words per Tweet')
+    parser.add_argument('-v', '--vocabulary', required=False, default=10000, type=int, help='Number of most frequent words whose document frequencies are precomputed')
+    parser.add_argument('-p', '--partitions', required=False, default=0, type=int, help='Number of id ranges to ingest in parallel; 0 ingests the table as a single stream')
+    parser.add_argument('-w', '--workers', required=False, default=4, type=int, help='Number of worker processes of the partitioned ingestion')
+    parser.add_argument('-cs', '--chunk_size', required=False, default=500, type=int, help='Number of tweets per bulk request')
+    parser.add_argument('-cb', '--max_chunk_bytes', required=False, default=100 * 2**20, type=int, help='Maximum size of a bulk request in bytes')
+    parser.add_argument('-fs', '--fetch_size', required=False, default=10000, type=int, help='Number of rows fetched from Postgres or read from a file at once')
+    parser.add_argument('-s', '--serializer', required=False, default="ndjson", choices=["ndjson", "dict"], help='Serialize rows directly into bulk requests (ndjson) or via a dictionary per row and streaming_bulk (dict)')
+    parser.add_argument('-cp', '--checkpoints', required=False, default="checkpoints", help='Directory of the checkpoints of the partitioned ingestion')
+    parser.add_argument('-inc', '--incremental', required=False, action='store_true', help='Ingest only tweets after the watermark of the index and update its statistics')
+    parser.add_argument('-lb', '--lookback', required=False, default=24, type=float, help='Hours before the watermark in which changed tweets are ingested again in incremental mode')
+    parser.add_argument('-bl', '--bulk_load', required=False, action='store_true', help='Disable refreshes and replicas while loading, then force merge and warm the index')
+    parser.add_argument('-ms', '--max_segments', required=False, default=1, type=int, help='Number of segments per shard after the force merge of a bulk load')
+    parser.add_argument('-ws', '--wait_for_status', required=False, default="yellow", choices=["green", "yellow", "none"], help='Cluster health of the index to wait for after a bulk load; green waits for all replicas')
+    parser.add_argument('-wt', '--wait_timeout', required=False, default="30m", help='Maximum time to wait for the cluster health after a bulk load')
+    parser.add_argument('-r', '--report_every', required=False, default=100000, type=int, help='Number of tweets after which a worker reports its throughput')
     args = parser.parse_args()                    
 
+    if (args.table is None) == (args.input is None):
+        parser.error("either a table or an input file is required")
+    if args.input is not None and (args.partitions > 0 or args.incremental):
+        parser.error("partitioned and incremental ingestion require a table")
+
     # connect to postgres and elastic search
     config = configparser.ConfigParser()
     config.read([args.elastic_credentials, args.postgres_credentials])
 
     es_client = es_connect(credentials=config["ELASTIC"])
-    pg_client = pg_connect(credentials=config["POSTGRES"])
-
-    pg_cursor = pg_client.cursor()
+    pg_client = pg_connect(credentials=config["POSTGRES"]) if args.input is None else None
 
     # create index if it not exists
     if not es_client.indices.exists(index=args.index):
@@ -94,49 +677,41 @@ def main():
         es_conf = json.load(open(file=args.elastic_settings))
         es_client.indices.create(index=args.index, settings=es_conf["settings"], mappings=es_conf["mappings"])
 
-    # count entries in data base
-    wordcount_query = (
-        "Select count(*) from ( "
-            f"SELECT array_length(string_to_array(regexp_replace(txt,  '[^\w\s]', '', 'g'), ' '), 1) AS word_count FROM {args.table} "
-        ") as wc "
-        f"where wc.word_count >= {args.wordcount}"
-    )
+    if args.incremental:
+        ingest_incremental(es_client, pg_client, args)
 
-    pg_cursor.execute(query=wordcount_query)
-    doc_count = pg_cursor.fetchall()[0][0]
+        es_client.close()
+        pg_client.close()
+        exit(0)
 
-    # compose query to retrieve tweets with corresponding hashtags and specified min. number of words
-    query = (
-        "SELECT * FROM ( "
-            "SELECT tw.id, tw.retweet_count, tw.reply_count, tw.like_count, "
-            "tw.created_at, tw.txt, array_agg(ht.txt) AS hashtags, "
-            "array_length(string_to_array(regexp_replace(tw.txt,  '[^\w\s]', '', 'g'), ' '), 1) AS word_count "
-            f"FROM {args.table} tw "
-            "LEFT OUTER JOIN hashtag_posting hp ON hp.tweet_id = tw.id "
-            "LEFT OUTER JOIN hashtag ht ON ht.id = hp.hashtag_id "
-            "GROUP BY tw.id "
-        ") as q "
-        f"WHERE q.word_count >= {args.wordcount} "
-    )
+    bulk_load_path = os.path.join(args.checkpoints, args.index, "bulk-load.json")
+    if args.bulk_load:
+        previous_settings = prepare_bulk_load(es_client, args.index, bulk_load_path)
 
-    # execute the query
-    print("Executing Postgres Query...")
-    pg_cursor.execute(query=query)
+    start = time.perf_counter()
+    if args.input is not None:
+        print(f"Reading tweets from {args.input}...")
+        with open_source(args.input, ATTRIBUTES) as source:
+            rows = filter_rows(source.rows(args.fetch_size), args.wordcount)
+            vocabulary, ingested = ingest_stream(es_client, rows, args)
+    elif args.partitions > 0:
+        vocabulary, ingested = ingest_partitioned(pg_client, args)
+    else:
+        # compose query to retrieve tweets with corresponding hashtags and specified min. number of words
+        print("Executing Postgres Query...")
+        with PostgresSource(pg_client, compose_tweet_query(args.table, args.wordcount), ATTRIBUTES) as source:
+            vocabulary, ingested = ingest_stream(es_client, source.rows(args.fetch_size), args, total=count_tweets(pg_client, args))
 
-    # insert data from Postgres to ES in a lazy manner
-    print(f"Ingesting {doc_count} tweets from Postgres into Elastic Search...")
+    if args.bulk_load:
+        finish_bulk_load(es_client, args.index, previous_settings, bulk_load_path, ingested, time.perf_counter() - start, args.max_segments,
+                         None if args.wait_for_status == "none" else args.wait_for_status, args.wait_timeout)
 
-    # feed tweets using streaming API
-    progress= tqdm(unit=" tweets", total=doc_count)
-    successes = 0
-    for ok, action in streaming_bulk(client=es_client, index=args.index ,actions=iterate(cursor=pg_cursor, attributes=ATTRIBUTES, size=1000)):
-        progress.update(1)
-        successes += ok
-
-    print(f"Finished - ingested {successes} tweets")
+    print("Precomputing corpus statistics...")
+    write_statistics(es_client, args.index, [word for word, _ in vocabulary.most_common(args.vocabulary)])
 
     es_client.close()
-    pg_client.close()
+    if pg_client is not None:
+        pg_client.close()
 
     exit(0)
 
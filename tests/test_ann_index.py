@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+import pytest
+
+from pipeline.ann_index import IVFIndex
+from pipeline.utils import inverse_norms
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    # the model file and an array gensim stores next to it
+    path = str(tmp_path / "model.kv")
+    vectors = np.random.default_rng(0).normal(size=(200, 8)).astype(np.float32)
+    with open(path, "wb") as file:
+        file.write(b"model")
+    np.save(path + ".vectors.npy", vectors)
+
+    IVFIndex.build(vectors, inverse_norms(np.linalg.norm(vectors, axis=1)), n_lists=8).save(path)
+    return path
+
+
+def test_load_matching_index(model_path):
+    index = IVFIndex.load(model_path, 200)
+    assert len(index.ids) == 200 and index.offsets[-1] == 200
+
+
+def test_load_rejects_changed_model(model_path):
+    np.save(model_path + ".vectors.npy", np.zeros((300, 8), dtype=np.float32))
+    with pytest.raises(ValueError):
+        IVFIndex.load(model_path)
+
+
+def test_load_rejects_other_vector_count(model_path):
+    with pytest.raises(ValueError):
+        IVFIndex.load(model_path, 300)
+
+
+def test_load_rejects_index_without_meta(model_path):
+    os.remove(IVFIndex.get_meta_path(model_path))
+    with pytest.raises(ValueError):
+        IVFIndex.load(model_path, 200)
+
+
+def test_quantized_copies_keep_index(model_path):
+    np.save(model_path + ".int8.npy", np.zeros((200, 8), dtype=np.int8))
+    IVFIndex.load(model_path, 200)
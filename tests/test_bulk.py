@@ -0,0 +1,40 @@
+import datetime
+import json
+
+import pytest
+
+pytest.importorskip("elasticsearch")
+
+from pipeline.bulk import NDJSONSerializer, encode_value, orjson
+
+
+ATTRIBUTES = ["_id", "like_count", "score", "created_at", "txt", "hashtags"]
+
+
+@pytest.mark.parametrize("value, encoded", [
+    (None, "null"),
+    (True, "true"),
+    (12, "12"),
+    (0.5, "0.5"),
+    (float("nan"), "null"),
+    (float("inf"), "null"),
+    (float("-inf"), "null"),
+    ("Grüße \"aus\"\nBerlin", '"Grüße \\"aus\\"\\nBerlin"'),
+    (datetime.datetime(2021, 9, 1, 12, 30), '"2021-09-01T12:30:00"'),
+    (["#Wahl", None], '["#Wahl",null]'),
+])
+def test_encode_value(value, encoded):
+    assert encode_value(value) == encoded
+
+
+@pytest.mark.parametrize("use_orjson", [False, pytest.param(True, marks=pytest.mark.skipif(orjson is None, reason="orjson is not installed"))])
+@pytest.mark.parametrize("score", [1.5, float("nan"), float("inf")])
+def test_serializer_writes_valid_json(use_orjson, score):
+    row = (7, 3, score, datetime.datetime(2021, 9, 1), "Hallo Welt", ["#Wahl"])
+    action, document = NDJSONSerializer(ATTRIBUTES, use_orjson=use_orjson).dumps(row).decode("utf-8").splitlines()
+
+    assert json.loads(action) == {"index": {"_id": "7"}}
+    # strict parsing rejects NaN and Infinity
+    document = json.loads(document, parse_constant=lambda constant: pytest.fail(f"invalid JSON constant {constant}"))
+    assert document["score"] == (score if score == 1.5 else None)
+    assert document["created_at"] == "2021-09-01T00:00:00"
@@ -0,0 +1,50 @@
+import copy
+import threading
+
+from pipeline.cache import ResultCache
+
+
+RESULT = {"hits": 2, "took": 3, "tweets": [{"_id": "1", "_source": {"txt": "Hallo"}}, {"_id": "2", "_source": {"txt": "Welt"}}]}
+
+
+def test_lookup_returns_copies():
+    cache = ResultCache()
+    result = copy.deepcopy(RESULT)
+    cache.put("key", result, generation=1)
+
+    # neither the stored result nor a returned one are shared with the cache
+    result["tweets"].clear()
+    first = cache.lookup("key", generation=1)
+    first["tweets"][0]["query"] = 0
+    first["tweets"].pop()
+
+    assert cache.lookup("key", generation=1) == RESULT
+
+
+def test_fetch_returns_copies():
+    cache = ResultCache()
+    computed = cache.fetch("key", lambda: copy.deepcopy(RESULT), generation=1)
+    computed["tweets"][0]["_source"]["txt"] = "geändert"
+
+    cached = cache.fetch("key", lambda: None, generation=1)
+    cached["tweets"].append({"_id": "3"})
+
+    assert cache.fetch("key", lambda: None, generation=1) == RESULT
+    assert cache.stats()["hits"] == 2
+
+
+def test_stale_lookup_returns_copies():
+    cache = ResultCache(stale_while_revalidate=True, refresh_workers=1)
+    cache.put("key", copy.deepcopy(RESULT), generation=1)
+
+    # the refresh is held back, hence both lookups are served from the stale entry
+    released = threading.Event()
+    refresh = lambda: released.wait() and copy.deepcopy(RESULT)
+
+    try:
+        stale = cache.lookup("key", generation=2, refresh=refresh)
+        stale["tweets"].clear()
+        assert cache.lookup("key", generation=2, refresh=refresh) == RESULT
+    finally:
+        released.set()
+        cache.close()
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from pipeline.cooccurrence import CooccurrenceMatrix
+from pipeline.utils import split_words
+
+
+TWEETS = [
+    ("Hallo Welt\nBerlin heute", 4),
+    ("Berlin heute #Klima", 3),
+    ("heute in Berlin\tund Welt", 5),
+    ("Klima-Wahl in Berlin", 4),
+    ("Welt, Klima und heute", 4),
+]
+
+
+@pytest.mark.parametrize("text, words", [
+    ("welt\nberlin", ["welt", "berlin"]),
+    ("Hallo\tWelt  heute", ["hallo", "welt", "heute"]),
+    ("#Klima-Wahl, Berlin!", ["klima", "wahl", "berlin"]),
+])
+def test_split_words(text, words):
+    assert split_words(text) == words
+
+
+def test_save_and_load(tmp_path):
+    matrix = CooccurrenceMatrix.build(TWEETS, min_count=1)
+    assert not any(any(c.isspace() for c in term) for term in matrix.vocabulary)
+
+    matrix.save(str(tmp_path))
+    loaded = CooccurrenceMatrix.load(str(tmp_path))
+
+    assert loaded.vocabulary == matrix.vocabulary
+    assert len(loaded.vocabulary) == len(loaded.doc_freq)
+    assert loaded.total_word_count == matrix.total_word_count
+
+    terms, synonyms = ["berlin", "welt", "klima"], ["heute", "berlin", "wahl"]
+    np.testing.assert_array_equal(loaded.score(terms, synonyms), matrix.score(terms, synonyms))
+    assert not np.isnan(loaded.score(["berlin"], ["heute"])).any()
+
+
+def test_save_and_load_any_term(tmp_path):
+    matrix = CooccurrenceMatrix.build(TWEETS, min_count=1)
+    vocabulary = ["zeile\numbruch" if term == "wahl" else term for term in matrix.vocabulary]
+    matrix = CooccurrenceMatrix(vocabulary, matrix.indptr, matrix.indices, matrix.data, matrix.doc_freq, matrix.total_word_count)
+
+    matrix.save(str(tmp_path))
+    loaded = CooccurrenceMatrix.load(str(tmp_path))
+
+    assert loaded.vocabulary == vocabulary
+    np.testing.assert_array_equal(loaded.score(["klima"], ["zeile\numbruch"]), matrix.score(["klima"], ["zeile\numbruch"]))
+
+
+def test_build_counts_pairs_of_pruned_vocabulary():
+    rng = np.random.default_rng(0)
+    words = [f"wort{i}" for i in range(40)]
+    tweets = [(" ".join(rng.choice(words, size=rng.integers(0, 12), p=np.arange(40, 0, -1) / 820)), 10) for _ in range(500)]
+    documents = [set(split_words(text)) for text, _ in tweets]
+
+    matrix = CooccurrenceMatrix.build(tweets, min_count=20, max_vocab=15, buffer_size=50)
+
+    doc_freq = {word: sum(word in doc for doc in documents) for word in words}
+    expected = sorted((word for word in words if doc_freq[word] >= 20), key=lambda word: -doc_freq[word])[:15]
+    assert sorted(matrix.vocabulary) == sorted(expected)
+    assert list(matrix.doc_freq) == [doc_freq[term] for term in matrix.vocabulary]
+
+    ids = matrix.get_ids(matrix.vocabulary)
+    a, b = np.triu_indices(len(ids), 1)
+    joint = [sum(matrix.vocabulary[i] in doc and matrix.vocabulary[j] in doc for doc in documents) for i, j in zip(a, b)]
+    np.testing.assert_array_equal(matrix.get_joint_counts(ids[a], ids[b]), joint)
+
+
+def test_build_requires_repeatable_rows():
+    with pytest.raises(TypeError):
+        CooccurrenceMatrix.build(iter(TWEETS), min_count=1)
+
+
+class FakeConnection:
+    """
+    A database connection whose cursors return the same rows on every execution.
+    """
+
+    def __init__(self, rows: list[tuple]) -> None:
+        self.rows = rows
+        self.executed = 0
+        self.open = 0
+
+    def cursor(self, name: str = None):
+        connection = self
+
+        class Cursor:
+            def execute(self, query, params=None):
+                connection.executed += 1
+                connection.open += 1
+                self.rows = list(connection.rows)
+
+            def fetchmany(self, size):
+                batch, self.rows = self.rows[:size], self.rows[size:]
+                return batch
+
+            def close(self):
+                connection.open -= 1
+
+        return Cursor()
+
+
+def test_build_from_postgres_source_reads_twice():
+    pytest.importorskip("psycopg2")
+    pytest.importorskip("elasticsearch")
+    pytest.importorskip("tqdm")
+
+    from pipeline.sources import PostgresSource
+    from scripts.cooccurrence_builder import TweetTexts
+    from scripts.tweet_feeder import ATTRIBUTES
+
+    connection = FakeConnection([(i, 0, 0, 0, None, text, [], word_count) for i, (text, word_count) in enumerate(TWEETS)])
+    with PostgresSource(connection, "SELECT ...", ATTRIBUTES, name="cooccurrence_builder") as source:
+        matrix = CooccurrenceMatrix.build(TweetTexts(source, size=2), min_count=1)
+
+    assert connection.executed == 2 and connection.open == 0
+    assert matrix.total_word_count == sum(word_count for _, word_count in TWEETS)
+    np.testing.assert_array_equal(matrix.doc_freq, CooccurrenceMatrix.build(TWEETS, min_count=1).doc_freq)
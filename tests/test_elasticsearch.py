@@ -0,0 +1,249 @@
+import asyncio
+import random
+
+import pytest
+
+elasticsearch = pytest.importorskip("elasticsearch")
+
+from elastic_transport import ApiResponseMeta, HttpHeaders
+
+from pipeline.cache import ResultCache
+from pipeline.elasticsearch import MAX_ADJACENCY_FILTERS, ElasticsearchQueries, ElasticsearchClient, AsyncElasticsearchClient
+from pipeline.utils import pmi, npmi, dice, llr
+
+
+def get_filters(chunk: dict) -> set:
+    return set(chunk) | {synonym for synonyms in chunk.values() for synonym in synonyms}
+
+
+def get_pairs(similar_terms: list[dict]) -> set:
+    return {(term, synonym) for terms in similar_terms for term, synonyms in terms.items() for synonym in synonyms}
+
+
+@pytest.mark.parametrize("similar_terms", [
+    # a single query with 10 terms of 10 similar terms each
+    [{f"term{t}": [f"syn{t}_{s}" for s in range(10)] for t in range(10)}],
+    # a single term with more similar terms than filters
+    [{"term": [f"syn{s}" for s in range(250)]}],
+    # several queries sharing terms
+    [{f"term{t}": [f"syn{(t + s) % 40}" for s in range(30)] for t in range(q, q + 5)} for q in range(6)],
+    [{}, {"term": []}, {"term": ["syn"]}],
+])
+def test_pack_similar_terms(similar_terms):
+    chunks = ElasticsearchQueries.pack_similar_terms(similar_terms)
+
+    assert all(len(get_filters(chunk)) <= MAX_ADJACENCY_FILTERS for chunk in chunks)
+
+    # every pair of a term and one of its similar terms is part of a single adjacency matrix
+    assert get_pairs(chunks) == get_pairs(similar_terms)
+
+
+def test_pack_similar_terms_merges_small_queries():
+    similar_terms = [{"a": ["b", "c"]}, {"a": ["c", "d"]}, {"e": ["f"]}]
+    assert ElasticsearchQueries.pack_similar_terms(similar_terms) == [{"a": ["b", "c", "d"], "e": ["f"]}]
+
+
+def count_documents(documents: list[set], terms: list[str]) -> dict:
+    """
+    Count the documents of the terms and of their pairs like an adjacency matrix aggregation does.
+    """
+    counts = {term: sum(term in doc for doc in documents) for term in terms}
+    for i, a in enumerate(terms):
+        for b in terms[i + 1:]:
+            joint = sum(a in doc and b in doc for doc in documents)
+            if joint:
+                counts[f"{a}&{b}"] = joint
+    return {key: count for key, count in counts.items() if count}
+
+
+@pytest.mark.parametrize("measure", [pmi, npmi, dice, llr])
+@pytest.mark.parametrize("threshold", [None, 0.0, 0.3, 0.6])
+def test_prune_similar_terms_keeps_selection(measure, threshold):
+    rng = random.Random(0)
+    vocabulary = [f"w{i}" for i in range(30)]
+    documents = [set(rng.sample(vocabulary[:20], rng.randint(1, 6))) for _ in range(200)]
+    doc_freq = {term: sum(term in doc for doc in documents) for term in vocabulary}
+    total = 1000
+
+    co_occurrences = count_documents(documents, vocabulary)
+
+    for _ in range(20):
+        candidates = rng.sample(vocabulary, 3)
+        similar_terms = {term: rng.sample(vocabulary, 8) for term in candidates}
+
+        expected = ElasticsearchQueries.select_expansion_terms(candidates, similar_terms, co_occurrences, total, threshold, measure)
+        pruned = ElasticsearchQueries.prune_similar_terms(similar_terms, doc_freq, total, threshold, measure)
+        assert ElasticsearchQueries.select_expansion_terms(candidates, pruned, co_occurrences, total, threshold, measure) == expected
+
+        # terms which occur in no document are never sent
+        for term, synonyms in pruned.items():
+            assert all(doc_freq[synonym] > 0 for synonym in synonyms)
+            assert doc_freq[term] > 0 or not synonyms
+
+
+def test_prune_similar_terms_drops_unreachable_pairs():
+    doc_freq = {"a": 10, "b": 10, "c": 0, "d": 5000}
+    pruned = ElasticsearchQueries.prune_similar_terms({"a": ["b", "c", "d", "unknown"]}, doc_freq, 10000, 0.5, npmi)
+    assert pruned == {"a": ["b", "unknown"]}
+
+
+class FailingClient(AsyncElasticsearchClient):
+    """
+    An asynchronous client whose searches fail for some queries, without a connection to a cluster.
+    """
+
+    def __init__(self, failing: set, delays: list[float]) -> None:
+        self._index = "tweets"
+        self.failing = failing
+        self.delays = delays
+        self.cancelled = []
+
+    async def get_tweets(self, params: dict) -> dict:
+        i = params["query"]
+        try:
+            await asyncio.sleep(self.delays[i])
+        except asyncio.CancelledError:
+            self.cancelled.append(i)
+            raise
+        if i in self.failing:
+            raise elasticsearch.ApiError("search failed", ApiResponseMeta(500, "1.1", HttpHeaders(), 0.0, None), None)
+        return {"hits": 1, "took": 1, "tweets": [i]}
+
+
+def test_get_tweets_as_completed_reports_failed_queries():
+    client = FailingClient(failing={1}, delays=[0.03, 0.0, 0.01])
+
+    async def collect():
+        return [result async for result in client.get_tweets_as_completed([{"query": i} for i in range(3)])]
+
+    results = asyncio.run(collect())
+
+    assert [i for i, _ in results] == [1, 2, 0]
+    assert "error" in results[0][1] and results[0][1]["tweets"] == []
+    assert [tweets["tweets"] for _, tweets in results[1:]] == [[2], [0]]
+
+
+def test_get_tweets_as_completed_cancels_remaining_queries():
+    client = FailingClient(failing=set(), delays=[0.0, 10.0, 10.0])
+
+    async def first():
+        completed = client.get_tweets_as_completed([{"query": i} for i in range(3)])
+        try:
+            async for result in completed:
+                return result
+        finally:
+            await completed.aclose()
+
+    assert asyncio.run(first())[0] == 0
+    assert sorted(client.cancelled) == [1, 2]
+
+
+DOCUMENTS = [{"klima", "wahl"}, {"klima", "wahl", "berlin"}, {"klima", "berlin"}, {"rente", "wahl"}, {"klima", "wahl"}]
+
+STATISTICS = {"generation": 1, "total_word_count": 40, "term_doc_freq": {"klima": 4, "wahl": 4, "berlin": 2, "rente": 1, "steuer": 0}}
+
+
+def aggregate(searches: list[dict]) -> dict:
+    """
+    Answer the adjacency matrix aggregations of a multi search request from DOCUMENTS.
+    """
+    responses = []
+    for body in searches[1::2]:
+        filters = list(body["aggs"]["interactions"]["adjacency_matrix"]["filters"])
+        counts = count_documents(DOCUMENTS, filters)
+        responses.append({"aggregations": {"interactions": {"buckets": [{"key": key, "doc_count": count} for key, count in counts.items()]}}})
+    return {"responses": responses}
+
+
+class FakeClient(ElasticsearchClient):
+
+    def __init__(self) -> None:
+        self._index = "tweets"
+        self.requests = []
+
+    def get_corpus_statistics(self) -> dict:
+        return STATISTICS
+
+    def msearch(self, searches: list[dict]) -> dict:
+        self.requests.append(searches)
+        return aggregate(searches)
+
+    def search(self, **kwargs) -> dict:
+        raise elasticsearch.ApiError("search failed", ApiResponseMeta(500, "1.1", HttpHeaders(), 0.0, None), None)
+
+
+class FakeAsyncClient(AsyncElasticsearchClient):
+
+    def __init__(self) -> None:
+        self._index = "tweets"
+
+    async def get_corpus_statistics(self) -> dict:
+        return STATISTICS
+
+    async def msearch(self, searches: list[dict]) -> dict:
+        return aggregate(searches)
+
+
+def test_expansion_terms_batch_sync_and_async():
+    candidate_terms = [["klima"], ["rente"], ["klima", "berlin"]]
+    similar_terms = [{"klima": ["wahl", "berlin", "steuer"]}, {"rente": ["steuer"]}, {"klima": ["wahl"], "berlin": ["wahl"]}]
+
+    client = FakeClient()
+    expansion_terms = client.get_expansion_terms_batch(candidate_terms, similar_terms, threshold=0.0)
+
+    assert expansion_terms == asyncio.run(FakeAsyncClient().get_expansion_terms_batch(candidate_terms, similar_terms, threshold=0.0))
+    assert expansion_terms[0] and not expansion_terms[1]
+
+    # the terms which occur in no document are not sent
+    assert len(client.requests) == 1
+    assert all("steuer" not in body["aggs"]["interactions"]["adjacency_matrix"]["filters"] for body in client.requests[0][1::2])
+
+
+def test_count_total_words_raises():
+    with pytest.raises(elasticsearch.ApiError):
+        FakeClient().count_total_words()
+
+
+class MultiSearchClient(ElasticsearchClient):
+    """
+    A client whose multi search requests fail for some queries, with a result cache holding the other ones.
+    """
+
+    def __init__(self, cached: set, failing: set, fail_requests: bool = False) -> None:
+        self._index = "tweets"
+        self.result_cache = ResultCache()
+        self.failing = failing
+        self.fail_requests = fail_requests
+        for i in cached:
+            self.result_cache.put(ResultCache.get_key(self._index, self.compose_search_body(i)), {"hits": 1, "took": 0, "tweets": [i]}, 1)
+
+    def compose_search_body(self, params) -> dict:
+        return {"query": params}
+
+    def get_generation(self) -> int:
+        return 1
+
+    def msearch(self, searches: list[dict]) -> dict:
+        if self.fail_requests:
+            raise elasticsearch.ApiError("search failed", ApiResponseMeta(500, "1.1", HttpHeaders(), 0.0, None), None)
+        return {"responses": [
+            {"error": "failed", "took": 1} if body["query"] in self.failing else {"hits": {"total": {"value": 1}, "hits": [body["query"]]}, "took": 1}
+            for body in searches[1::2]
+        ]}
+
+
+def test_get_tweets_many_reports_query_positions(capsys):
+    client = MultiSearchClient(cached={0, 1, 3}, failing={4})
+    results = client.get_tweets_many(list(range(6)), chunk_size=2)
+
+    assert [result["tweets"] for result in results] == [[0], [1], [2], [3], [], [5]]
+    assert "search query 4 " in capsys.readouterr().out
+
+
+def test_get_tweets_many_reports_failed_requests(capsys):
+    client = MultiSearchClient(cached={0, 2}, failing=set(), fail_requests=True)
+    results = client.get_tweets_many(list(range(5)), chunk_size=2)
+
+    assert [i for i, result in enumerate(results) if "error" in result] == [1, 3, 4]
+    out = capsys.readouterr().out
+    assert "queries [1, 3] " in out and "queries [4] " in out
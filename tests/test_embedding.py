@@ -0,0 +1,53 @@
+import warnings
+
+import numpy as np
+import pytest
+
+pytest.importorskip("gensim")
+
+from gensim.models import KeyedVectors
+
+from pipeline.embedding import ModelRegistry, QuantizedVectors, WordEmbedding
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 8)).astype(np.float32)
+    vectors[7] = 0
+
+    model = KeyedVectors(vector_size=8)
+    model.add_vectors([f"wort{i}" for i in range(50)], vectors)
+    path = str(tmp_path / "model.kv")
+    model.save(path)
+
+    yield path
+    ModelRegistry.clear()
+
+
+def test_zero_vectors_are_no_nan(model_path):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        embedding = WordEmbedding(model_path)
+        similar_terms = embedding.get_similar_terms(["wort0", "wort7"], 5)
+
+    assert np.isfinite(embedding._scale).all()
+    assert len(similar_terms["wort0"]) == len(similar_terms["wort7"]) == 5
+
+    # the neighbours of a regular term are those of the exact cosine similarity
+    model = KeyedVectors.load(model_path)
+    vectors = np.delete(model.vectors, 7, axis=0)
+    keys = [key for key in model.index_to_key if key != "wort7"]
+    scores = vectors @ model.vectors[0] / np.linalg.norm(vectors, axis=1)
+    expected = [keys[i] for i in np.argsort(-scores) if keys[i] != "wort0"][:5]
+    assert similar_terms["wort0"] == expected
+
+
+@pytest.mark.parametrize("dtype", QuantizedVectors.DTYPES)
+def test_quantize_zero_vectors(model_path, dtype):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        quantized = QuantizedVectors.quantize(KeyedVectors.load(model_path), dtype)
+
+    assert not quantized.vectors[7].any()
+    assert np.isfinite(quantized.vectors.astype(np.float32)).all()
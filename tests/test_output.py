@@ -0,0 +1,53 @@
+import pytest
+
+from pipeline.output import RecordWriter, open_writer, read_records
+
+
+RECORDS = [{"query": q, "_id": str(i), "_score": 1.0, "_source": {"txt": f"Tweet {i}"}} for q in range(3) for i in range(50)]
+
+
+def test_record_writer_is_abstract():
+    with pytest.raises(TypeError):
+        RecordWriter("output")
+
+
+def test_jsonl_readable_after_flush(tmp_path):
+    path = str(tmp_path / "hits")
+
+    with open_writer(path, "jsonl") as writer:
+        for record in RECORDS[:50]:
+            writer.write(record)
+        writer.flush()
+
+        # the records of the first query are readable while the run continues
+        assert list(read_records(path + ".jsonl")) == RECORDS[:50]
+
+        for record in RECORDS[50:]:
+            writer.write(record)
+
+    assert list(read_records(path + ".jsonl")) == RECORDS
+
+
+def test_jsonl_flushes_once_per_flush(tmp_path):
+    with open_writer(str(tmp_path / "hits"), "jsonl", "gzip") as writer:
+        flushes = []
+        flush = writer.file.flush
+        writer.file.flush = lambda: flushes.append(flush())
+
+        for record in RECORDS:
+            writer.write(record)
+        writer.flush()
+
+        assert len(flushes) == 1
+
+
+def test_columnar_flush_keeps_batches(tmp_path):
+    path = str(tmp_path / "hits")
+
+    with open_writer(path, "numpy", batch_size=100) as writer:
+        for record in RECORDS:
+            writer.write(record)
+            writer.flush()
+
+    assert writer.parts == 2
+    assert list(read_records(path + ".npy.d")) == RECORDS
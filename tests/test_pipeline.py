@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip("spacy")
+pytest.importorskip("de_core_news_lg")
+pytest.importorskip("gensim")
+pytest.importorskip("elasticsearch")
+
+from scripts import pipeline
+
+
+class FakeTextProcessor:
+
+    def __init__(self, profile: str) -> None:
+        self.profile = profile
+        self.analyses = self
+
+    def get_unsupported_params(self, params: dict) -> list:
+        return []
+
+    def analyze_many(self, queries: list, params: dict, batch_size: int, n_process: int) -> list:
+        return [{"text": query, "tokens": query.split(), "terms": query.split()} for query in queries]
+
+    def stats(self) -> dict:
+        return {}
+
+
+class FakeWordEmbedding:
+
+    def __init__(self, model: str, nprobe: int, cache, prefault: bool, dtype: str) -> None:
+        self.cache = cache
+
+    def get_similar_terms_batch(self, queries: list, n: int) -> list:
+        return [{term: [] for term in terms} for terms in queries]
+
+
+class FakeCache:
+    opened = []
+
+    def __init__(self, path: str) -> None:
+        self.opened.append(path)
+
+    def stats(self) -> dict:
+        return {}
+
+
+def test_expand_queries_opens_cache_once(monkeypatch):
+    monkeypatch.setattr(pipeline, "TextProcessor", FakeTextProcessor)
+    monkeypatch.setattr(pipeline, "WordEmbedding", FakeWordEmbedding)
+    monkeypatch.setattr(pipeline, "SimilarTermsCache", FakeCache)
+    monkeypatch.setattr(pipeline, "_caches", {})
+
+    params = {"type": "fasttext", "model": "model.kv", "num_nearest_terms": 5, "cache": "cache.db"}
+    for _ in range(3):
+        log = {}
+        pipeline._expand_queries(["Klima Wahl", "Rente"], params, log)
+
+    assert FakeCache.opened == ["cache.db"]
+    timings = log["embedding_timings"]
+    assert timings["total_s"] == pytest.approx(timings["load_s"] + timings["batch_lookup_s"])
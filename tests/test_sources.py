@@ -0,0 +1,26 @@
+import json
+
+import pytest
+
+pytest.importorskip("elasticsearch")
+
+from pipeline.sources import TweetSource, open_source
+
+
+ATTRIBUTES = ["_id", "txt", "hashtags"]
+
+
+def test_tweet_source_is_abstract():
+    with pytest.raises(TypeError):
+        TweetSource(ATTRIBUTES)
+
+
+def test_jsonl_source_rows(tmp_path):
+    path = tmp_path / "tweets.jsonl"
+    tweets = [{"id": i, "txt": f"Tweet {i}", "hashtags": ["#Wahl"] if i % 2 else None} for i in range(5)]
+    path.write_text("".join(json.dumps(tweet) + "\n" for tweet in tweets), encoding="utf-8")
+
+    with open_source(str(path), ATTRIBUTES) as source:
+        rows = list(source.rows(size=2))
+
+    assert rows == [(tweet["id"], tweet["txt"], tweet["hashtags"]) for tweet in tweets]
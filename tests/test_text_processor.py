@@ -0,0 +1,23 @@
+import unicodedata
+
+import pytest
+
+pytest.importorskip("spacy")
+pytest.importorskip("de_core_news_lg")
+
+from pipeline.text_processor import TextProcessor
+
+
+PARAMS = {"pos_list": ["NOUN", "PROPN"], "entity_list": [], "hashtag": True, "user": True}
+
+
+def test_analyze_many_processes_original_texts():
+    processor = TextProcessor()
+    decomposed = unicodedata.normalize("NFD", "Grüße  aus\tBerlin #Klima")
+    texts = [decomposed, "Grüße aus Berlin #Klima", decomposed]
+
+    analyses = processor.analyze_many(texts, PARAMS)
+
+    # the texts share the normalized cache key, the pipeline sees the first of them as it is
+    assert analyses[0]["text"] == decomposed
+    assert analyses[1] == analyses[0] and analyses[2] == analyses[0]
@@ -0,0 +1,151 @@
+import argparse
+import os
+import re
+
+import pytest
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("elasticsearch")
+pytest.importorskip("tqdm")
+
+from scripts import tweet_feeder
+
+
+class Recorder:
+    """
+    Records the calls of the API namespaces of an Elastic Search client.
+    """
+
+    def __init__(self, calls: list, prefix: str = "", responses: dict = None) -> None:
+        self._calls = calls
+        self._prefix = prefix
+        self._responses = responses if responses is not None else {}
+
+    def __getattr__(self, name: str):
+        if name in ("indices", "cluster"):
+            return Recorder(self._calls, name + ".", self._responses)
+
+        def call(**kwargs):
+            self._calls.append((self._prefix + name, kwargs))
+            return self._responses.get(self._prefix + name, {})
+        return call
+
+    def options(self, **kwargs):
+        return self
+
+
+@pytest.mark.parametrize("wait_for_status", ["yellow", None])
+def test_finish_bulk_load_merges_before_restoring_settings(tmp_path, wait_for_status):
+    state_path = tmp_path / "bulk-load.json"
+    state_path.write_text("{}")
+
+    calls = []
+    stats = {"primaries": {"docs": {"count": 1}, "store": {"size_in_bytes": 1}}, "total": {"store": {"size_in_bytes": 1}}}
+    es = Recorder(calls, responses={"indices.stats": {"_all": stats}, "cluster.health": {"timed_out": True, "status": "yellow"}})
+    previous = {"index.refresh_interval": None, "index.number_of_replicas": "1"}
+
+    tweet_feeder.finish_bulk_load(es, "tweets", previous, str(state_path), 1, 1.0, wait_for_status=wait_for_status, wait_timeout="1m")
+
+    names = [name for name, _ in calls]
+    assert names.index("indices.refresh") < names.index("indices.forcemerge") < names.index("indices.put_settings")
+    assert calls[names.index("indices.put_settings")][1]["settings"] == previous
+
+    health = [kwargs for name, kwargs in calls if name == "cluster.health"]
+    assert health == ([{"index": "tweets", "wait_for_status": "yellow", "timeout": "1m"}] if wait_for_status else [])
+    assert not state_path.exists()
+
+
+class FakeCursor:
+    """
+    A cursor of an executed query, which returns its rows in batches.
+    """
+
+    def __init__(self, rows: list[tuple]) -> None:
+        self.rows = rows
+
+    def fetchmany(self, size: int) -> list[tuple]:
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+def test_read_delta():
+    created_at = datetime(2021, 9, 1, 12, 0)
+    text = " ".join(["Wort"] * 30)
+    # rows in the shape of the select list of the delta query
+    columns = re.search(r"SELECT (.*) FROM", tweet_feeder.compose_delta_query("tweet")).group(1).split(", ")
+    rows = [
+        (1, 2, 0, 5, created_at, text, ["#Wahl"]),
+        (2, 0, 0, 0, created_at, "zu kurz", [None]),
+        (3, 1, 1, 1, created_at, text + ", oder?", ["#Klima", "#Wahl"]),
+    ]
+    assert all(len(row) == len(columns) for row in rows)
+
+    docs = list(tweet_feeder.read_delta(FakeCursor(rows), wordcount=25, size=2))
+
+    assert [doc["_id"] for doc in docs] == [1, 3]
+    assert all(list(doc) == tweet_feeder.ATTRIBUTES for doc in docs)
+    assert [doc["word_count"] for doc in docs] == [30, 31]
+    assert docs[1]["hashtags"] == ["#Klima", "#Wahl"] and docs[1]["created_at"] == created_at
+
+
+class FakeConnection:
+    """
+    A connection to a table with the ids 1 to 100.
+    """
+
+    def cursor(self):
+        class Cursor:
+            def execute(self, query):
+                pass
+
+            def fetchone(self):
+                return 1, 100
+
+        return Cursor()
+
+
+def fake_ingest_partition(partition: int, id_range: tuple[int, int], args) -> tuple[Counter, int]:
+    if partition in args.failing:
+        raise RuntimeError(f"partition {partition} failed")
+
+    path = os.path.join(args.checkpoints, args.index, f"partition-{partition}.json")
+    tweet_feeder.write_checkpoint(path, {"range": list(id_range), "last_id": id_range[1] - 1, "docs": 25, "bytes": 100, "done": True})
+    return Counter({"wort": 25}), 25
+
+
+@pytest.fixture
+def partitioned(monkeypatch, tmp_path):
+    monkeypatch.setattr(tweet_feeder, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(tweet_feeder, "ingest_partition", fake_ingest_partition)
+    return argparse.Namespace(checkpoints=str(tmp_path), index="tweets", table="tweet", partitions=4, workers=2, failing=set())
+
+
+def test_ingest_partitioned_removes_checkpoints(partitioned):
+    vocabulary, ingested = tweet_feeder.ingest_partitioned(FakeConnection(), partitioned)
+    assert ingested == 100 and vocabulary["wort"] == 100
+    assert not os.path.exists(os.path.join(partitioned.checkpoints, "tweets"))
+
+    # the next run splits the table again instead of skipping all partitions
+    assert tweet_feeder.ingest_partitioned(FakeConnection(), partitioned)[1] == 100
+
+
+def test_ingest_partitioned_keeps_other_state(partitioned):
+    state_path = os.path.join(partitioned.checkpoints, "tweets", "bulk-load.json")
+    os.makedirs(os.path.dirname(state_path))
+    tweet_feeder.write_checkpoint(state_path, {})
+
+    tweet_feeder.ingest_partitioned(FakeConnection(), partitioned)
+    assert os.listdir(os.path.dirname(state_path)) == ["bulk-load.json"]
+
+
+def test_ingest_partitioned_keeps_checkpoints_of_failed_run(partitioned):
+    partitioned.failing = {2}
+    with pytest.raises(RuntimeError):
+        tweet_feeder.ingest_partitioned(FakeConnection(), partitioned)
+
+    names = set(os.listdir(os.path.join(partitioned.checkpoints, "tweets")))
+    assert {"partitions.json", "partition-0.json", "partition-1.json", "partition-3.json"} <= names
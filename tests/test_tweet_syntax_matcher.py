@@ -0,0 +1,37 @@
+import pytest
+
+spacy = pytest.importorskip("spacy")
+
+import pipeline.matcher.tweet_syntax_matcher
+from pipeline.tokenizer.tweet_tokenizer import TWEET_TOKEN_PATTERN, add_hashtag_pattern, separate_hashtags
+
+
+@pytest.fixture(scope="module")
+def nlp():
+    nlp = spacy.blank("de")
+    add_hashtag_pattern(nlp, TWEET_TOKEN_PATTERN)
+    nlp.add_pipe("tweet_syntax_matcher")
+    return nlp
+
+
+def flagged(doc, extension: str) -> list[str]:
+    return [token.text for token in doc if token._.get(extension)]
+
+
+@pytest.mark.parametrize("text, hashtags, users", [
+    ("RT @user: Hallo #Berlin", ["#Berlin"], ["@user"]),
+    ("Wir lieben #Berlin.", ["#Berlin"], []),
+    ("#Klima#Wahl, sagt @user_1!", ["#Klima", "#Wahl"], ["@user_1"]),
+    ("Mail an name@example.org", [], []),
+    ("Nur # und @ allein", [], []),
+])
+def test_hashtags_and_users(nlp, text, hashtags, users):
+    doc = nlp(separate_hashtags(text))
+    assert flagged(doc, "is_hashtag") == hashtags
+    assert flagged(doc, "is_user") == users
+
+
+def test_retweets_and_urls(nlp):
+    doc = nlp("RT @user: mehr unter https://example.org/artikel")
+    assert flagged(doc, "is_retweet") == ["RT"]
+    assert flagged(doc, "is_url") == ["https://example.org/artikel"]
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+spacy = pytest.importorskip("spacy")
+
+from pipeline.tokenizer.tweet_tokenizer import TWEET_TOKEN_PATTERN, add_hashtag_pattern, separate_hashtags
+
+
+def separate_hashtags_reference(text: str) -> str:
+    """
+    The intended semantics: a space is inserted before every '#' which follows some other character than a space.
+    """
+    return "".join(" #" if c == "#" and i > 0 and text[i - 1] != " " else c for i, c in enumerate(text))
+
+
+@pytest.fixture(scope="module")
+def nlp():
+    nlp = spacy.blank("de")
+    add_hashtag_pattern(nlp, TWEET_TOKEN_PATTERN)
+    return nlp
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("", ""),
+    ("#Klima", "#Klima"),
+    ("#Klima#Wahl", "#Klima #Wahl"),
+    ("#Klima #Wahl", "#Klima #Wahl"),
+    ("Wahl#2021#Klima#Rente", "Wahl #2021 #Klima #Rente"),
+    ("a##b", "a # #b"),
+    ("Zeile\n#Klima", "Zeile\n #Klima"),
+])
+def test_separate_hashtags(text, expected):
+    assert separate_hashtags(text) == expected
+
+
+def test_separate_hashtags_random():
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = "".join(rng.choices("ab #@.\n", k=rng.randint(0, 30)))
+        separated = separate_hashtags(text)
+
+        assert separated == separate_hashtags_reference(text)
+        # only spaces are inserted and applying it twice changes nothing
+        assert separated.replace(" ", "") == text.replace(" ", "")
+        assert separate_hashtags(separated) == separated
+
+
+def test_separate_hashtags_dense_text_is_linear():
+    # the former implementation rebuilt the string on every insertion
+    text = "#a" * 100000
+    assert separate_hashtags(text) == "#a" + " #a" * 99999
+
+
+@pytest.mark.parametrize("text, tokens", [
+    ("#Klima#Wahl heute", ["#Klima", "#Wahl", "heute"]),
+    ("Heute in #Berlin", ["Heute", "in", "#Berlin"]),
+    ("Danke @user_1 für", ["Danke", "@user_1", "für"]),
+    ("Die Corona-Krise #Corona", ["Die", "Corona-Krise", "#Corona"]),
+    ("RT @user: Hallo", ["RT", "@user", ":", "Hallo"]),
+    ("Wir lieben #Berlin.", ["Wir", "lieben", "#Berlin", "."]),
+    ("(#Klima, @user)", ["(", "#Klima", ",", "@user", ")"]),
+])
+def test_hashtags_and_mentions_are_single_tokens(nlp, text, tokens):
+    assert [token.text for token in nlp(separate_hashtags(text))] == tokens